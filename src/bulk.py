@@ -0,0 +1,287 @@
+import logging, sys, time, threading, csv, argparse
+
+import session_config, constants
+
+logger = logging.getLogger("bulk")
+
+# Recognized bulk CSV column headings - compared in lower case without spaces
+# or underscores - and the space attribute each one fills.  Any heading that
+# starts with "user", and every column after it, holds a user for the space.
+
+header_names = { "spaceid"      : "spaceID",
+                 "space"        : "spaceID",
+                 "label"        : "business",
+                 "business"     : "business",
+                 "businessname" : "business",
+                 "disk"         : "disk",
+                 "memory"       : "memory",
+                 "template"     : "template",
+                 "force"        : "force"
+               }
+
+# Without a heading row the columns are in the documented order.
+positional_columns = { constants.CONST_SPACE_ID : "spaceID",
+                       constants.CONST_BUSINESS : "business",
+                       constants.CONST_DISK     : "disk",
+                       constants.CONST_MEMORY   : "memory",
+                       constants.CONST_TEMPLATE : "template",
+                       constants.CONST_FORCE    : "force"
+                     }
+
+def open_csv(filename):
+    # Excel likes to start CSV files with a byte order mark - drop it.
+    return open(filename, "r", newline="", encoding="utf-8-sig")
+
+def is_data_row(cells):
+    # Skip blank and comment lines.
+    if len(cells) == 0 or all(len(cell.strip()) == 0 for cell in cells):
+        return False
+
+    return not cells[0].strip().startswith("#")
+
+def map_columns(heading):
+    # Work out which column holds which space attribute from the heading row.
+
+    columns = {}
+    users_start = None
+
+    for index, name in enumerate(heading):
+        name = name.strip().lower().replace(" ", "").replace("_", "")
+
+        if name.startswith("user"):
+            users_start = index
+            break
+
+        if name in header_names:
+            columns[index] = header_names[name]
+
+    if "spaceID" not in columns.values():
+        return None, None
+
+    return columns, users_start
+
+def count_rows(filename, skip=1):
+    # A quick streaming pass so progress can show an ETA - exactly the rows
+    # read_space_rows hands out.
+    return sum(1 for row in read_space_rows(filename, skip, warn=False))
+
+def read_space_rows(filename, skip=1, bulk_args=None, warn=True):
+    """Stream the spaces from a bulk CSV file.
+
+    Each row is returned as the same arguments "spaces create" would
+    receive, plus the number of the row: the CSV record number, counting
+    the skipped lines - a quoted value may span several lines of the
+    file, but it is still one record.  Values from the bulk
+    command line (--force, --template) are applied to every row.  Set
+    warn to False for extra passes over the file (e.g., planning) so
+    problem rows are only reported once.
+    """
+
+    force_all = getattr(bulk_args, "force", False)
+    cli = getattr(bulk_args, "cli", False)
+    default_template = getattr(bulk_args, "template", None)
+
+    columns = positional_columns
+    users_start = constants.CONST_USERS
+
+    with open_csv(filename) as csv_file:
+        reader = csv.reader(csv_file)
+
+        for record, cells in enumerate(reader, start=1):
+            # The last of the skipped lines is the heading row.
+            if record <= skip:
+                if record == skip:
+                    heading_columns, heading_users = map_columns(cells)
+
+                    if heading_columns is not None:
+                        columns, users_start = heading_columns, heading_users
+                    elif warn:
+                        logger.warning(f"read_space_rows: heading in {filename} not recognized - using column positions.")
+
+                continue
+
+            if not is_data_row(cells):
+                continue
+
+            row = argparse.Namespace(line=record, spaceID=None, business=None, disk=None, memory=None, 
+                                     template=None, force=False, query=False, users=[], cli=cli)
+
+            for index, attribute in columns.items():
+                if index < len(cells) and len(cells[index].strip()) > 0:
+                    setattr(row, attribute, cells[index].strip())
+
+            # Never pass a row without a space id along - a delete would match every space.
+            if row.spaceID is None:
+                if warn:
+                    logger.warning(f"read_space_rows: row {record} in {filename} has no space id - skipped.")
+
+                continue
+
+            # Note: the command line overrides the force flag of individual spaces.
+            row.force = force_all or (isinstance(row.force, str) and row.force.lower() == "true")
+
+            # A template in the CSV wins over the command line template.
+            if row.template is None:
+                row.template = default_template
+
+            if users_start is not None:
+                row.users = [ cell.strip() for cell in cells[users_start:] if len(cell.strip()) > 0 ]
+
+            yield row
+
+class Throttle:
+    # Spread the start of rows so a bulk run never sends more than "rate"
+    # rows per second to the tenant - no matter how many workers there are.
+
+    def __init__(self, rate=None):
+        self.interval = 0 if rate is None or rate <= 0 else 1 / rate
+        self.next_start = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.interval == 0:
+            return
+
+        with self.lock:
+            now = time.perf_counter()
+            start = max(now, self.next_start)
+            self.next_start = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+class Progress:
+    # Live progress for a bulk run: rows done, failures, throughput and ETA.
+
+    def __init__(self, label, total=None, output_handle=sys.stderr):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.reported = 0
+        self.output_handle = output_handle
+        self.interactive = output_handle.isatty()
+        self.lock = threading.Lock()
+
+    def update(self, ok):
+        with self.lock:
+            self.done += 1
+
+            if not ok:
+                self.failed += 1
+
+            # Refresh a terminal continuously, otherwise write a line every 10 seconds.
+            now = time.perf_counter()
+
+            if self.interactive or now - self.reported >= 10:
+                self.reported = now
+                self.report()
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.started
+        throughput = self.done / elapsed if elapsed > 0 else 0
+
+        line = f"{self.label}: {self.done}"
+
+        if self.total is not None:
+            line += f"/{self.total}"
+
+        line += f" rows - {self.failed} failed - {throughput:.1f} rows/s"
+
+        if self.total is not None and throughput > 0 and not final:
+            line += " - ETA " + time.strftime("%H:%M:%S", time.gmtime((self.total - self.done) / throughput))
+        else:
+            line += " - elapsed " + time.strftime("%H:%M:%S", time.gmtime(elapsed))
+
+        if self.interactive:
+            self.output_handle.write("\r" + line + ("\n" if final else ""))
+        else:
+            self.output_handle.write(line + "\n")
+
+        self.output_handle.flush()
+
+    def finish(self):
+        with self.lock:
+            self.report(final=True)
+
+def run(rows, action, label, parallel=1, rate=None, results_file=None, total=None, journal=None):
+    """Run the action for each bulk row on a pool of workers.
+
+    Each row must have "line" and "spaceID" attributes.  The action returns
+    True when the row succeeded.  The outcome of every row (ok/failed, HTTP
+    status, latency) is written to the results file so only the failed rows
+    need to be run again.  With a journal, rows it has as done are skipped
+    and the start and outcome of the other rows are recorded.
+    """
+
+    throttle = Throttle(rate)
+    progress = Progress(label, total)
+
+    def run_row(row):
+        key = f"{label}:{row.line}:{row.spaceID}"
+
+        if journal is not None and journal.is_done(key):
+            progress.update(True)
+            return row, None, None, 0
+
+        if journal is not None:
+            journal.record(key, "started")
+
+        throttle.wait()
+
+        session_config.dwc.clear_status()
+
+        t0 = time.perf_counter()
+
+        try:
+            ok = action(row) == True
+        except Exception as e:
+            logger.error(f"{label}: row {row.line} - space {row.spaceID} - {e}")
+            ok = False
+
+        latency = time.perf_counter() - t0
+        status = session_config.dwc.get_status()
+
+        if journal is not None:
+            journal.record(key, "ok" if ok else "failed", http_status=status)
+
+        progress.update(ok)
+
+        return row, ok, status, latency
+
+    # Size the connection pool for the workers.
+    session_config.dwc.ensure_pool(parallel)
+
+    results_handle = None
+
+    if results_file is not None:
+        results_handle = open(results_file, "w", newline="")
+        results_writer = csv.writer(results_handle)
+        results_writer.writerow([ "row", "space_id", "outcome", "http_status", "latency" ])
+
+    failed = 0
+
+    try:
+        for row, ok, status, latency in session_config.dwc.iter_concurrent(run_row, rows, parallel):
+            # Rows done by an earlier run (see journal) have no new outcome.
+            if ok is None:
+                outcome = "skipped"
+            elif ok:
+                outcome = "ok"
+            else:
+                outcome = "failed"
+                failed += 1
+
+            if results_handle is not None:
+                results_writer.writerow([ row.line, row.spaceID, outcome, status, f"{latency:.3f}" ])
+    finally:
+        if results_handle is not None:
+            results_handle.close()
+
+        progress.finish()
+
+    if failed > 0:
+        logger.warning(f"{label}: {failed} row(s) failed - see {results_file}")
+
+    return failed
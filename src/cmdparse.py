@@ -2,6 +2,9 @@ import argparse
 
 dwc_parser = None
 
+# Output styles for the "list" commands - each has a writer module (see writer.py).
+output_formats = [ 'hana', 'csv', 'json', 'text', 'parquet', 'sqlite' ]
+
 def config_parser():
     """Define the parsers for ALL possible command lines"""
 
@@ -14,6 +17,14 @@ def config_parser():
 
     dwc_parser.add_argument("-l", "--logging",  help="set the global logging level, default=none", choices=['none', 'info', 'debug', 'warn', 'error'])
     dwc_parser.add_argument("-c", "--config",   help="provisioning tool config file (default=config.json")
+    dwc_parser.add_argument("--relogin",        help="ignore any saved session and login again", default=False, action="store_true")
+    dwc_parser.add_argument("--retries",        help="retries for busy or unavailable tenant responses (default=5)", default=5, type=int)
+    dwc_parser.add_argument("--cache-ttl",      help="seconds to reuse cached list responses (default=per endpoint)", type=int)
+    dwc_parser.add_argument("--no-cache",       help="always query the tenant, never use cached list responses", default=False, action="store_true")
+    dwc_parser.add_argument("--metrics",        help="print calls, bytes and latency per endpoint at the end of the run", default=False, action="store_true")
+    dwc_parser.add_argument("--metrics-file",   help="write the per-endpoint metrics to a JSON file")
+    dwc_parser.add_argument("--daemon",         help="run the command in the running \"serve\" process", default=False, action="store_true")
+    dwc_parser.add_argument("--socket",         help="socket file of the \"serve\" process (default=src/working/provisioner.sock)")
 
     # Start the parser for all commands.    
     global_subparsers = dwc_parser.add_subparsers(help='dwc provisioning tool commands', dest="command")
@@ -35,15 +46,31 @@ def config_parser():
     
     # Script command - only takes a file name
     script_parser = global_subparsers.add_parser('script', help='Execute a series of commands from a script file')
-    script_parser.add_argument('filename', help='script file name')
+    script_parser.add_argument("-P", "--parallel", help="number of independent commands to run at the same time (default=1)", default=1, type=int)
+    script_parser.add_argument("-j", "--journal",  help="record the progress of the run in a new journal file")
+    script_parser.add_argument("--resume",         help="continue the run recorded in a journal file - done work is skipped")
+    script_parser.add_argument('filename',         help='script file name')
         
+    # Serve command - keep the session logged in and run commands sent with --daemon
+    serve_parser = global_subparsers.add_parser('serve', help='Keep a logged in session and run the commands sent with --daemon')
+    serve_parser.add_argument("--refresh", help="seconds to keep the space and user lists between commands (default=60)", default=60, type=int)
+
+    # Plan/apply commands - compare (and update) the tenant with a desired state file
+    plan_parser = global_subparsers.add_parser('plan', help='Show the changes needed to make the tenant match a desired state file')
+    plan_parser.add_argument("filename", help="desired state file (JSON or YAML)")
+
+    apply_parser = global_subparsers.add_parser('apply', help='Make the tenant match a desired state file')
+    apply_parser.add_argument("-w", "--workers", help="number of spaces to change at the same time (default=1)", default=1, type=int)
+    apply_parser.add_argument("filename",        help="desired state file (JSON or YAML)")
+
     # Users commands: list (only right now)
     user_parser = global_subparsers.add_parser('users', help='Create, delete and list DWC users')
     user_subparsers = user_parser.add_subparsers(help="users command", dest="subcommand")
 
     user_list_parser = user_subparsers.add_parser('list', help='Space member list command')
     user_list_parser.add_argument("-d", "--directory", help="directory for output files")
-    user_list_parser.add_argument("-f", "--format",    help="output style", default="text", choices=['hana', 'csv', 'json', 'text'])
+    user_list_parser.add_argument("-f", "--format",    help="output style", default="text", choices=output_formats)
+    user_list_parser.add_argument("--hana-mode",  help="hana output: replace the tables or upsert into them (default=replace)", default="replace", choices=['replace', 'upsert'])
     user_list_parser.add_argument("-p", "--prefix",    help="output prefix for writing", default="DWC_USERS")
     user_list_parser.add_argument("-q", "--query",     help="seach expansion of user names", default=False, action="store_true")
     user_list_parser.add_argument('users',             help='list of user patterns', nargs=argparse.REMAINDER)
@@ -54,12 +81,14 @@ def config_parser():
 
     # Spaces LIST options
     space_list_parser = space_subparsers.add_parser('list', help='spaces list command')
-    space_list_parser.add_argument("-f", "--format",    help="output style", default="text", choices=['hana', 'csv', 'json', 'text'])
+    space_list_parser.add_argument("-f", "--format",    help="output style", default="text", choices=output_formats)
+    space_list_parser.add_argument("--hana-mode",  help="hana output: replace the tables or upsert into them (default=replace)", default="replace", choices=['replace', 'upsert'])
     space_list_parser.add_argument("-p", "--prefix",    help="prefix for output", default="DWC_SPACES")
     space_list_parser.add_argument("-q", "--query",     help="seach expansion of space names", default=False, action="store_true")
     space_list_parser.add_argument("-e", "--extend",    help="extend search to include remote tables and schema objects (slower)", default=False, action="store_true")
     space_list_parser.add_argument("-a", "--add",       help="add user and redeploy the space to query builder objects", default=False, action="store_true")
     space_list_parser.add_argument("-d", "--directory", help="directory for output files")
+    space_list_parser.add_argument("-w", "--workers",   help="number of spaces to query at the same time (default=1)", default=1, type=int)
     space_list_parser.add_argument("spaceID",           help="space id(s) to list", nargs=argparse.REMAINDER)
 
     # Spaces CREATE options
@@ -70,11 +99,13 @@ def config_parser():
     space_create_parser.add_argument("-m", "--memory",   help="memory allocated to space")
     space_create_parser.add_argument("-f", "--force",    help="force the re-creation if space exists", default=False, action="store_true")
     space_create_parser.add_argument("-q", "--query",    help="seach expansion of user names", default=False, action="store_true")
+    space_create_parser.add_argument("--cli",            help="create the space with the dwc command line tool", default=False, action="store_true")
     space_create_parser.add_argument("spaceID",          help="space ID to create")
     space_create_parser.add_argument("users",            help="users to add to the space", nargs=argparse.REMAINDER)
 
     # Spaces DELETE options
     space_delete_parser = space_subparsers.add_parser('delete', help='Delete one or more spaces.')
+    space_delete_parser.add_argument("--cli",   help="delete the space(s) with the dwc command line tool", default=False, action="store_true")
     space_delete_parser.add_argument("spaceID", help="space id(s) to delete", nargs=argparse.REMAINDER)
 
     # Spaces BULK options
@@ -85,10 +116,22 @@ def config_parser():
     space_bulk_create_parser.add_argument("-s", "--skip",     help="header lines to skip in the CSV file (default=1)", default="1")
     space_bulk_create_parser.add_argument("-f", "--force",    help="force the re-creation if space exists", action="store_true")
     space_bulk_create_parser.add_argument("-t", "--template", help="Space id to use as a template if not specified per space")
+    space_bulk_create_parser.add_argument("-P", "--parallel", help="number of rows to process at the same time (default=1)", default=1, type=int)
+    space_bulk_create_parser.add_argument("-r", "--rate",     help="maximum rows started per second against the tenant", type=float)
+    space_bulk_create_parser.add_argument("-o", "--results",  help="per-row outcome file (default=<filename>.results.csv)")
+    space_bulk_create_parser.add_argument("-j", "--journal",  help="record the progress of the run in a new journal file")
+    space_bulk_create_parser.add_argument("--resume",         help="continue the run recorded in a journal file - done work is skipped")
+    space_bulk_create_parser.add_argument("--cli",            help="create the spaces with the dwc command line tool", default=False, action="store_true")
     space_bulk_create_parser.add_argument("filename",         help="CSV file containing spaces to create")
 
     space_bulk_delete_parser = space_bulk_subparsers.add_parser('delete', help='Space bulk delete command')
     space_bulk_delete_parser.add_argument("-s", "--skip", help="header lines to skip in the CSV file", default="1")
+    space_bulk_delete_parser.add_argument("-P", "--parallel", help="number of rows to process at the same time (default=1)", default=1, type=int)
+    space_bulk_delete_parser.add_argument("-r", "--rate",     help="maximum rows started per second against the tenant", type=float)
+    space_bulk_delete_parser.add_argument("-o", "--results",  help="per-row outcome file (default=<filename>.results.csv)")
+    space_bulk_delete_parser.add_argument("-j", "--journal",  help="record the progress of the run in a new journal file")
+    space_bulk_delete_parser.add_argument("--resume",         help="continue the run recorded in a journal file - done work is skipped")
+    space_bulk_delete_parser.add_argument("--cli",            help="delete the spaces with the dwc command line tool", default=False, action="store_true")
     space_bulk_delete_parser.add_argument("filename",     help="CSV file containing space names to delete")
 
     # Space MEMBER options
@@ -97,7 +140,8 @@ def config_parser():
 
     space_member_list_parser = space_member_subparsers.add_parser('list', help='Space member list command')
     space_member_list_parser.add_argument("-q", "--query",     help="use search lookup for space name and users", default=False, action="store_true")
-    space_member_list_parser.add_argument("-f", "--format",    help="output style", default="text", choices=['hana', 'csv', 'json', 'text'])
+    space_member_list_parser.add_argument("-f", "--format",    help="output style", default="text", choices=output_formats)
+    space_member_list_parser.add_argument("--hana-mode",  help="hana output: replace the tables or upsert into them (default=replace)", default="replace", choices=['replace', 'upsert'])
     space_member_list_parser.add_argument("-p", "--prefix",    help="output style", default="DWC_MEMBERS")
     space_member_list_parser.add_argument("-d", "--directory", help="directory for output files")
     space_member_list_parser.add_argument("spaceID",           help="search pattern for spaces", nargs=argparse.REMAINDER)
@@ -109,7 +153,7 @@ def config_parser():
 
     space_member_remove_parser = space_member_subparsers.add_parser('remove', help='Space member remove command')
     space_member_remove_parser.add_argument("-q", "--query", help="Use search lookup for space name and users", default=False, action="store_true")
-    space_member_remove_parser.add_argument("spaceName",        help="search pattern for spaces to remove user")
+    space_member_remove_parser.add_argument("spaceID",          help="search pattern for spaces to remove user")
     space_member_remove_parser.add_argument("user",             help="user list (patterns) to remove", nargs=argparse.REMAINDER)
 
     # Start the CONNECTIONS command
@@ -119,7 +163,8 @@ def config_parser():
     conn_list_parser = conn_subparsers.add_parser('list', help='Connection list command')
     conn_list_parser.add_argument("-q", "--query",      help="search space names (default=false)", action="store_true")
     conn_list_parser.add_argument("-c", "--connection", help="connection name to list from space")
-    conn_list_parser.add_argument("-f", "--format",     help="output style", default="text", choices=['hana', 'csv', 'json', 'text'])
+    conn_list_parser.add_argument("-f", "--format",     help="output style", default="text", choices=output_formats)
+    conn_list_parser.add_argument("--hana-mode",   help="hana output: replace the tables or upsert into them (default=replace)", default="replace", choices=['replace', 'upsert'])
     conn_list_parser.add_argument("-p", "--prefix",     help="output prefix, default=DWC_CONNECTIONS", default="DWC_CONNECTIONS")
     conn_list_parser.add_argument("-d", "--directory",  help="directory for output files")
     conn_list_parser.add_argument("spaceID",            help="space(s) to list connections", nargs=argparse.REMAINDER)
@@ -141,11 +186,13 @@ def config_parser():
 
     share_list_parser = share_subparsers.add_parser('list', help='shares create command help')
     share_list_parser.add_argument("-q", "--query",       help="Use search lookup for space name, object, or target (default=false)", action="store_true")
-    share_list_parser.add_argument("-f", "--format",       help="output style", default="text", choices=['hana', 'csv', 'json', 'text'])
+    share_list_parser.add_argument("-f", "--format",       help="output style", default="text", choices=output_formats)
+    share_list_parser.add_argument("--hana-mode",     help="hana output: replace the tables or upsert into them (default=replace)", default="replace", choices=['replace', 'upsert'])
     share_list_parser.add_argument("-p", "--prefix",       help="output prefix", default="DWC_SHARES")
     share_list_parser.add_argument("-d", "--directory",    help="directory for output files")
     share_list_parser.add_argument("-s", "--sourceSpace",  help="source space with object to share")
     share_list_parser.add_argument("-b", "--sourceObject", help="source object technical name to share")
+    share_list_parser.add_argument("-w", "--workers",      help="number of share requests to run at the same time (default=1)", default=1, type=int)
     share_list_parser.add_argument("-t", "--targetSpace",  help="target space(s) getting the share", nargs=argparse.REMAINDER)
 
     share_create_parser = share_subparsers.add_parser('create', help='shares create command help')
@@ -157,6 +204,17 @@ def config_parser():
     # share_list_parser = share_subparsers.add_parser('list', help='shares list command help')
     # share_unshare_parser = share_subparsers.add_parser('unshare', help='shares unshare command help')
 
+def is_read_only(args):
+    """Does the command only read from the tenant?"""
+
+    if args.command == "spaces" and args.subcommand == "member":
+        return args.member_subcommand == "list"
+
+    if args.command == "spaces" and args.subcommand == "list":
+        return not args.add
+
+    return args.command in [ "users", "connections", "shares" ] and args.subcommand == "list"
+
 def parse(args):
     if dwc_parser is None:
         config_parser()
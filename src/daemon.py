@@ -0,0 +1,301 @@
+import logging, os, sys, io, json, time, socket, traceback
+from pathlib import Path
+
+# Keep this module light - the client side runs before any of the heavy
+# modules (requests, bs4) are imported.
+
+import metrics
+
+logger = logging.getLogger("daemon")
+
+# The socket lives next to the other working files unless --socket says otherwise.
+socket_file = os.path.join(Path(__file__).parent.absolute(), "working", "provisioner.sock")
+
+def get_socket_file(args):
+    return socket_file if args.socket is None else args.socket
+
+def is_available():
+    return hasattr(socket, "AF_UNIX")
+
+def send_message(connection, message):
+    connection.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+def read_messages(connection):
+    # Messages are single lines of JSON.
+    with connection.makefile("r", encoding="utf-8") as messages:
+        for line in messages:
+            yield json.loads(line)
+
+def forward(argv, filename):
+    """Run a command in the "provisioner serve" process.
+
+    Sends the command line and working directory to the daemon and
+    writes its output and log messages as they arrive.  Returns the exit
+    code of the command, or None when there is no daemon to talk to.
+    """
+
+    if not is_available() or not os.path.exists(filename):
+        return None
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(filename)
+    except OSError as e:
+        logger.debug(f"forward: daemon not reachable on {filename} - {e}")
+        connection.close()
+        return None
+
+    with connection:
+        send_message(connection, { "argv" : argv, "cwd" : os.getcwd() })
+
+        for message in read_messages(connection):
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+            elif "exit" in message:
+                sys.stdout.flush()
+                return message["exit"]
+
+    # The daemon went away in the middle of the command.
+    logger.error("forward: connection to the daemon lost.")
+
+    return 1
+
+class SocketStream(io.TextIOBase):
+    # Sends everything written to it back to the client as one of the
+    # output streams.
+
+    def __init__(self, connection, stream):
+        self.connection = connection
+        self.stream = stream
+
+    def write(self, text):
+        if len(text) > 0:
+            try:
+                send_message(self.connection, { self.stream : text })
+            except OSError:
+                pass  # The client went away - finish the command anyway.
+
+        return len(text)
+
+    def isatty(self):
+        return False
+
+class DaemonState:
+    # Keeps the logged in session healthy between commands.
+
+    def __init__(self, dwc, refresh, retries, log_level, check_interval=300):
+        self.dwc = dwc
+        self.refresh = refresh
+        self.retries = retries
+        self.log_level = log_level
+        self.check_interval = check_interval
+        self.checked = time.time()
+        self.loaded = time.time()
+
+    def before_command(self):
+        now = time.time()
+
+        # Lists may have changed in the tenant behind our back - don't
+        # keep them longer than the refresh interval.
+        if now - self.loaded > self.refresh:
+            self.dwc.reset_caches()
+            self.loaded = now
+
+        # The tenant expires idle sessions - check now and then and log in
+        # again if needed.
+        if now - self.checked > self.check_interval:
+            self.checked = now
+
+            if not self.dwc.validate_session():
+                logger.info("before_command: session expired - logging in again.")
+                self.dwc.connect(reuse=False)
+
+# Log levels for the global --logging option.
+log_levels = { "none"  : logging.NOTSET,
+               "info"  : logging.INFO,
+               "debug" : logging.DEBUG,
+               "warn"  : logging.WARNING,
+               "error" : logging.ERROR }
+
+class RequestOptions:
+    # Applies the global options of a client's command line to the
+    # daemon's session for one command, and puts the daemon's own
+    # settings back afterwards.
+
+    def __init__(self, args, state, session_config, cmdparse, commands):
+        self.args = args
+        self.state = state
+        self.session_config = session_config
+        self.read_only = all(cmdparse.is_read_only(command_args) for command_args in commands)
+        self.response_cache = None
+
+    def apply(self):
+        args = self.args
+        dwc = self.state.dwc
+
+        dwc.set_retries(args.retries)
+
+        if args.logging is not None:
+            self.session_config.log_level = log_levels[args.logging]
+            dwc.setLevel(self.session_config.log_level)
+
+        # The cache options work like they do in a process of their own -
+        # --no-cache starts from live data, --cache-ttl lets a report reuse
+        # answers from earlier runs.
+        self.response_cache = dwc.response_cache
+
+        if args.no_cache:
+            dwc.reset_caches()
+            dwc.response_cache = None
+        elif args.cache_ttl is not None and self.read_only:
+            dwc.enable_cache(args.cache_ttl)
+
+        if args.relogin:
+            dwc.connect(reuse=False)
+
+        # Every command is measured on its own - the daemon runs for a long
+        # time and would otherwise keep every latency it ever recorded.
+        metrics.reset()
+
+    def restore(self):
+        dwc = self.state.dwc
+
+        dwc.set_retries(self.state.retries)
+
+        self.session_config.log_level = self.state.log_level
+        dwc.setLevel(self.state.log_level)
+
+        dwc.response_cache = self.response_cache
+
+    def report(self, stdout):
+        if self.args.metrics:
+            metrics.write_table(stdout)
+
+        if self.args.metrics_file is not None:
+            metrics.write_json(self.args.metrics_file)
+
+def serve(args):
+    """Serve commands from clients over a Unix domain socket.
+
+    The logged in session and its caches stay alive between commands.
+    Commands are run one at a time, in the order they arrive.
+    """
+
+    import session_config, cmdparse, executor
+
+    if not is_available():
+        logger.error("serve: Unix domain sockets are not available on this platform.")
+        return
+
+    filename = get_socket_file(args)
+
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+
+    if os.path.exists(filename):
+        os.remove(filename)  # Left over from a daemon that didn't clean up.
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    # The socket gives full access to the logged in session - owner only,
+    # from the moment it is created.
+    saved_umask = os.umask(0o177)
+
+    try:
+        server.bind(filename)
+    finally:
+        os.umask(saved_umask)
+
+    os.chmod(filename, 0o600)
+
+    server.listen()
+
+    state = DaemonState(session_config.dwc, args.refresh, args.retries, session_config.log_level)
+
+    logger.info(f"serve: listening on {filename}")
+
+    try:
+        while True:
+            connection, address = server.accept()
+
+            with connection:
+                try:
+                    handle(connection, state, session_config, cmdparse, executor)
+                except Exception as e:
+                    logger.error(f"serve: request failed - {e}")
+    except KeyboardInterrupt:
+        logger.info("serve: stopped.")
+    finally:
+        server.close()
+
+        if os.path.exists(filename):
+            os.remove(filename)
+
+def handle(connection, state, session_config, cmdparse, executor):
+    request = next(read_messages(connection))
+
+    stdout = SocketStream(connection, "stdout")
+    stderr = SocketStream(connection, "stderr")
+
+    # Log messages for this command go back to the client too.
+    log_handler = logging.StreamHandler(stderr)
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s : %(message)s"))
+
+    saved_stdout, saved_stderr, saved_cwd = sys.stdout, sys.stderr, os.getcwd()
+
+    exit_code = 0
+
+    sys.stdout, sys.stderr = stdout, stderr
+    logging.getLogger().addHandler(log_handler)
+
+    try:
+        # File names on the command line are relative to the client.
+        os.chdir(request["cwd"])
+
+        args = cmdparse.parse(request["argv"])
+
+        if args.command in [ "config", "serve" ]:
+            logger.error(f"handle: {args.command} can't be run by the daemon.")
+            exit_code = 1
+        elif args.config is not None:
+            # The daemon is logged in to the tenant of its own configuration.
+            logger.error("handle: --config can't be used with --daemon - start \"serve\" with that configuration instead.")
+            exit_code = 1
+        else:
+            commands = executor.build_commands(args)
+
+            if commands is None:
+                exit_code = 1
+            else:
+                state.before_command()
+
+                options = RequestOptions(args, state, session_config, cmdparse, commands)
+                options.apply()
+
+                try:
+                    executor.run(args, commands)
+                finally:
+                    options.restore()
+
+                options.report(stdout)
+
+                # Our own changes make the cached lists stale.
+                if not options.read_only:
+                    session_config.dwc.reset_caches()
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        stderr.write(traceback.format_exc())
+        exit_code = 1
+    finally:
+        logging.getLogger().removeHandler(log_handler)
+        sys.stdout, sys.stderr = saved_stdout, saved_stderr
+        os.chdir(saved_cwd)
+
+    try:
+        send_message(connection, { "exit" : exit_code })
+    except OSError:
+        pass
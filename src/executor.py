@@ -0,0 +1,365 @@
+import logging, os, sys, io, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import session_config, cmdparse, journal
+import connections, spaces, shares, users, plan
+
+logger = logging.getLogger("executor")
+
+def run_command(command_args):
+    """Run a single parsed command against the logged in session."""
+
+    if command_args.command == "spaces":
+        spaces.process(command_args)
+    elif command_args.command == "connections":
+        connections.process(command_args)
+    elif command_args.command == "users":
+        users.process(command_args)
+    elif command_args.command == "shares":
+        shares.process(command_args)
+    elif command_args.command in [ "plan", "apply" ]:
+        plan.process(command_args)
+
+def run_journaled(command_args, journal=None):
+    # Run a command, recording its start and outcome in the journal.  A
+    # command the journal already has as done is skipped.
+
+    key = getattr(command_args, "journal_key", None)
+
+    if journal is None or key is None:
+        run_command(command_args)
+        return
+
+    if journal.is_done(key):
+        logger.info(f"run_journaled: {key} - already done, skipped.")
+        return
+
+    journal.record(key, "started")
+
+    session_config.dwc.clear_status()
+
+    try:
+        run_command(command_args)
+    except Exception as e:
+        journal.record(key, "failed", error=str(e))
+        raise
+
+    # Commands report their problems in the log - a failed request during
+    # the command means it has to be run again.
+    status = session_config.dwc.get_status()
+
+    journal.record(key, "failed" if status is not None and status >= 400 else "ok", http_status=status)
+
+def build_commands(args):
+    """Build the list of commands to run from the parsed command line.
+
+    For the "script" command, the commands come from the script file -
+    reading stops at an "exit" line and "config" commands are skipped.
+    Returns None when the script can't be found.
+    """
+
+    if args.command != 'script':
+        return [ args ]
+
+    if not os.path.exists(args.filename):
+        logger.fatal("Script {} not found.".format(args.filename))
+        return None
+
+    commands = []  # We love lists to loop over.
+
+    with open(args.filename, "r") as script:
+        commandScript = script.readlines()
+
+    # Append them to the list of commands after parsing their arguments
+    for line, command in enumerate(commandScript, start=1):
+        script_args = command.strip()
+
+        # Only process non-blank and non-comment lines in the file.
+        if len(script_args) == 0 or script_args[0] == "#":   
+            continue
+        
+        # If we see "exit" we are done with this script.
+        if script_args.startswith("exit"):
+            break
+        
+        # Invalid script commands - skip.    
+        if script_args.startswith("config") or script_args.startswith("serve"):
+            logger.warning(f"{script_args.split(' ')[0]} commands are not permitted in script files - skipped")
+            continue
+        
+        logger.debug("..script cmd: {}".format(script_args))
+
+        # Add this command to the list we will process later.  Go ahead
+        # and parse the commands to verify the arguments.
+        command_args = cmdparse.parse(script_args.split(" "))
+
+        # The line and text identify the command in a journal of the run.
+        command_args.journal_key = f"{line}:{script_args}"
+
+        commands.append(command_args)
+
+    # Member changes to the same spaces are merged so each space is read
+    # and written once.
+    return spaces.coalesce_members(commands)
+
+def run(args, commands):
+    """Run the commands built for the parsed command line.
+
+    A script may run its commands in parallel and record them in a
+    journal so an interrupted run can be resumed.
+    """
+
+    if args.command != "script":
+        run_commands(commands)
+        return
+
+    script_journal = journal.open_journal(args)
+
+    try:
+        run_commands(commands, args.parallel, script_journal)
+    finally:
+        if script_journal is not None:
+            script_journal.close()
+
+def run_commands(commands, parallel=1, journal=None):
+    """Run the commands from the command line or a script.
+
+    With parallel=1 the commands run one after the other, just as they
+    appear.  Otherwise, commands that don't depend on each other run at
+    the same time - see get_resources for how dependencies are found.
+    Either way the output appears in the same order as the commands.
+    With a journal, commands it has as done are skipped and the others
+    are recorded as they start and finish.
+    """
+
+    # Nothing after an "exit" runs.
+    for index, command_args in enumerate(commands):
+        if command_args.command == "exit":
+            commands = commands[:index]
+            break
+
+    if parallel <= 1 or len(commands) <= 1:
+        for command_args in commands:
+            # Space definitions are only reused within a single command.
+            session_config.dwc.clear_memo()
+
+            run_journaled(command_args, journal)
+    else:
+        run_parallel(commands, parallel, journal)
+
+def get_spaces(names, query=False):
+    # A search pattern, or no names at all, can touch any space.
+
+    if names is None or query:
+        return { "space:*" }
+
+    if isinstance(names, str):
+        names = [ names ]
+
+    if len(names) == 0:
+        return { "space:*" }
+
+    return { "space:" + name.upper() for name in names }
+
+def get_resources(command_args):
+    """Work out what a command reads and what it changes.
+
+    Resources are "space:NAME" for a single space, "space:*" for any
+    space (searches, lists of all spaces, bulk files), "users" for the
+    user directory and "*" for everything.  Returns (reads, writes).
+    """
+
+    command = command_args.command
+    subcommand = getattr(command_args, "subcommand", None)
+    query = getattr(command_args, "query", False)
+
+    if command == "users" and subcommand == "list":
+        return { "users" }, set()
+
+    if command == "spaces":
+        if subcommand == "list":
+            if cmdparse.is_read_only(command_args):
+                return get_spaces(command_args.spaceID, query) | { "users" }, set()
+
+            return set(), { "space:*" }
+
+        if subcommand == "create":
+            reads = { "users" }
+
+            if command_args.template is not None:
+                reads |= get_spaces(command_args.template)
+
+            return reads, get_spaces(command_args.spaceID)
+
+        if subcommand == "delete":
+            return set(), get_spaces(command_args.spaceID)
+
+        if subcommand == "bulk":
+            # We don't know which spaces are in the file.
+            return { "users" }, { "space:*" }
+
+        if subcommand == "member":
+            member_subcommand = command_args.member_subcommand
+
+            if member_subcommand == "list":
+                return get_spaces(command_args.spaceID, query) | { "users" }, set()
+
+            if member_subcommand in [ "add", "remove" ]:
+                return { "users" }, get_spaces(command_args.spaceID)
+
+            if member_subcommand == "batch":
+                return { "users" }, set().union(*[ get_spaces(batch_args.spaceID) for batch_args in command_args.batch ])
+
+    if command == "connections":
+        if subcommand == "list":
+            return get_spaces(command_args.spaceID, query), set()
+
+        # Create always matches the target as a pattern (see
+        # connections_create), delete takes the names as they are.
+        if subcommand == "create":
+            return set(), get_spaces(command_args.targetSpace, True)
+
+        if subcommand == "delete":
+            return set(), get_spaces(command_args.targetSpace)
+
+    if command == "shares":
+        if subcommand == "list":
+            return get_spaces(command_args.sourceSpace, query) | get_spaces(command_args.targetSpace, query), set()
+
+        if subcommand == "create":
+            return set(), get_spaces(command_args.sourceSpace) | get_spaces(command_args.targetSpace, query)
+
+    if command == "plan":
+        return { "space:*", "users" }, set()
+
+    if command == "apply":
+        return { "users" }, { "space:*" }
+
+    # Anything we don't know about waits for everything before it, and
+    # everything after it waits for it.
+    return set(), { "*" }
+
+def is_overlap(resources, other_resources):
+    for resource in resources:
+        for other_resource in other_resources:
+            if resource == other_resource or resource == "*" or other_resource == "*":
+                return True
+
+            if resource.startswith("space:") and other_resource.startswith("space:") and \
+               (resource == "space:*" or other_resource == "space:*"):
+                return True
+
+    return False
+
+def is_dependent(command_resources, earlier_resources):
+    # Reads can share - a change has to wait for anyone reading or changing
+    # the same thing, and a read has to wait for an earlier change.
+
+    reads, writes = command_resources
+    earlier_reads, earlier_writes = earlier_resources
+
+    return is_overlap(writes, earlier_reads | earlier_writes) or is_overlap(reads, earlier_writes)
+
+class ScriptOutput:
+    # Stands in for sys.stdout while commands run in parallel.  Each running
+    # command writes to its own buffer so the output can be shown in script
+    # order - anything else goes straight to the real stdout.
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+
+        if buffer is None:
+            return self.stdout.write(text)
+
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stdout.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+def run_parallel(commands, parallel, journal=None):
+    resources = [ get_resources(command_args) for command_args in commands ]
+
+    # Every command waits for the earlier commands it depends on.
+    depends_on = [ [ earlier for earlier in range(index) if is_dependent(resources[index], resources[earlier]) ]
+                   for index in range(len(commands)) ]
+
+    logger.debug(f"run_parallel: {len(commands)} command(s), dependencies {depends_on}")
+
+    dwc = session_config.dwc
+
+    # Start with fresh space definitions - after this, changes made by the
+    # commands themselves keep the shared definitions up to date.
+    dwc.clear_memo()
+
+    # Size the connection pool for all the workers up front - commands
+    # asking for fewer workers won't shrink it under the others.
+    dwc.ensure_pool(max([ parallel ] + [ getattr(command_args, "workers", 1) * parallel for command_args in commands ]))
+
+    output = ScriptOutput(sys.stdout)
+    outputs = {}
+
+    def run_buffered(index):
+        output.local.buffer = io.StringIO()
+
+        try:
+            run_journaled(commands[index], journal)
+        finally:
+            outputs[index] = output.local.buffer.getvalue()
+            output.local.buffer = None
+
+    done = set()
+    running = {}
+    waiting = list(range(len(commands)))
+    next_output = 0
+    error = None
+
+    sys.stdout = output
+
+    try:
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            while len(running) > 0 or (len(waiting) > 0 and error is None):
+                # Start every command whose dependencies have finished.
+                if error is None:
+                    for index in list(waiting):
+                        if len(running) >= parallel:
+                            break
+
+                        if all(earlier in done for earlier in depends_on[index]):
+                            waiting.remove(index)
+                            running[executor.submit(run_buffered, index)] = index
+
+                finished, still_running = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    index = running.pop(future)
+
+                    # Like a sequential run, a failing command stops the script - the
+                    # commands already running are allowed to finish.
+                    if future.exception() is not None and error is None:
+                        error = future.exception()
+
+                    done.add(index)
+
+                # Show the output of the finished commands in script order.
+                while next_output in outputs:
+                    output.stdout.write(outputs.pop(next_output))
+                    next_output += 1
+    finally:
+        # After a failure, the commands that never started leave gaps -
+        # the output of the commands that did run still appears, in
+        # script order.
+        for index in sorted(outputs):
+            output.stdout.write(outputs.pop(index))
+
+        sys.stdout = output.stdout
+
+    if error is not None:
+        raise error
@@ -0,0 +1,82 @@
+import logging, os, json, time, threading
+
+logger = logging.getLogger("journal")
+
+class Journal:
+    """Append-only record of the work done by a script or bulk run.
+
+    Every command (or bulk row) gets a "started" entry before it runs
+    and an "ok" or "failed" entry when it finishes.  Each entry is a line
+    of JSON, flushed to disk before the work continues, so the journal
+    survives the process dying at any point.  Resuming a journal skips
+    the work that finished "ok" - anything failed or still in flight
+    when the run died is done again.
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+        # Last known state of each piece of work in the journal we resume.
+        self.states = {}
+
+        if resume:
+            if os.path.exists(filename):
+                self.load()
+            else:
+                logger.warning(f"Journal: {filename} not found - starting a new journal.")
+
+        directory = os.path.dirname(filename)
+
+        if len(directory) > 0 and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # A new run starts a new journal, a resumed run adds to it.
+        self.handle = open(filename, "a" if resume else "w", encoding="utf-8")
+
+    def load(self):
+        with open(self.filename, "r", encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line may be cut short if the process died writing it.
+                    logger.debug(f"load: ignoring partial entry in {self.filename}")
+                    continue
+
+                self.states[entry["key"]] = entry["state"]
+
+        done = sum(1 for state in self.states.values() if state == "ok")
+
+        logger.info(f"load: {self.filename} - {done} of {len(self.states)} entries already done.")
+
+    def is_done(self, key):
+        return self.states.get(key) == "ok"
+
+    def record(self, key, state, **details):
+        entry = { "key" : key, "state" : state, "time" : time.strftime("%Y-%m-%dT%H:%M:%S") }
+        entry.update(details)
+
+        with self.lock:
+            self.handle.write(json.dumps(entry) + "\n")
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+
+    def close(self):
+        with self.lock:
+            self.handle.close()
+
+def open_journal(args):
+    # --resume continues an existing journal, --journal starts a new one.
+
+    resume = getattr(args, "resume", None)
+
+    if resume is not None:
+        return Journal(resume, resume=True)
+
+    filename = getattr(args, "journal", None)
+
+    if filename is not None:
+        return Journal(filename)
+
+    return None
@@ -0,0 +1,78 @@
+import logging, threading, json, math, sys
+
+logger = logging.getLogger("metrics")
+
+# Call statistics for each named endpoint (url_name) across the whole run.
+# Requests may come from many threads so all updates go through the lock.
+
+endpoints = {}
+lock = threading.Lock()
+
+def setLevel(level):
+    logger.setLevel(level)
+
+def record(url_name, status, elapsed, bytes_in=0, bytes_out=0):
+    with lock:
+        if url_name not in endpoints:
+            endpoints[url_name] = { "count" : 0, "bytes_in" : 0, "bytes_out" : 0, "statuses" : {}, "latencies" : [] }
+
+        endpoint = endpoints[url_name]
+
+        endpoint["count"] += 1
+        endpoint["bytes_in"] += bytes_in
+        endpoint["bytes_out"] += bytes_out
+        endpoint["statuses"][str(status)] = endpoint["statuses"].get(str(status), 0) + 1
+        endpoint["latencies"].append(elapsed)
+
+def reset():
+    # Start counting again - the daemon reports each command on its own.
+    with lock:
+        endpoints.clear()
+
+def percentile(values, pct):
+    # Nearest-rank percentile of an already sorted list.
+    if len(values) == 0:
+        return 0
+
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+
+    return values[rank - 1]
+
+def summary():
+    results = {}
+
+    with lock:
+        for url_name in endpoints:
+            endpoint = endpoints[url_name]
+            latencies = sorted(endpoint["latencies"])
+
+            results[url_name] = { "count"     : endpoint["count"],
+                                  "bytes_in"  : endpoint["bytes_in"],
+                                  "bytes_out" : endpoint["bytes_out"],
+                                  "statuses"  : dict(endpoint["statuses"]),
+                                  "total"     : sum(latencies),
+                                  "p50"       : percentile(latencies, 50),
+                                  "p95"       : percentile(latencies, 95),
+                                  "p99"       : percentile(latencies, 99)
+                                }
+
+    return results
+
+def write_table(output_handle=sys.stdout):
+    results = summary()
+
+    output_handle.write("{:20s} {:>7s} {:>12s} {:>10s} {:>9s} {:>9s} {:>9s} {:>9s}  {}\n".format(
+        "Endpoint", "Calls", "Bytes In", "Bytes Out", "Total s", "p50 ms", "p95 ms", "p99 ms", "Status"))
+
+    # Show the endpoints eating the most time first.
+    for url_name in sorted(results, key=lambda name: results[name]["total"], reverse=True):
+        endpoint = results[url_name]
+        statuses = ", ".join(f"{status}={count}" for status, count in sorted(endpoint["statuses"].items()))
+
+        output_handle.write("{:20s} {:7d} {:12d} {:10d} {:9.2f} {:9.1f} {:9.1f} {:9.1f}  {}\n".format(
+            url_name[:20], endpoint["count"], endpoint["bytes_in"], endpoint["bytes_out"], endpoint["total"],
+            endpoint["p50"] * 1000, endpoint["p95"] * 1000, endpoint["p99"] * 1000, statuses))
+
+def write_json(filename):
+    with open(filename, "w") as outfile:
+        outfile.write(json.dumps(summary(), indent = 4)) # With pretty print
@@ -0,0 +1,141 @@
+import logging, time, threading, collections
+
+logger = logging.getLogger("passcode_pool")
+
+class PasscodeError(Exception):
+    """No passcode could be fetched for the dwc CLI."""
+
+class PasscodePool:
+    """One-time passcodes for the dwc CLI, fetched ahead of demand.
+
+    A background thread keeps "size" unused passcodes on hand so a CLI
+    call can start right away instead of waiting for the passcode page.
+    Passcodes are only good for a few minutes - each one is dropped
+    once it is too close to expiring to get a CLI process started.
+    Refilling stops when no passcode was asked for in "idle" seconds
+    and starts again with the next request.  A caller only waits for the
+    refill thread while it is fetching and hasn't been failing - "wait"
+    seconds when nothing is being fetched.
+    """
+
+    def __init__(self, fetch, size=1, lifetime=240, margin=30, idle=120, wait=5):
+        self.fetch = fetch
+        self.size = max(1, size)
+        self.lifetime = lifetime
+        self.margin = margin
+        self.idle = idle
+        self.wait = wait
+
+        # The last time someone wanted passcodes.
+        self.used = time.time()
+
+        # Is the refill thread fetching a passcode right now, and why did
+        # its last fetch fail (None when it worked).
+        self.fetching = False
+        self.error = None
+
+        # Unused passcodes and the time each one stops being usable.
+        self.passcodes = collections.deque()
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.refill, name="passcode_pool", daemon=True)
+        self.thread.start()
+
+    def resize(self, size):
+        with self.condition:
+            self.size = max(1, size)
+            self.used = time.time()
+            self.condition.notify_all()
+
+    def drop_expired(self):
+        now = time.time()
+
+        while len(self.passcodes) > 0 and self.passcodes[0][1] <= now:
+            self.passcodes.popleft()
+            logger.debug("drop_expired: unused passcode expired.")
+
+    def is_idle(self):
+        return time.time() - self.used > self.idle
+
+    def get(self, timeout=60):
+        with self.condition:
+            self.used = time.time()
+
+            # Wake the refill thread in case it stopped while idle.
+            self.condition.notify_all()
+
+            started = time.time()
+
+            while True:
+                self.drop_expired()
+
+                if len(self.passcodes) > 0:
+                    passcode, expires = self.passcodes.popleft()
+
+                    # Let the refill thread replace it.
+                    self.condition.notify_all()
+
+                    return passcode
+
+                # Don't wait on a refill thread that keeps failing.
+                if self.error is not None:
+                    break
+
+                # A fetch in progress is worth the full timeout - otherwise
+                # the refill thread is only about to start one.
+                remaining = started + (timeout if self.fetching else self.wait) - time.time()
+
+                if remaining <= 0:
+                    break
+
+                self.condition.wait(remaining)
+
+        # The refill thread couldn't get one in time - one last try while
+        # the caller waits, so the caller gets the reason it failed.
+        logger.warning(f"get: no prefetched passcode after {time.time() - started:.0f} seconds - fetching one now.")
+
+        try:
+            return self.fetch()
+        except Exception as e:
+            raise PasscodeError(f"no passcode for the dwc CLI - {e}") from e
+
+    def refill(self):
+        while True:
+            with self.condition:
+                self.drop_expired()
+
+                # Nothing to do while the pool is full, or nobody has asked
+                # for a passcode in a while - don't keep the session busy.
+                while len(self.passcodes) >= self.size or self.is_idle():
+                    if self.is_idle():
+                        self.condition.wait()
+                    else:
+                        # Wake up when a passcode is taken or the oldest one expires.
+                        self.condition.wait(max(0.1, self.passcodes[0][1] - time.time()))
+
+                    self.drop_expired()
+
+                self.fetching = True
+
+            # Fetch outside the lock so callers can take the passcodes we already have.
+            try:
+                passcode = self.fetch()
+            except Exception as e:
+                logger.warning(f"refill: passcode request failed - {e}")
+
+                with self.condition:
+                    self.fetching = False
+                    self.error = e
+
+                    # Callers waiting for this fetch stop waiting.
+                    self.condition.notify_all()
+
+                time.sleep(5)
+                continue
+
+            with self.condition:
+                self.fetching = False
+                self.error = None
+
+                self.passcodes.append((passcode, time.time() + self.lifetime - self.margin))
+                self.condition.notify_all()
@@ -0,0 +1,464 @@
+import logging, os, sys, json, copy
+
+# YAML state files are optional - JSON always works.
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+import session_config, constants, utility
+
+logger = logging.getLogger("plan")
+
+def process(plan_args):
+    """Sub-processor for the "plan" and "apply" commands.
+
+    Both commands read a desired state file, take one snapshot of the
+    tenant and work out the smallest set of changes that makes the
+    tenant match the file.  "plan" only shows the changes, "apply"
+    also makes them.  The desired state file looks like:
+
+        { "spaces" : {
+            "SALES" : { "label"       : "Sales",
+                        "template"    : "TEMPLATE_SPACE",
+                        "disk"        : 2,
+                        "memory"      : 1,
+                        "members"     : [ "user1@company.com", "USER2" ],
+                        "connections" : [ "hana.json", { "name" : "OLD", "state" : "absent" } ],
+                        "shares"      : [ { "object" : "VIEW_1", "targets" : [ "FINANCE" ] } ]
+                      },
+            "OLD_SPACE" : { "state" : "absent" }
+          }
+        }
+
+    Only the settings named in the file are managed - e.g., a space
+    without "members" keeps its members, listed connections are
+    created (never changed), and each listed object is shared with
+    exactly the listed targets.
+    """
+
+    logger.setLevel(session_config.log_level)
+
+    utility.start_timer("plan")
+
+    desired = load_state(plan_args.filename)
+
+    if desired is None:
+        return
+
+    # Only "apply" has --workers.
+    workers = getattr(plan_args, "workers", 1)
+
+    changes = compute_plan(desired, os.path.dirname(os.path.abspath(plan_args.filename)), workers)
+
+    write_plan(changes, plan_args.filename)
+
+    if plan_args.command == "apply" and len(changes) > 0:
+        failed = apply_plan(changes, workers)
+
+        if failed > 0:
+            logger.error(f"apply: {failed} change(s) failed - run plan again to see what is left.")
+
+    logger.info(utility.log_timer("plan", f"{plan_args.command}: {len(changes)} space(s) with changes"))
+
+def load_state(filename):
+    if not os.path.exists(filename):
+        logger.error(f"load_state: file not found: {filename}")
+        return None
+
+    try:
+        with open(filename, "r") as state_file:
+            if filename.lower().endswith((".yaml", ".yml")):
+                if yaml is None:
+                    logger.error("load_state: the PyYAML package is required for YAML files - use JSON or install PyYAML.")
+                    return None
+
+                state = yaml.safe_load(state_file)
+            else:
+                state = json.load(state_file)
+    except Exception as e:
+        logger.error(f"load_state: {filename} is not valid - {e}")
+        return None
+
+    if not isinstance(state, dict) or not isinstance(state.get("spaces"), dict):
+        logger.error(f"load_state: {filename} must have a \"spaces\" object.")
+        return None
+
+    # Space IDs get the same clean-up as "spaces create" gives them.
+
+    desired = {}
+
+    for space_name, space_state in state["spaces"].items():
+        space_id = session_config.dwc.validate_space_id(space_name)
+
+        if space_id is None:
+            continue
+
+        if space_state is None:
+            space_state = {}
+
+        if not isinstance(space_state, dict):
+            logger.error(f"load_state: space {space_name} must be an object - skipped.")
+            continue
+
+        desired[space_id] = space_state
+
+    return desired
+
+def take_snapshot(desired, workers=1):
+    # Everything the plan compares against is read here, once.  Only the
+    # spaces named in the file are read in detail.
+
+    dwc = session_config.dwc
+
+    dwc.ensure_pool(workers)
+
+    # The space list and the user directory don't depend on each other.
+    dwc.map_concurrent(lambda load: load(), [ dwc.get_spaces, dwc.get_users ], 2)
+
+    existing = [ space_id for space_id in desired if space_id in dwc.spaces_by_name ]
+    present = [ space_id for space_id in existing if desired[space_id].get("state", "present") != "absent" ]
+
+    snapshot = { "existing"    : set(existing),
+                 "definitions" : {},
+                 "connections" : {},
+                 "shares"      : {},
+                 "templates"   : {}
+               }
+
+    snapshot["definitions"] = dict(zip(present, dwc.map_concurrent(dwc.get_space_definition, present, workers)))
+
+    connection_spaces = [ space_id for space_id in present if "connections" in desired[space_id] ]
+    snapshot["connections"] = dict(zip(connection_spaces, dwc.map_concurrent(dwc.get_connections, connection_spaces, workers)))
+
+    # One share search covers all the spaces.
+    share_spaces = [ space_id for space_id in present if "shares" in desired[space_id] ]
+
+    if len(share_spaces) > 0:
+        for share in dwc.get_shares(share_spaces, query=False, workers=workers):
+            snapshot["shares"].setdefault((share["spaceName"], share["objectName"]), set()).add(share["targetSpace"])
+
+    # Templates are only needed for the spaces we have to create.
+    templates = sorted(set(desired[space_id]["template"] for space_id in desired
+                           if space_id not in snapshot["existing"] and desired[space_id].get("state", "present") != "absent"
+                              and desired[space_id].get("template") is not None))
+
+    snapshot["templates"] = dict(zip(templates, dwc.map_concurrent(dwc.get_space, templates, workers)))
+
+    return snapshot
+
+def compute_plan(desired, base_directory, workers=1):
+    snapshot = take_snapshot(desired, workers)
+
+    changes = []
+
+    for space_id, space_state in desired.items():
+        state = space_state.get("state", "present")
+
+        if state not in [ "present", "absent" ]:
+            logger.error(f"compute_plan: space {space_id} - state must be present or absent - skipped.")
+            continue
+
+        change = { "space"              : space_id,
+                   "action"             : None,
+                   "definition"         : None,
+                   "details"            : [],
+                   "connections_add"    : [],
+                   "connections_delete" : [],
+                   "shares"             : []
+                 }
+
+        if state == "absent":
+            if space_id in snapshot["existing"]:
+                change["action"] = "delete"
+        else:
+            if space_id in snapshot["existing"]:
+                plan_update(change, space_state, snapshot)
+            else:
+                plan_create(change, space_state, snapshot)
+
+                # Nothing else can happen in a space we can't create.
+                if change["action"] is None:
+                    continue
+
+            plan_connections(change, space_state, snapshot, base_directory)
+            plan_shares(change, space_state, snapshot)
+
+        if change["action"] is not None or len(change["connections_add"]) > 0 or \
+           len(change["connections_delete"]) > 0 or len(change["shares"]) > 0:
+            changes.append(change)
+
+    return changes
+
+def resolve_members(space_id, members):
+    # Members are exact user names or email addresses.
+
+    user_names = []
+
+    for member in members:
+        users = session_config.dwc.get_users(member, query=False)
+
+        if len(users) == 0:
+            logger.warning(f"compute_plan: space {space_id} - user {member} not found - ignored.")
+        elif users[0]["userName"] not in user_names:
+            user_names.append(users[0]["userName"])
+
+    return user_names
+
+def plan_create(change, space_state, snapshot):
+    space_id = change["space"]
+    template = space_state.get("template")
+
+    if template is None:
+        space_definition = copy.deepcopy(constants.default_space_definition["spaceDefinition"])
+    else:
+        template_space = snapshot["templates"].get(template)
+
+        if template_space is None:
+            logger.error(f"compute_plan: space {space_id} - template space {template} not found - skipped.")
+            return
+
+        space_definition = copy.deepcopy(template_space[session_config.dwc.get_space_id(template_space)]["spaceDefinition"])
+        change["details"].append(f"template: {template}")
+
+    space_definition["label"] = session_config.dwc.validate_space_label(space_id, space_state.get("label"))
+
+    if "disk" in space_state:
+        space_definition["assignedStorage"] = int(float(space_state["disk"]) * constants.CONST_GIGABYTE)
+
+    if "memory" in space_state:
+        space_definition["assignedRam"] = int(float(space_state["memory"]) * constants.CONST_GIGABYTE)
+
+    space_definition["members"] = [ { "name" : user_name, "type" : "user" }
+                                    for user_name in resolve_members(space_id, space_state.get("members", [])) ]
+
+    if len(space_definition["members"]) > 0:
+        change["details"].append("members: " + " ".join("+" + member["name"] for member in space_definition["members"]))
+
+    change["action"] = "create"
+    change["definition"] = { space_id : { "spaceDefinition" : space_definition } }
+
+def plan_update(change, space_state, snapshot):
+    space_id = change["space"]
+    space = snapshot["definitions"].get(space_id)
+
+    if space is None:
+        logger.error(f"compute_plan: space {space_id} - definition not available - skipped.")
+        return
+
+    space_definition = space[session_config.dwc.get_space_id(space)]["spaceDefinition"]
+
+    if "label" in space_state:
+        label = session_config.dwc.validate_space_label(space_id, space_state["label"])
+
+        if space_definition.get("label") != label:
+            change["details"].append(f"label: \"{space_definition.get('label')}\" -> \"{label}\"")
+            space_definition["label"] = label
+
+    for setting, attribute in [ ("disk", "assignedStorage"), ("memory", "assignedRam") ]:
+        if setting in space_state:
+            value = int(float(space_state[setting]) * constants.CONST_GIGABYTE)
+
+            if space_definition.get(attribute) != value:
+                change["details"].append(f"{setting}: {space_definition.get(attribute)} -> {value}")
+                space_definition[attribute] = value
+
+    if "members" in space_state:
+        wanted = resolve_members(space_id, space_state["members"])
+        members = space_definition.get("members", [])
+
+        current = [ member["name"] for member in members if member["type"] == "user" ]
+
+        added = [ user_name for user_name in wanted if user_name not in current ]
+        removed = [ user_name for user_name in current if user_name not in wanted ]
+
+        if len(added) > 0 or len(removed) > 0:
+            change["details"].append("members: " + " ".join([ "+" + name for name in added ] + [ "-" + name for name in removed ]))
+
+            # Keep the order of the members that stay - other member types are not managed.
+            space_definition["members"] = [ { "name" : member["name"], "type" : member["type"] }
+                                            for member in members if member["name"] not in removed or member["type"] != "user" ]
+            space_definition["members"].extend({ "name" : user_name, "type" : "user" } for user_name in added)
+
+    # All the setting changes for a space go out in a single write.
+    if len(change["details"]) > 0:
+        change["action"] = "update"
+        change["definition"] = space
+
+def plan_connections(change, space_state, snapshot, base_directory):
+    space_id = change["space"]
+
+    current = { connection["name"] : connection for connection in snapshot["connections"].get(space_id, []) }
+
+    for entry in space_state.get("connections", []):
+        if isinstance(entry, dict) and entry.get("state") == "absent":
+            if entry.get("name") in current:
+                change["connections_delete"].append((entry["name"], current[entry["name"]]["id"]))
+
+            continue
+
+        conn_file = entry if isinstance(entry, str) else entry.get("file") if isinstance(entry, dict) else None
+
+        if conn_file is None:
+            logger.error(f"compute_plan: space {space_id} - connection entry {entry} is not valid - skipped.")
+            continue
+
+        # Connection files are relative to the state file.
+        if not os.path.isabs(conn_file):
+            conn_file = os.path.join(base_directory, conn_file)
+
+        try:
+            with open(conn_file, "r") as json_file:
+                conn_json = json.load(json_file)
+        except (IOError, ValueError) as e:
+            logger.error(f"compute_plan: space {space_id} - connection file {conn_file} - {e}")
+            continue
+
+        if "data" not in conn_json or "name" not in conn_json["data"]:
+            logger.error(f"compute_plan: space {space_id} - {conn_file} is not a valid connection")
+            continue
+
+        # Connection definitions (passwords) can't be read back - existing connections are left alone.
+        if conn_json["data"]["name"] not in current:
+            change["connections_add"].append((conn_json["data"]["name"], conn_json))
+
+def plan_shares(change, space_state, snapshot):
+    space_id = change["space"]
+
+    # Objects that need the same share/unshare targets go out in one request.
+    batches = {}
+
+    for entry in space_state.get("shares", []):
+        if not isinstance(entry, dict) or "object" not in entry:
+            logger.error(f"compute_plan: space {space_id} - share entry {entry} is not valid - skipped.")
+            continue
+
+        targets = set(entry.get("targets", []))
+        current = snapshot["shares"].get((space_id, entry["object"]), set())
+
+        share = tuple(sorted(targets - current))
+        unshare = tuple(sorted(current - targets))
+
+        if len(share) > 0 or len(unshare) > 0:
+            batches.setdefault((share, unshare), []).append(entry["object"])
+
+    for (share, unshare), object_names in batches.items():
+        change["shares"].append({ "spaceName"         : space_id,
+                                  "objectNames"       : object_names,
+                                  "shareSpaceNames"   : list(share),
+                                  "unshareSpaceNames" : list(unshare)
+                                })
+
+def write_plan(changes, filename, output_handle=sys.stdout):
+    if len(changes) == 0:
+        output_handle.write(f"No changes - the tenant matches {filename}.\n")
+        return
+
+    counts = { action : sum(1 for change in changes if change["action"] == action) for action in [ "create", "update", "delete" ] }
+
+    output_handle.write(f"Plan: {counts['create']} to create, {counts['update']} to update, {counts['delete']} to delete.\n")
+
+    symbols = { "create" : "+", "update" : "~", "delete" : "-", None : " " }
+
+    for change in changes:
+        output_handle.write(f"{symbols[change['action']]} space {change['space']}\n")
+
+        for detail in change["details"]:
+            output_handle.write(f"    {detail}\n")
+
+        for conn_name, conn_json in change["connections_add"]:
+            output_handle.write(f"    + connection {conn_name}\n")
+
+        for conn_name, connection_id in change["connections_delete"]:
+            output_handle.write(f"    - connection {conn_name}\n")
+
+        for share in change["shares"]:
+            targets = " ".join([ "+" + name for name in share["shareSpaceNames"] ] + [ "-" + name for name in share["unshareSpaceNames"] ])
+            output_handle.write(f"    ~ share {', '.join(share['objectNames'])}: {targets}\n")
+
+def apply_plan(changes, workers=1):
+    # Spaces are written first so new spaces exist before connections and
+    # shares refer to them.  Spaces are deleted last - after any shares
+    # to them have been removed.
+
+    dwc = session_config.dwc
+
+    dwc.ensure_pool(workers)
+
+    def is_ok(response):
+        return response is not None and response.status_code < 400
+
+    def write_space(change):
+        if change["action"] not in [ "create", "update" ]:
+            return 0
+
+        response = dwc.put_space(change["definition"])
+
+        if not is_ok(response):
+            logger.error(f"apply: space {change['space']} - {change['action']} failed.")
+            return 1
+
+        logger.info(f"apply: space {change['space']} - {change['action']} complete.")
+
+        return 0
+
+    def write_contents(change):
+        # A space that couldn't be created has nothing to add to.
+        if change["space"] in failed_creates:
+            logger.warning(f"apply: space {change['space']} - create failed, connections and shares skipped.")
+            return 0
+
+        failed = 0
+
+        if len(change["connections_add"]) > 0 or len(change["connections_delete"]) > 0:
+            space_guid = dwc.get_space_guid(change["space"])
+
+            for conn_name, conn_json in change["connections_add"]:
+                if not is_ok(dwc.post(dwc.get_url("connection").format(space_guid), json.dumps(conn_json), url_name="connection")):
+                    logger.error(f"apply: space {change['space']} - connection {conn_name} create failed.")
+                    failed += 1
+
+            for conn_name, connection_id in change["connections_delete"]:
+                if not is_ok(dwc.delete(dwc.get_url("connection_delete").format(connection_id, space_guid), url_name="connection_delete")):
+                    logger.error(f"apply: space {change['space']} - connection {conn_name} delete failed.")
+                    failed += 1
+
+        for share in change["shares"]:
+            if not is_ok(dwc.post(dwc.get_url("shares"), json.dumps(share), url_name="shares")):
+                logger.error(f"apply: space {change['space']} - share {', '.join(share['objectNames'])} failed.")
+                failed += 1
+
+        if len(change["shares"]) > 0:
+            dwc.invalidate_cache("builder_objects")
+
+        return failed
+
+    def delete_space(change):
+        if change["action"] != "delete":
+            return 0
+
+        if not dwc.space_delete(change["space"]):
+            logger.error(f"apply: space {change['space']} - delete failed.")
+            return 1
+
+        logger.info(f"apply: space {change['space']} - delete complete.")
+
+        return 0
+
+    space_results = dwc.map_concurrent(write_space, changes, workers)
+
+    failed = sum(space_results)
+    failed_creates = { change["space"] for change, result in zip(changes, space_results) if change["action"] == "create" and result > 0 }
+
+    # New spaces need their internal IDs before connections can be added.
+    if any(change["action"] == "create" for change in changes):
+        dwc.get_spaces(force=True)
+
+    failed += sum(dwc.map_concurrent(write_contents, changes, workers))
+    failed += sum(dwc.map_concurrent(delete_space, changes, workers))
+
+    if any(change["action"] == "delete" for change in changes):
+        dwc.invalidate_cache("spaces", "spaces_resources", "builder_objects")
+
+    return failed
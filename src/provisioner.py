@@ -8,12 +8,10 @@ major elements of the GUI are available for download:
 There are various options that can be set to control the operation of this script.
 """
 
-import os, sys, logging
+import sys, logging
 
 import session_config
-import cmdparse, connections, spaces, shares, users, utility
-
-from session import DWCSession
+import cmdparse, utility, metrics, daemon
 
 logger = logging.getLogger("dwc_tool")
 
@@ -29,6 +27,17 @@ if __name__ == '__main__':
     # Note: The args this script names as the first param - remove it.
     args = cmdparse.parse(sys.argv[1:])  
 
+    # Hand the command to a running "provisioner serve" if asked - it is
+    # already logged in and has warm caches.  Without one, run it here.
+
+    if args.daemon and args.command not in [ "config", "serve" ]:
+        exit_code = daemon.forward(sys.argv[1:], daemon.get_socket_file(args))
+
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+        logger.info("no provisioner daemon running - running the command in this process.")
+
     # Make sure our configuration is present and valid.    
     session_config.ensure_config(args)
 
@@ -39,55 +48,25 @@ if __name__ == '__main__':
     # Update our logging level based on the configuration we just loaded.
     logger.setLevel(session_config.log_level)        
     
+    # Note: the command modules (and the writers behind them) are only
+    # imported once we know the command runs in this process - a client
+    # handing its command to the daemon doesn't need them.
+
+    import executor
+
     # Build the full list of commands, including multiple commands
     # coming from a script.
-    
-    commands = []  # We love lists to loop over.
 
-    # Check if a script was provided on the command line.  If so, the
-    # commands in the script file will be added to the commands to
-    # run - in addition to the global parameters.
+    commands = executor.build_commands(args)
 
-    if args.command != 'script':
-        commands.append(args)
-    else:
-        if not os.path.exists(args.filename):
-            logger.fatal("Script {} not found.".format(args.filename))
-            sys.exit(1)
+    if commands is None:
+        sys.exit(1)
 
-        # Read all the commands from the script - stop if we
-        # encounter the "exit" command.  Also, skip any "config"
-        # commands.
+    # We are good to go, login to the DWC tenant.  Note: the session module
+    # (requests, bs4) is only imported when we really need it.
 
-        with open(args.filename, "r") as script:
-            commandScript = script.readlines()
-    
-        # Append them to the list of commands after parsing their arguments
-        for command in commandScript:
-            script_args = command.strip()
+    from session import DWCSession
 
-            # Only process non-blank and non-comment lines in the file.
-            if len(script_args) == 0 or script_args[0] == "#":   
-                continue
-            
-            # If we see "exit" we are done with this script.
-            if script_args.startswith("exit"):
-                break
-            
-            # Invalid script commands - skip.    
-            if script_args.startswith("config"):
-                logger.warning("config commands are not permitted in script files - skipped")
-                continue
-            
-            logger.debug("..script cmd: {}".format(script_args))
-
-            # Add this command to the list we will process later.  Go ahead
-            # and parse the commands to verify the arguments.
-            script_args = script_args.split(" ")
-            commands.append(cmdparse.parse(script_args))
-
-    # We are good to go, login to the DWC tenant
-    
     session_config.dwc = DWCSession(
         url=session_config.get_config_param("dwc", "dwc_url"), 
         user=session_config.get_config_param("dwc", "dwc_user"), 
@@ -95,24 +74,37 @@ if __name__ == '__main__':
     
     # Push the logging level into the DWC session.
     session_config.dwc.setLevel(logger.getEffectiveLevel())
+    session_config.dwc.set_retries(args.retries)
+
+    # Report-only runs can reuse recent answers from earlier runs.  Anything
+    # that changes the tenant always works from live data.
+
+    if not args.no_cache and all(cmdparse.is_read_only(command_args) for command_args in commands):
+        session_config.dwc.enable_cache(args.cache_ttl)
 
-    # Start the interaction with DWC by logging in.
+    # Start the interaction with DWC by logging in - or by reusing the
+    # saved session from an earlier run.
 
-    if session_config.dwc.login() == False:
+    if session_config.dwc.connect(reuse=not args.relogin) == False:
         sys.exit(1)
         
-    # Loop over the commands processing each with their own arguments.
-    
-    for command_args in commands:
-        if command_args.command == "spaces":
-            spaces.process(command_args)
-        elif command_args.command == "connections":
-            connections.process(command_args)
-        elif command_args.command == "users":
-            users.process(command_args)
-        elif command_args.command == "shares":
-            shares.process(command_args)
-        elif command_args.command == "exit":
-            break
+    # Run the commands - independent script commands may run at the same time.
+    # The daemon keeps this session to run commands sent by clients.
+
+    if args.command == "serve":
+        daemon.serve(args)
+    else:
+        executor.run(args, commands)
         
+    # Let the user know which endpoints needed retries to get the work done.
+    for endpoint, count in session_config.dwc.get_retry_counts().items():
+        logger.info(f"{endpoint}: {count} retries")
+
+    # Show where the time went - per endpoint - if asked.
+    if args.metrics:
+        metrics.write_table()
+
+    if args.metrics_file is not None:
+        metrics.write_json(args.metrics_file)
+
     logger.info(utility.log_timer("dwc_tool", "DWC Operation"))
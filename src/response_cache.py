@@ -0,0 +1,75 @@
+import logging, os, sqlite3, time, threading
+from pathlib import Path
+
+logger = logging.getLogger("response_cache")
+
+# The cache lives next to the other working files and is shared by all
+# tenants and users - every entry is keyed by both.
+
+cache_file = os.path.join(Path(__file__).parent.absolute(), "working", "response_cache.db")
+
+# Number of seconds a response stays fresh for each read-only endpoint.  Only
+# the endpoints listed here are ever cached.
+
+default_ttls = { "spaces"           : 60,
+                 "spaces_resources" : 60,
+                 "users"            : 300,
+                 "builder_objects"  : 120
+               }
+
+class ResponseCache:
+    def __init__(self, tenant, user, ttl=None, filename=cache_file):
+        self.tenant = tenant
+        self.user = user
+
+        # A single TTL from the command line overrides all the defaults.
+        self.ttls = dict(default_ttls)
+
+        if ttl is not None:
+            for url_name in self.ttls:
+                self.ttls[url_name] = ttl
+
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+
+        # The responses include the users and space definitions of the
+        # tenant - owner only, like the saved session (see session_store).
+        # SQLite gives its journal files the same permissions.
+        os.close(os.open(filename, os.O_WRONLY | os.O_CREAT, 0o600))
+        os.chmod(filename, 0o600)
+
+        # The session may be shared by many threads - serialize access.
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("create table if not exists responses (tenant text, user text, url_name text, url text, stored real, body text, primary key (tenant, user, url))")
+
+    def is_cacheable(self, url_name):
+        return url_name in self.ttls and self.ttls[url_name] > 0
+
+    def get(self, url_name, url):
+        with self.lock:
+            row = self.conn.execute("select stored, body from responses where tenant = ? and user = ? and url = ?",
+                                    (self.tenant, self.user, url)).fetchone()
+
+        if row is None:
+            return None
+
+        if time.time() - row[0] > self.ttls[url_name]:
+            logger.debug(f"get: {url_name} expired")
+            return None
+
+        logger.debug(f"get: {url_name} served from cache")
+
+        return row[1]
+
+    def put(self, url_name, url, body):
+        with self.lock, self.conn:
+            self.conn.execute("insert or replace into responses values (?, ?, ?, ?, ?, ?)",
+                              (self.tenant, self.user, url_name, url, time.time(), body))
+
+    def invalidate(self, url_names):
+        with self.lock, self.conn:
+            for url_name in url_names:
+                self.conn.execute("delete from responses where tenant = ? and user = ? and url_name = ?",
+                                  (self.tenant, self.user, url_name))
@@ -1,13 +1,20 @@
 from bs4 import BeautifulSoup
 from os.path import exists
 
-import requests, urllib, urllib3, subprocess
-import logging, time, json, re, copy
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections.abc import Mapping
 
-import utility
+import requests, urllib, urllib3, subprocess, shutil
+import logging, time, json, re, copy, threading, collections
+
+import utility, session_store, transport, response_cache, user_directory, metrics, passcode_pool
 
 logger = logging.getLogger("session")
 
+class SearchIncompleteError(Exception):
+    """A page of repository search results could not be read - the
+    results would be missing objects."""
+
 class DWCSession:
     # Since we are impersonating a browser we need to identify what kind.
     headers = { 'User-Agent' : 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:63.0) Gecko/20100101 Firefox/63.0' }
@@ -26,6 +33,8 @@ class DWCSession:
                       "connection"        : '#dwc_url/dwaas-core/repository/remotes/?space_ids={}&inSpaceManagement=true',
                       "connection_delete" : "#dwc_url/dwaas-core/repository/remotes/{}?space_ids={}",
                       "remotetables"      : "#dwc_url/dwaas-core/monitor/{spaceID}/remoteTables?includeBusinessNames=true",
+                      "dbuser_objects"    : "#dwc_url/dwaas-core/datasources/getchildren?path={dbuser_path}&space={space_name}",
+                      "builder_objects"   : "#dwc_url/dwaas-core/repository/search/$all?%24top={top}&%24skip={skip}&%24apply=filter({objects_query})&%24count=true",
                       "businessbuilder"   : "#dwc_url/dwaas-core/c4s/internal_services/loadContent",
                       "users"             : "#dwc_url/sap/fpa/services/rest/epm/security/list/users?detail=true&parameter=key_value&includePending=true&forceLicensingCheck=true&tenant={tenant_id}"
                     }
@@ -41,9 +50,44 @@ class DWCSession:
 
         self.dwc_url = url
         self.dwc_user_info = None
+        self.passcode_url = None
+        self.passcode_pool = None
 
         self.spaces_cache = None
-        self.users_cache = None
+        self.user_directory = None
+
+        # Indexes over the spaces cache - see index_spaces.
+        self.spaces_by_name = {}
+        self.spaces_by_id = {}
+        self.spaces_upper_names = []
+
+        # Optional persistent cache of read-only responses - see enable_cache.
+        self.response_cache = None
+
+        # Space definitions read during the current command - see get_space_definition.
+        self.space_memo = {}
+        self.memo_lock = threading.Lock()
+
+        # Several threads may ask for the same cached lists at the same
+        # time - only the first one should go to the tenant.  Each list has
+        # its own lock so the space list and the user directory can be
+        # read at the same time.  cache_lock guards the passcode pool.
+        self.cache_lock = threading.RLock()
+        self.spaces_lock = threading.Lock()
+        self.users_lock = threading.Lock()
+
+        # Per-thread state, e.g., the status of the last request.
+        self.local = threading.local()
+
+        # Size of the connection pool (the requests default) - see ensure_pool.
+        self.pool_size = 10
+        self.pool_lock = threading.Lock()
+
+        # Number of objects asked for in each page of a repository search.
+        self.search_page_size = 1000
+
+        # Longest list of object names (in characters) sent on a share list URL.
+        self.object_names_limit = 4000
 
         # Instantiate a "requests" session - no network traffic happens here.
         # The Session object handles the HTTP(s) and cookie processing.
@@ -51,6 +95,14 @@ class DWCSession:
         self.session = requests.Session()
         self.session.headers = self.headers
 
+        # All traffic goes through our transport adapter - it handles the
+        # connection pool and retries when the tenant is busy.
+
+        self.transport = transport.DWCTransport()
+
+        self.session.mount("https://", self.transport)
+        self.session.mount("http://", self.transport)
+
         logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s %(message)s")
         self.logger = logging.getLogger('dwc-session')
 
@@ -59,6 +111,84 @@ class DWCSession:
     def setLevel(self, level):
         logger.setLevel(level)
 
+    def ensure_pool(self, workers):
+        # Make sure the connection pool can keep one connection alive per
+        # worker - the requests default is only 10.  The number of workers
+        # itself is passed to each iter_concurrent/map_concurrent call, so
+        # commands running in parallel (scripts) keep their own width.
+        # The pool only grows - the other commands may still be using it.
+
+        with self.pool_lock:
+            if workers > self.pool_size:
+                self.pool_size = workers
+                self.transport.resize(self.pool_size)
+
+    def set_retries(self, retries):
+        self.transport.retries = max(0, int(retries))
+
+    def get_retry_counts(self):
+        return self.transport.get_retry_counts()
+
+    def iter_concurrent(self, function, items, workers=1):
+        # Run the function over the items on a bounded pool of threads sharing
+        # this session.  Results are yielded in the same order as the items
+        # so the output stays deterministic regardless of completion order.
+
+        if workers <= 1:
+            for item in items:
+                yield function(item)
+
+            return
+
+        # The request status is kept per thread - the outcome of the requests
+        # made on the workers is passed back to the calling thread so a
+        # failure there counts as a failure of the caller (see get_status).
+
+        def run_item(item):
+            self.clear_status()
+
+            result = function(item)
+
+            return result, self.local.error_status, self.local.last_status
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = collections.deque()
+
+            for item in items:
+                pending.append(executor.submit(run_item, item))
+
+                # Only keep a small window of work in flight so long (or streamed)
+                # lists of items do not pile up results in memory.
+                if len(pending) >= workers * 2:
+                    yield self.merge_status(*pending.popleft().result())
+
+            while len(pending) > 0:
+                yield self.merge_status(*pending.popleft().result())
+
+    def merge_status(self, result, error_status, last_status):
+        # Take on the status of a request made by a worker thread.
+
+        if last_status is not None:
+            self.local.last_status = last_status
+
+        if error_status is not None and getattr(self.local, "error_status", None) is None:
+            self.local.error_status = error_status
+
+        return result
+
+    def map_concurrent(self, function, items, workers=1):
+        return list(self.iter_concurrent(function, items, workers))
+
+    def enable_cache(self, ttl=None):
+        # Keep read-only responses on disk so back-to-back runs against the
+        # same tenant, as the same user, do not repeat the same queries.
+        self.response_cache = response_cache.ResponseCache(self.dwc_url, self.j_username, ttl)
+
+    def invalidate_cache(self, *url_names):
+        # Changes made by this process make the cached lists out of date.
+        if self.response_cache is not None:
+            self.response_cache.invalidate(url_names)
+
     def set_dwc_url(self, dwc_url):
         self.dwc_url = dwc_url
 
@@ -177,6 +307,84 @@ class DWCSession:
 
             return False
 
+    def connect(self, reuse=True):
+        # Prefer a saved session for this tenant and user - a full SAML
+        # login is only needed when there is none or it has expired.
+
+        if reuse and self.restore_session():
+            logger.debug(f"reusing saved session for {self.j_username}")
+            return True
+
+        if not self.login():
+            return False
+
+        if reuse:
+            self.save_session()
+
+        return True
+
+    def save_session(self):
+        cookies = []
+
+        for cookie in self.session.cookies:
+            cookies.append({ "name"    : cookie.name,
+                             "value"   : cookie.value,
+                             "domain"  : cookie.domain,
+                             "path"    : cookie.path,
+                             "expires" : cookie.expires,
+                             "secure"  : cookie.secure
+                           })
+
+        session_store.save(self.dwc_url, self.j_username, self.j_password, 
+                           { "cookies" : cookies, "passcode_url" : self.passcode_url })
+
+    def restore_session(self):
+        state = session_store.load(self.dwc_url, self.j_username, self.j_password)
+
+        if state is None:
+            return False
+
+        for cookie in state["cookies"]:
+            self.session.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"],
+                                     expires=cookie["expires"], secure=cookie["secure"])
+
+        self.passcode_url = state["passcode_url"]
+
+        # A single lightweight call tells us if the tenant still honors
+        # the saved cookies.
+
+        if self.validate_session():
+            return True
+
+        logger.debug("restore_session: saved session has expired.")
+
+        self.session.cookies.clear()
+        session_store.remove(self.dwc_url, self.j_username)
+
+        return False
+
+    def validate_session(self):
+        # This is the same request as set_user_info, but an expired session
+        # is redirected to the login page instead of returning JSON.
+
+        try:
+            response = self.session.get(self.get_url("logon"), verify=False, allow_redirects=False)
+
+            if response.status_code != 200:
+                return False
+
+            user_info = json.loads(response.text)
+        except Exception:
+            return False
+
+        if not isinstance(user_info, dict) or "user" not in user_info:
+            return False
+
+        # We have the user info for free - keep it.
+        self.dwc_user_info = user_info
+
+        return True
+
     def set_user_info(self):
         # After the logon, DWC always asks for the user info, we are
         # replicating that request.  This request also returns the
@@ -207,29 +415,59 @@ class DWCSession:
         return None
     
     def get_spaces(self, force=False):
-        # Assume this operation does not need to be repeated during this
-        # session - cache the first response unless asked to force a reload.
+        with self.spaces_lock:
+            # Assume this operation does not need to be repeated during this
+            # session - cache the first response unless asked to force a reload.
+
+            if force == False and self.spaces_cache is not None:
+                return self.spaces_cache
 
-        if force == False and self.spaces_cache is not None:
+            # Query for a list of all spaces in the tenant.  Note: this
+            # operation is valid regardless of whether the current user
+            # is a member of any particular space.
+
+            self.spaces_cache = self.get_json('spaces')["results"]
+            
+            # As a separate query, ask for the utilization of the spaces.
+            self.spaces_resources_cache = self.get_json('spaces_resources')
+            
+            # Enrich the spaces with consumption information
+            for space in self.spaces_cache:
+                if space["name"] in self.spaces_resources_cache:
+                    space["resources"] = self.spaces_resources_cache[space["name"]]
+                else:
+                    space["resources"] = None
+
+            self.index_spaces()
+                
             return self.spaces_cache
 
-        # Query for a list of all spaces in the tenant.  Note: this
-        # operation is valid regardless of whether the current user
-        # is a member of any particular space.
+    def reset_caches(self):
+        # Forget the space and user lists - the next request reads them again.
+        with self.spaces_lock, self.users_lock:
+            self.spaces_cache = None
+            self.spaces_resources_cache = None
+            self.user_directory = None
+
+        self.clear_memo()
+
+    def index_spaces(self):
+        # Lookups by name and ID happen once per space or per CSV row - build
+        # hash indexes once instead of scanning the list every time.  The
+        # upper-cased names are kept for "contains" searches.
+
+        spaces_by_name = {}
+        spaces_by_id = {}
+        spaces_upper_names = []
 
-        self.spaces_cache = self.get_json('spaces')["results"]
-        
-        # As a separate query, ask for the utilization of the spaces.
-        self.spaces_resources_cache = self.get_json('spaces_resources')
-        
-        # Enrich the spaces with consumption information
         for space in self.spaces_cache:
-            if space["name"] in self.spaces_resources_cache:
-                space["resources"] = self.spaces_resources_cache[space["name"]]
-            else:
-                space["resources"] = None
-            
-        return self.spaces_cache
+            spaces_by_name[space["name"]] = space
+            spaces_by_id[space["id"]] = space
+            spaces_upper_names.append((space["name"].upper(), space))
+
+        self.spaces_by_name = spaces_by_name
+        self.spaces_by_id = spaces_by_id
+        self.spaces_upper_names = spaces_upper_names
 
     def get_space_guid(self, space_id):
         if space_id is None or not isinstance(space_id, str) or len(space_id) == 0:
@@ -239,11 +477,12 @@ class DWCSession:
         # Search the available spaces by name and, if found return
         # the internal ID of the space.
 
-        spaces = self.get_spaces()
+        self.get_spaces()
 
-        for space in spaces:
-            if space["name"] == space_id:
-                return space["id"]
+        space = self.spaces_by_name.get(space_id)
+
+        if space is not None:
+            return space["id"]
 
         return None
         
@@ -273,19 +512,18 @@ class DWCSession:
             search_list = [ search_list ]
 
         for search_space_name in search_list:
-            matched = False
+            if query:
+                search_upper = search_space_name.upper()
 
-            for space in spaces:
-                if query:
-                    if space["name"].upper().find(search_space_name.upper()) != -1:
-                        return_list.append(space)
-                        matched = True
-                else:
-                    if space["name"] == search_space_name:
+                for space_upper_name, space in self.spaces_upper_names:
+                    if space_upper_name.find(search_upper) != -1:
                         return_list.append(space)
-                        matched = True
-                        
-                        break  # This specific space has been included, we are done looking
+            else:
+                # Exact names come straight from the index.
+                space = self.spaces_by_name.get(search_space_name)
+
+                if space is not None:
+                    return_list.append(space)
 
         return return_list
 
@@ -308,14 +546,56 @@ class DWCSession:
         space_list = self.query_spaces(space_name, query)
         
         if len(space_list) == 1:
-            # Always ask the tenant for a new version of the space.
-            space = self.get_json("space", { "spaceID" : fixed_space_name })
+            # Ask the tenant for a new version of the space - at most once per command.
+            space = self.get_space_definition(fixed_space_name)
         else:
             space = None
 
         return space
 
-    def get_shares(self, space=None, object_name=None, target=None, query=False):
+    def get_space_definition(self, space_id):
+        # Reads of the same space during a command share one request: the first
+        # caller asks the tenant, anyone asking at the same time waits for that
+        # answer and later callers reuse it.  Every caller gets its own copy.
+
+        with self.memo_lock:
+            future = self.space_memo.get(space_id)
+            owner = future is None
+
+            if owner:
+                future = Future()
+                self.space_memo[space_id] = future
+
+        if owner:
+            try:
+                space = self.get_json("space", { "spaceID" : space_id })
+            except Exception as e:
+                self.forget_space(space_id, future)
+                future.set_exception(e)
+                raise
+
+            # Don't hold on to failed lookups - the next caller tries again.
+            if space is None:
+                self.forget_space(space_id, future)
+
+            future.set_result(space)
+
+        return copy.deepcopy(future.result())
+
+    def forget_space(self, space_id, future=None):
+        # The space has changed (or the lookup failed) - the next read must
+        # go to the tenant.
+
+        with self.memo_lock:
+            if future is None or self.space_memo.get(space_id) is future:
+                self.space_memo.pop(space_id, None)
+
+    def clear_memo(self):
+        # Start each command with fresh space definitions.
+        with self.memo_lock:
+            self.space_memo = {}
+
+    def get_shares(self, space=None, object_name=None, target=None, query=False, workers=1):
         shares_list = []
         
         # Figure out which spaces we are looking in - if nothing was passed
@@ -327,39 +607,50 @@ class DWCSession:
             logger.warn("get_shares: No matching spaces found.")
             return shares_list
         
-        # If an object_name was passed (even if search), look for those
-        # matching objects across the spaces we are searching (or all).
-        
+        # Find the names of the shared objects in each space.  For a single space
+        # search just that space.  For more, do a single tenant-wide search and
+        # group the objects by space - most spaces share nothing so this saves a
+        # search per space.
+
+        shared_objects = {}
+
+        if len(spaces) == 1:
+            for object in self.iter_data_builder_objects(spaces[0], shared_only=True, workers=workers):
+                shared_objects.setdefault(spaces[0]["name"], []).append(object["name"])
+        else:
+            space_names = set(space["name"] for space in spaces)
+
+            for object in self.iter_data_builder_objects(None, shared_only=True, workers=workers):
+                if object.get("space_name") in space_names:
+                    shared_objects.setdefault(object["space_name"], []).append(object["name"])
+
+        # Build the share list requests - long lists of object names are split
+        # to keep the URLs within limits.  Spaces without any data builder objects
+        # that have been shared are skipped.
+
+        batches = []
+
         for space in spaces:
-            # Get the list of shared objects for this space.
-            objects = self.get_data_builder_objects(space, shared_only=True)
-            
-            # Skip spaces without any data builder objects that have been shared.
-            if len(objects) == 0:
-                continue
-        
-            # Compose the comma separated list of object names having shares
-            
-            search_objects = ""
-            comma = ""
-            
-            for object in objects:
-                search_objects += comma + object["name"]
-                comma = ","
-                    
-            if len(search_objects) == 0:
+            if space["name"] in shared_objects:
+                for object_names in self.chunk_object_names(shared_objects[space["name"]]):
+                    batches.append((space["name"], object_names))
+
+        def get_share_batch(batch):
+            space_name, object_names = batch
+
+            # Ask for the all the shares for these objects.
+            return space_name, self.get_json("share_list", values={ "spaceID" : space_name, "objectNames" : ",".join(object_names) })
+
+        for space_name, shares in self.iter_concurrent(get_share_batch, batches, workers):
+            if not isinstance(shares, dict):
                 continue
-            
-            # Ask for the all the shares for this space.
-            shares = self.get_json("share_list", values={ "spaceID" : space["name"], "objectNames" : search_objects })
-            
+
             # We should get back a dictionary of objects with each object listing
-            # their shares.  Loop over to see if we are only looking for a specific
-            # space.
+            # their shares.
             
             for object_name in shares:
                 for share in shares[object_name]:
-                    share_item = { "spaceName" : space["name"],
+                    share_item = { "spaceName" : space_name,
                                    "objectName" : object_name,
                                    "targetSpace" : share["name"]
                                  }
@@ -367,6 +658,28 @@ class DWCSession:
                     shares_list.append(share_item)
         
         return shares_list
+
+    def chunk_object_names(self, object_names):
+        # Split a list of object names into URL-safe groups whose combined
+        # length stays under the share list limit.
+
+        chunk = []
+        chunk_length = 0
+
+        for object_name in object_names:
+            object_name = urllib.parse.quote(object_name, safe="")
+
+            if len(chunk) > 0 and chunk_length + len(object_name) + 1 > self.object_names_limit:
+                yield chunk
+
+                chunk = []
+                chunk_length = 0
+
+            chunk.append(object_name)
+            chunk_length += len(object_name) + 1
+
+        if len(chunk) > 0:
+            yield chunk
             
     def add_share(self, space_name, object_name, targets):
         # A single share call to DWC can share the same object to many
@@ -396,7 +709,10 @@ class DWCSession:
                     logger.warn("add_share: target {} not valid".format(str(target)))
         
         if len(data["shareSpaceNames"]) > 0:
-            self.post(self.get_url("shares"), json.dumps(data))
+            self.post(self.get_url("shares"), json.dumps(data), url_name="shares")
+
+            # The shared object search results have changed.
+            self.invalidate_cache("builder_objects")
         else:
             logger.warn("add_share: no valid targets specified.")
 
@@ -495,7 +811,7 @@ class DWCSession:
                 return None
 
         # Create the connection with a POST operation
-        return self.post(space_url, json.dumps(conn_json))
+        return self.post(space_url, json.dumps(conn_json), url_name="connection")
 
     def connection_delete(self, space_name, conn_name):
         space_id = self.get_space_guid(space_name)
@@ -518,7 +834,7 @@ class DWCSession:
         space_url = self.get_url("connection_delete").format(connection_id, space_id)
 
         # Delete the connection with a DELETE operation.
-        return self.delete(space_url)
+        return self.delete(space_url, url_name="connection_delete")
 
     def is_dwc_user(self, user):
         # Test is the passed user exists in the DWC tenant list of users.
@@ -531,23 +847,26 @@ class DWCSession:
     
     def get_users(self, users_query=None, force=False, query=True):
         '''
-        Get the list of user from the tenant as a deep copy.  For repeat calls,
-        always start with a cached user list.  Users are considered non-mutable
+        Get the list of user from the tenant as read-only views.  For repeat calls,
+        always start with the cached user directory.  Users are considered non-mutable
         for a single session so doing the same call mulitple times is a performance
-        bottleneck.
+        bottleneck - callers wanting to change a user must copy it first.
         '''
 
-        if self.users_cache is None or force == True:
-            self.users_cache = self.get_json("users", { "tenant_id" : self.get_tenant_id() })
+        with self.users_lock:
+            if self.user_directory is None or force == True:
+                self.user_directory = user_directory.UserDirectory(self.get_json("users", { "tenant_id" : self.get_tenant_id() }))
+
+        directory = self.user_directory
 
         # Do we have any users in the tenant?  This is never true, but check anyway.
-        if len(self.users_cache) == 0:
+        if len(directory) == 0:
             return []
 
         # If no search list was given, return the entire list.
 
         if users_query is None:
-            return copy.deepcopy(self.users_cache)  # Return a mutable list
+            return directory.all()
 
         # We could get a few different requests:
         # 1. A single string of a username
@@ -558,7 +877,7 @@ class DWCSession:
         # If we find that we have a dictionary object that looks like a
         # DWC user, simply return the user back as the found user.
         
-        if isinstance(users_query, dict) and "userName" in users_query:
+        if isinstance(users_query, Mapping) and "userName" in users_query:
             return [ users_query ]  # we don't need to search anything
         
         # We want to search a list of users, convert a simple string into a list
@@ -568,7 +887,7 @@ class DWCSession:
             users_query = [ users_query ]
 
         # If we got a space user object, add the name - note: we need to get the full user object
-        if isinstance(users_query, dict) and "name" in users_query and "type" in users_query:
+        if isinstance(users_query, Mapping) and "name" in users_query and "type" in users_query:
             users_query = [ users_query["name"] ]
             
         # Make sure we have a list with at least one member.
@@ -578,9 +897,9 @@ class DWCSession:
             return []
 
         if len(users_query) == 0:
-            return copy.deepcopy(self.users_cache)
+            return directory.all()
 
-        # Setup the mutable return list.
+        # Setup the return list.
 
         return_users = []
 
@@ -588,20 +907,20 @@ class DWCSession:
             # If we are boiling down a list of users, pull the
             # username out of the pattern object.
             
-            if isinstance(pattern, dict):
+            if isinstance(pattern, Mapping):
                 pattern = pattern["userName"]
                 
-            for user in self.users_cache:
-                if query:
-                    # For a query search, convert the entire user JSON to a string and
-                    # search for any instance of the query pattern.
-                    
-                    if str(user).upper().find(pattern.upper()) != -1:
-                        return_users.append(copy.deepcopy(user))
-                else:
-                    if user["userName"].upper() == pattern.upper() or user["parameters"]["EMAIL"].upper() == pattern.upper():
-                        return_users.append(copy.deepcopy(user))
-                        break  # Non-search pattern has been matched, stop looking
+            if query:
+                # For a query search, look for any instance of the query pattern
+                # anywhere in the user definition.
+                
+                return_users.extend(directory.search(pattern))
+            else:
+                # Exact user name or email match from the directory indexes.
+                user = directory.find(pattern)
+
+                if user is not None:
+                    return_users.append(user)
 
         return return_users
 
@@ -625,7 +944,7 @@ class DWCSession:
                     logger.warn("get_space_name: invalid space object.")
         elif isinstance(space, str):
             # With no other information, simply return the passed name.
-            space_name = space
+            space_id = space
 
         return space_id
 
@@ -654,13 +973,9 @@ class DWCSession:
         # Encode the search string for the URL.                               
         dbuser_path = urllib.parse.quote(str(search_path).replace("'", '"'))
         
-        # build the final URL to send to DWC
-        dbuser_query = f'#dwc_url/dwaas-core/datasources/getchildren?path={dbuser_path}&space={space_name}'
-
-        # To simplify the get operation, simply punch this URL into the standard list.
-        self.urls["dbuser_objects"] = dbuser_query
-
-        objects = self.get_json("dbuser_objects")
+        # Format the values into the standard URL - note: the URL list is shared
+        # by all threads so it is never modified.
+        objects = self.get_json("dbuser_objects", { "dbuser_path" : dbuser_path, "space_name" : space_name })
         
         if "items" in objects:  # Results are in a sub-object named items
             return objects["items"]
@@ -668,6 +983,12 @@ class DWCSession:
             return []
 
     def get_data_builder_objects(self, space, shared_only=False):
+        return list(self.iter_data_builder_objects(space, shared_only))   # Return the list of objects.
+
+    def iter_data_builder_objects(self, space, shared_only=False, workers=1):
+        # Stream the repository objects for the space (or the whole tenant if
+        # no space is given) as they arrive from the search pages.
+
         space_id = self.get_space_id(space)
 
         # Pick the types of objects to include...
@@ -700,27 +1021,58 @@ class DWCSession:
         # Build the full search object
         objects_query = f"Search.search({objects_query})"
 
-        CONST_DOLLAR = '%24'
+        # Page through the search results - the first page tells us how many
+        # objects there are so the remaining pages can be fetched at the same time.
 
-        db_objects_query = CONST_DOLLAR + 'top=99999'
-        db_objects_query += '&'
-        db_objects_query += CONST_DOLLAR + 'skip=0'
-        db_objects_query += '&'
-        db_objects_query += CONST_DOLLAR + f"apply=filter({objects_query})"
-        db_objects_query += '&'
-        db_objects_query += CONST_DOLLAR + 'count=true'
+        page_size = self.search_page_size
 
-        db_objects_query =  self.get_dwc_url() + "/dwaas-core/repository/search/$all?" + db_objects_query
+        def get_page(skip):
+            page = self.get_json("builder_objects", { "top" : page_size, "skip" : skip, "objects_query" : objects_query })
 
-        # Park the just constructed URL in the list of the session.  This makes
-        # calling and getting JSON a standard operation.
-        
-        self.urls["builder_objects"] = db_objects_query
+            if page is None or "value" not in page:
+                return skip, None
 
-        # Go get the objects
-        builder_objects = self.get_json("builder_objects")
-        
-        return builder_objects["value"]   # Return the list of objects.
+            return skip, page
+
+        def check_page(skip, page):
+            # A missing page means missing objects - stop rather than return
+            # results that look complete but aren't.
+            if page is None:
+                logger.error(f"iter_data_builder_objects: search page at skip {skip} failed - results incomplete.")
+                raise SearchIncompleteError(f"repository search failed at skip {skip} (page size {page_size})")
+
+        skip, first_page = get_page(0)
+
+        check_page(skip, first_page)
+
+        for object in first_page["value"]:
+            yield object
+
+        if len(first_page["value"]) < page_size:
+            return   # Everything fit on the first page.
+
+        if "@odata.count" in first_page:
+            skips = range(page_size, first_page["@odata.count"], page_size)
+
+            for skip, page in self.iter_concurrent(get_page, skips, workers):
+                check_page(skip, page)
+
+                yield from page["value"]
+        else:
+            # Without a count, keep asking until we get a short page.
+            skip = page_size
+
+            while True:
+                skip, page = get_page(skip)
+
+                check_page(skip, page)
+
+                yield from page["value"]
+
+                if len(page["value"]) < page_size:
+                    break
+
+                skip += page_size
 
     def get_business_builder_objects(self, space_name):
         business_builder_query = {
@@ -742,7 +1094,7 @@ class DWCSession:
             ]
         }
 
-        response = self.post(self.get_url("businessbuilder"), json.dumps(business_builder_query))
+        response = self.post(self.get_url("businessbuilder"), json.dumps(business_builder_query), url_name="businessbuilder")
         
         try:
             results = json.loads(response.text)
@@ -760,7 +1112,7 @@ class DWCSession:
         return results
 
     def get_remote_tables(self, space_name):
-        results = self.get_json("remotetables", { "space_name" : space_name })
+        results = self.get_json("remotetables", { "spaceID" : space_name })
 
         if results is not None and "tables" in results:
             remote_tables = results["tables"]
@@ -811,8 +1163,12 @@ class DWCSession:
 
         return False
         
-    def add_members(self, space, users, query=False):
-        t0 = time.perf_counter()
+    def add_members(self, space, users, query=False, put=True):
+        # Add the users to the space.  With put=False only the passed space
+        # object is changed - the caller writes it, e.g., after several
+        # member changes to the same space.  Returns True if the space changed.
+
+        added_user = False
 
         # If we got a string for the space ID, find the space object
         if isinstance(space, str):
@@ -843,11 +1199,13 @@ class DWCSession:
                             space[space_id]["spaceDefinition"]["members"].append({ 'name' : user["userName"], 'type' : 'user' })
                             added_user = True
                     
-                    if added_user:
+                    if added_user and put:
                         self.put_space(space)
-        
-    def remove_members(self, space, users, query=False):
-        t0 = time.perf_counter()
+
+        return added_user
+
+    def remove_members(self, space, users, query=False, put=True):
+        # Remove the users from the space - see add_members for put.
 
         # If we got a name, find the space object
         if isinstance(space, str):
@@ -856,22 +1214,22 @@ class DWCSession:
         # The space must be an actual space object with the expected structure
         if space is None or not isinstance(space, dict):
             logger.error("remove_member: invalid space object")
-            return
+            return False
         
         # The first key must be the name of the space.
-        space_name = self.get_space_name(space)
+        space_name = self.get_space_id(space)
 
         # Check the space object properties.        
         if space_name is None or "spaceDefinition" not in space[space_name]:
             logger.error("remove_member: invalid space object")        
-            return
+            return False
         
         # Now figure out who's being added - could be many users
         user_list = self.get_users(users, query=query)
         
         if len(user_list) == 0:
             logger.warning("remove_members: invalid list of users")
-            return
+            return False
         
         removed_user = False
         remaining_member_list = []
@@ -895,7 +1253,11 @@ class DWCSession:
         
         if removed_user:
             space[space_name]["spaceDefinition"]["members"] = remaining_member_list
-            self.put_space(space)
+
+            if put:
+                self.put_space(space)
+
+        return removed_user
 
     def put_space(self, space):
         # We are expecting a space object, do a quick sanity check.
@@ -903,83 +1265,164 @@ class DWCSession:
         
         if space_id is None or "spaceDefinition" not in space[space_id]:
             logger.error("put_space: invalid space passed")
-            return
+            return None
         
         url = self.get_url("space")
         url = url.format(**{ "spaceID" : space_id })
 
-        self.put(url, json.dumps(space, separators=(',', ':')))
+        response = self.put(url, json.dumps(space, separators=(',', ':')), url_name="space")
+
+        if response.status_code >= 400:
+            logger.warning("put_space: {} - error {}.".format(space_id, response.status_code))
+
+        self.forget_space(space_id)
+
+        # The space lists (and their resources) no longer match the tenant.
+        self.invalidate_cache("spaces", "spaces_resources", "builder_objects")
+
+        return response
+
+    def space_create(self, space, cli=False):
+        # Create (or replace) a space with a single PUT on the logged in
+        # session.  The dwc CLI is only used when explicitly asked for.
+
+        if cli:
+            return self.spaces_create_cli("create", space)
+
+        response = self.put_space(space)
+
+        return response is not None and response.status_code < 400
+
+    def space_delete(self, space_id, cli=False):
+        # Delete the space, including its connections and objects.
+
+        if cli:
+            deleted = self.spaces_delete_cli(space_id)
+        else:
+            url = self.get_url("space").format(**{ "spaceID" : space_id })
+            url += "&connections=true&definitions=true"
+
+            deleted = self.delete(url, url_name="space").status_code < 400
+
+        self.forget_space(space_id)
+
+        return deleted
+
+    def get_cli(self):
+        # The dwc CLI must be installed and on the PATH.
+        cli = shutil.which("dwc")
+
+        if cli is None:
+            logger.error("get_cli: the dwc command line tool was not found on the PATH.")
+
+        return cli
 
     def spaces_delete_cli(self, space_id):
         utility.start_timer("spaces_delete_cli")
 
-        process_output = subprocess.run([ '/opt/homebrew/bin/dwc',
+        cli = self.get_cli()
+
+        if cli is None:
+            return False
+
+        try:
+            passcode = self.get_passcode()
+        except passcode_pool.PasscodeError as e:
+            logger.error(f"spaces_delete_cli: space_id {space_id} not deleted - {e}")
+            return False
+
+        process_output = subprocess.run([ cli,
                                           'spaces',
                                           'delete',
                                           '-F',
                                           '-H', self.get_dwc_url(),
                                           '-s', space_id, 
-                                          '-p', self.get_passcode()
+                                          '-p', passcode
                                         ],
                                         capture_output=True)
         
-        logger.info(utility.log_timer("spaces_delete_cli", "space_id {} deleted.".format(space_id)))
-
         if process_output.returncode != 0:
             logger.error("Invalid CLI result: {}".format(process_output.stdout))
+            return False
+
+        logger.info(utility.log_timer("spaces_delete_cli", "space_id {} deleted.".format(space_id)))
+
+        # The space lists (and their resources) no longer match the tenant.
+        self.invalidate_cache("spaces", "spaces_resources", "builder_objects")
+
+        return True
         
-    def spaces_create_cli(self, operation, json):
+    def spaces_create_cli(self, operation, space_json):
         t0 = time.perf_counter()
 
         json_obj = None
 
-        if json is None:
+        if space_json is None:
             logger.error("CLI {}: A JSON object must be provided.".format(operation))
-            return
-        elif isinstance(json, str):
+            return False
+        elif isinstance(space_json, str):
             # The string could be either a filename or a string of JSON.  First test to
             # see if it is a filename, otherwise assume it is a JSON string.  If neither
             # is valid, log an error and exit.
 
-            if exists(json):
-                json_file = json
+            if exists(space_json):
+                try:
+                    with open(space_json, "r") as json_file:
+                        json_obj = json.load(json_file)
+                except Exception as e:
+                    logger.error(f"Invalid JSON file {space_json} passed to spaces_cli - {e}")
+                    return False
             else:
                 # Attempt to parse the string into JSON.
                 try:
-                    json_obj = json.loads(json)
+                    json_obj = json.loads(space_json)
                 except Exception as e:
                     logger.error("Invalid JSON string passed to spaces_cli.")
-                    return
+                    return False
         else:
-            json_obj = json
+            json_obj = space_json
 
-        if json_obj is not None:
-            # Quick sanity check on the json object
-            space_name = next(iter(json_obj))  # get first dictionary key - should be the space name
+        # Quick sanity check on the json object
+        space_name = next(iter(json_obj))  # get first dictionary key - should be the space name
 
-            if "spaceDefinition" not in json_obj[space_name]:
-                logger.error("Invalid JSON object passed to spaces_cli")
-                return
+        if "spaceDefinition" not in json_obj[space_name]:
+            logger.error("Invalid JSON object passed to spaces_cli")
+            return False
 
-            json_file = utility.write_json(space_name, json_obj)
-            dwc_url = self.get_dwc_url()
+        cli = self.get_cli()
+
+        if cli is None:
+            return False
+
+        try:
             passcode = self.get_passcode()
+        except passcode_pool.PasscodeError as e:
+            logger.error(f"CLI {operation}: space {space_name} not created - {e}")
+            return False
+
+        json_file = utility.write_json(space_name, json_obj)
+        dwc_url = self.get_dwc_url()
 
-            process_output = subprocess.run([ '/opt/homebrew/bin/dwc',
-                                              'spaces',
-                                              'create',
-                                              '-H', dwc_url,
-                                              '-f', json_file, 
-                                              '-p', passcode
-                                            ],
-                                            capture_output=True)
+        process_output = subprocess.run([ cli,
+                                          'spaces',
+                                          'create',
+                                          '-H', dwc_url,
+                                          '-f', json_file, 
+                                          '-p', passcode
+                                        ],
+                                        capture_output=True)
         
         elapsed = time.perf_counter() - t0
         logger.debug("call_space_cli: operation {} - file {} - elapsed {}.".format(operation, json_file, elapsed))
 
+        self.forget_space(space_name)
+        self.invalidate_cache("spaces", "spaces_resources", "builder_objects")
+
         if process_output.returncode != 0:
             logger.error("Invalid CLI result: {}".format(process_output.stdout))
-            logger.error(process_output.stdout)
+            return False
+
+        return True
 
     def validate_space_id(self, space_id):
         """ The space ID can only contain uppercase letters, numbers, and underscores (_). Reserved keywords, 
@@ -1073,8 +1516,21 @@ class DWCSession:
         # Compose the URL - this includes formatting values into the URL template.
         url = self.get_url(url_name).format(**values)
         
+        # Read-only endpoints may already have a fresh answer in the cache.
+        use_cache = self.response_cache is not None and self.response_cache.is_cacheable(url_name)
+
+        if use_cache:
+            cached_text = self.response_cache.get(url_name, url)
+
+            if cached_text is not None:
+                self.elapsed = time.perf_counter() - t0
+
+                metrics.record(url_name, "cache", self.elapsed)
+
+                return json.loads(cached_text)
+
         # Send the URL to DWC via a GET operation.
-        response = self.session.get(url, verify=False)
+        response = self.request("GET", url_name, url)
 
         if response.status_code >= 400:
             logger.error("url_name: {} - error: {} - message: {}".format(url_name, response.status_code, response.text))
@@ -1089,19 +1545,67 @@ class DWCSession:
             logger.warning("url_name: {} - error: {} - message: {}".format(url_name, results["code"], results["details"]["message"]))
             return None
 
+        # Only good answers are worth keeping.
+        if use_cache and response.status_code < 400:
+            self.response_cache.put(url_name, url, response.text)
+
         return results
 
-    def post(self, url, data=None):
+    def request(self, method, url_name, url, **kwargs):
+        # Every call to the tenant goes through here so retries and metrics
+        # are counted against the named endpoint.
+
         t0 = time.perf_counter()
 
+        self.transport.set_endpoint(url_name)
+
+        try:
+            response = self.session.request(method, url, verify=False, **kwargs)
+        finally:
+            self.transport.set_endpoint(None)
+
+        self.elapsed = time.perf_counter() - t0
+
+        body = response.request.body
+
+        if body is None:
+            bytes_out = 0
+        elif isinstance(body, str):
+            bytes_out = len(body.encode())
+        else:
+            bytes_out = len(body)
+
+        metrics.record(url_name, response.status_code, self.elapsed, len(response.content), bytes_out)
+
+        # Remember the outcome for this thread - bulk operations report the
+        # status of each row.
+        self.local.last_status = response.status_code
+
+        if response.status_code >= 400 and getattr(self.local, "error_status", None) is None:
+            self.local.error_status = response.status_code
+
+        return response
+
+    def clear_status(self):
+        self.local.last_status = None
+        self.local.error_status = None
+
+    def get_status(self):
+        # The first failure since clear_status, otherwise the latest status.
+        error_status = getattr(self.local, "error_status", None)
+
+        if error_status is not None:
+            return error_status
+
+        return getattr(self.local, "last_status", None)
+
+    def post(self, url, data=None, url_name="post"):
         self.set_header("Content-Type", "application/json")
 
         if data == None:
-            response = self.session.post(url, verify=False)
+            response = self.request("POST", url_name, url)
         else: 
-            response = self.session.post(url, data, verify=False)
-
-        self.elapsed = time.perf_counter() - t0
+            response = self.request("POST", url_name, url, data=data)
 
         if response.status_code >= 400:
             logger.warning("post to {} - error {}.".format(url, response.status_code))
@@ -1109,46 +1613,56 @@ class DWCSession:
 
         return response
 
-    def delete(self, url):
-        t0 = time.perf_counter()
-
-        response = self.session.delete(url, verify=False)
-
-        self.elapsed = time.perf_counter() - t0
+    def delete(self, url, url_name="delete"):
+        response = self.request("DELETE", url_name, url)
 
         if response.status_code >= 400:
             logger.warning("delete to {} - error {}.".format(url, response.status_code))
 
-        self.elapsed = time.perf_counter() - t0
+        # Deleting spaces (or their content) changes the lists we may have cached.
+        self.invalidate_cache("spaces", "spaces_resources", "builder_objects")
 
         return response
 
-    def put(self, url, data):
-        t0 = time.perf_counter()
-
+    def put(self, url, data, url_name="put"):
         put_headers = copy.deepcopy(self.session.headers)
         put_headers["Content-Type"] = "application/json"
         
-        response = self.session.put(url, data, verify=False, headers=put_headers)
-
-        self.elapsed = time.perf_counter() - t0
+        response = self.request("PUT", url_name, url, data=data, headers=put_headers)
 
         return response
 
     def get_passcode(self):
-        response = self.session.get(self.passcode_url)
-        soup=BeautifulSoup(response.text, "html.parser")
+        # One-time passcodes for the dwc CLI come from a pool that fetches
+        # them ahead of demand - see passcode_pool.
+        return self.get_passcode_pool().get()
 
-        passcode = soup.find("h2").contents[0].contents[0]
+    def get_passcode_pool(self, size=None):
+        with self.cache_lock:
+            if self.passcode_pool is None:
+                self.passcode_pool = passcode_pool.PasscodePool(self.fetch_passcode)
 
-        return passcode
+        # Keep one passcode ready for each CLI process that may start at the same time.
+        if size is not None:
+            self.passcode_pool.resize(size)
 
-    def getwithdata(self, url, data):
-        t0 = time.perf_counter()
+        return self.passcode_pool
+
+    def fetch_passcode(self):
+        response = self.session.get(self.passcode_url)
+        soup=BeautifulSoup(response.text, "html.parser")
+
+        # The passcode page of an unavailable tenant (or an expired session)
+        # has no passcode on it.
+        try:
+            passcode = soup.find("h2").contents[0].contents[0]
+        except (AttributeError, IndexError):
+            raise passcode_pool.PasscodeError(f"passcode page returned no passcode (HTTP {response.status_code})")
 
-        self.response = self.session.get(url, data=data, verify=False)
+        return str(passcode)
 
-        self.elapsed = time.perf_counter() - t0
+    def getwithdata(self, url, data, url_name="get"):
+        self.response = self.request("GET", url_name, url, data=data)
 
         return self.response
 
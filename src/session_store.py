@@ -0,0 +1,86 @@
+import logging, os, json, time, base64, hashlib
+from pathlib import Path
+
+# The session store is optional - without the cryptography package every
+# run simply performs a full login.
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+logger = logging.getLogger("session_store")
+
+# Saved sessions live next to the other working files, one file per
+# tenant URL and user.
+
+store_path = os.path.join(Path(__file__).parent.absolute(), "working", "sessions")
+
+def setLevel(level):
+    logger.setLevel(level)
+
+def is_available():
+    return Fernet is not None
+
+def store_file(url, user):
+    # Never put the tenant or user name in the file name - hash them.
+    store_key = hashlib.sha256(f"{url}|{user}".lower().encode()).hexdigest()
+
+    return os.path.join(store_path, store_key + ".session")
+
+def get_cipher(url, user, password):
+    # The encryption key is derived from the configured credentials so only
+    # someone holding the configuration can read the saved cookies.
+
+    salt = hashlib.sha256(f"{url}|{user}".lower().encode()).digest()
+    key = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, 100000)
+
+    return Fernet(base64.urlsafe_b64encode(key))
+
+def save(url, user, password, state):
+    if not is_available():
+        logger.debug("save: cryptography package not installed - session not saved.")
+        return False
+
+    if not os.path.exists(store_path):
+        os.makedirs(store_path)
+
+    state["saved"] = time.time()
+
+    token = get_cipher(url, user, password).encrypt(json.dumps(state).encode())
+
+    # Create the file readable only by the current user.
+    file_handle = os.open(store_file(url, user), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+    with os.fdopen(file_handle, "wb") as session_file:
+        session_file.write(token)
+
+    return True
+
+def load(url, user, password):
+    if not is_available():
+        logger.debug("load: cryptography package not installed - session store disabled.")
+        return None
+
+    session_file_name = store_file(url, user)
+
+    if not os.path.exists(session_file_name):
+        return None
+
+    try:
+        with open(session_file_name, "rb") as session_file:
+            token = session_file.read()
+
+        return json.loads(get_cipher(url, user, password).decrypt(token))
+    except (InvalidToken, ValueError, OSError):
+        # A changed password or a damaged file - throw it away.
+        logger.debug("load: saved session could not be read - removed.")
+        remove(url, user)
+
+    return None
+
+def remove(url, user):
+    session_file_name = store_file(url, user)
+
+    if os.path.exists(session_file_name):
+        os.remove(session_file_name)
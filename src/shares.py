@@ -22,10 +22,13 @@ def process(share_args):
         logger.error(f"process: unexpected subcommand: {share_args.subcommand}")
 
 def shares_list(share_args):
+    session_config.dwc.ensure_pool(share_args.workers)
+
     shares = session_config.dwc.get_shares(share_args.sourceSpace, 
                                            share_args.sourceObject, 
                                            share_args.targetSpace, 
-                                           share_args.query)
+                                           share_args.query,
+                                           share_args.workers)
     
     writer.write_list(shares, share_args)
     
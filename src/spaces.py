@@ -1,6 +1,7 @@
-import logging, os, copy
+import logging, os, copy, argparse, threading
+from types import MappingProxyType
 
-import session_config, cmdparse, constants, utility, writer
+import session_config, constants, utility, writer, bulk, journal
 
 logger = logging.getLogger("spaces")
 
@@ -20,7 +21,74 @@ def process(space_args):
     elif space_args.subcommand == "member":
         process_members(space_args)
 
-def spaces_create(space_args):
+class CreateContext:
+    """Read-only answers shared by all the rows of a bulk create.
+
+    Built once by plan_create before any row runs: the template space
+    definitions, the users matched by each user pattern and the spaces
+    already in the tenant.  Rows must copy anything they change.
+    """
+
+    def __init__(self, templates, users, all_users, existing):
+        self.templates = MappingProxyType(templates)
+        self.users = MappingProxyType(users)
+        self.all_users = all_users
+        self.existing = frozenset(existing)
+
+    def get_users(self, patterns):
+        # Same answers as dwc.get_users - no patterns means every user.
+        if len(patterns) == 0:
+            return list(self.all_users)
+
+        return [ user for pattern in patterns for user in self.users.get(pattern, ()) ]
+
+def plan_create(rows):
+    """Resolve what the rows of a bulk create need before any row runs.
+
+    A single streaming pass over the rows collects the distinct templates
+    and user patterns - only those are kept, not the rows.  Returns the
+    CreateContext and the number of rows.
+    """
+
+    templates = set()
+    patterns = set()
+    count = 0
+
+    for row in rows:
+        if row.template is not None:
+            templates.add(row.template)
+
+        patterns.update(row.users)
+
+        count += 1
+
+    dwc = session_config.dwc
+
+    # The space list and the user directory don't depend on each other - load them together.
+    dwc.map_concurrent(lambda load: load(), [ dwc.get_spaces, dwc.get_users ], 2)
+
+    def resolve_template(template):
+        template_space = dwc.get_space(template)
+
+        if template_space is None:
+            return template, None
+
+        return template, template_space[dwc.get_space_id(template_space)]["spaceDefinition"]
+
+    resolved_templates = dict(dwc.map_concurrent(resolve_template, sorted(templates)))
+
+    resolved_users = {}
+
+    for pattern in patterns:
+        resolved_users[pattern] = tuple(dwc.get_users([ pattern ]))
+
+    logger.info(f"plan_create: {count} row(s), {len(templates)} template(s), {len(patterns)} user(s) resolved.")
+
+    context = CreateContext(resolved_templates, resolved_users, tuple(dwc.get_users([])), dwc.spaces_by_name)
+
+    return context, count
+
+def spaces_create(space_args, context=None):
     utility.start_timer("spaces_create")
 
     # The user could have specified a text name instead of
@@ -30,7 +98,7 @@ def spaces_create(space_args):
 
     if space_id is None:
         logger.error(f'space_create: a space ID is required')
-        return
+        return False
 
     space_label = session_config.dwc.validate_space_label(space_id, space_args.business)
 
@@ -46,17 +114,18 @@ def spaces_create(space_args):
     # If the user specified the "--force" command line option, this may be overridden
     delete_flag = False
 
-    # Check to see if the space already exists.
-    space_def = session_config.dwc.get_space(space_id)
+    # Check to see if the space already exists - the space list is enough,
+    # there is no need to read the whole definition.
 
-    # Check to see if the space objects (or empty object) has the
-    # space_name as a dictionary object - this only valid when
-    # a real space is returned.
+    if context is not None:
+        space_exists = space_id in context.existing
+    else:
+        space_exists = session_config.dwc.is_space(space_id)
 
-    if space_def is not None:
+    if space_exists:
         if space_args.force == False:
             logger.warning(f'spaces_create: space {space_args.spaceID} already exists - specify force.')
-            return
+            return False
         else:
             delete_flag = True
 
@@ -73,18 +142,24 @@ def spaces_create(space_args):
 
         new_space_def[space_id]["spaceDefinition"]["members"] = []   # We will add members shortly.
     else:
-        # Make sure the template space is in the tenant.
-        template_space = session_config.dwc.get_space(space_args.template)
+        # Make sure the template space is in the tenant - a bulk run has
+        # already looked up every template.
 
-        if template_space is None:
+        if context is not None:
+            template_def = context.templates.get(space_args.template)
+        else:
+            template_space = session_config.dwc.get_space(space_args.template)
+            template_def = None if template_space is None else template_space[space_args.template]["spaceDefinition"]
+
+        if template_def is None:
             logger.error(f"spaces_create: create space {space_args.spaceID} - template space {space_args.template} - invalid.")
-            return
+            return False
 
         new_space_def = {}
         new_space_def[space_id] = {}
 
         # Copy the space definition from the template
-        new_space_def[space_id]["spaceDefinition"] = template_space[space_args.template]["spaceDefinition"]
+        new_space_def[space_id]["spaceDefinition"] = copy.deepcopy(template_def)
         new_space_def[space_id]["spaceDefinition"]["label"] = space_label
         new_space_def[space_id]["spaceDefinition"]["members"] = []   # We will add members shortly
 
@@ -99,7 +174,10 @@ def spaces_create(space_args):
         new_space_def[space_id]["spaceDefinition"]["assignedRam"] = assigned_ram
 
     # Add members to the space definition.
-    users = session_config.dwc.get_users(space_args.users)
+    if context is not None:
+        users = context.get_users(space_args.users)
+    else:
+        users = session_config.dwc.get_users(space_args.users)
 
     # Let the user know they didn't specify valid users for the space.
     if len(users) == 0:    
@@ -121,12 +199,17 @@ def spaces_create(space_args):
         
         spaces_delete(space_args)
 
-    # The space is ready to be created, call the CLI to do the operation.
+    # The space is ready to be created - a single PUT on the session, unless
+    # the dwc CLI was asked for.
 
-    session_config.dwc.put_space(new_space_def)
+    if not session_config.dwc.space_create(new_space_def, cli=getattr(space_args, "cli", False)):
+        logger.error(f"spaces_create: {space_id} creation failed")
+        return False
 
     logger.info(utility.log_timer("spaces_create", f"spaces_create: {space_id} creation complete"))
 
+    return True
+
 def spaces_delete(space_args):
     utility.start_timer("spaces_delete")
 
@@ -134,20 +217,21 @@ def spaces_delete(space_args):
     
     if len(space_list) == 0:
         logger.warning("spaces_delete: no spaces found to delete")
-        return
+        return False
+
+    deleted = True
 
     for space in space_list:
         space_id = session_config.dwc.get_space_id(space)
         
-        url = session_config.dwc.get_url("space")
-        url = url.format(**{ "spaceID" : space_id })
-        url += "&connections=true&definitions=true"
-        
-        session_config.dwc.delete(url)
+        if not session_config.dwc.space_delete(space_id, cli=getattr(space_args, "cli", False)):
+            deleted = False
 
     space_count = len(space_list)
     logger.debug(utility.log_timer("spaces_delete", f"spaces_delete: {space_count} space(s) deleted"))
 
+    return deleted
+
 def process_bulk(space_args):
     # A file with a list of spaces for the bulk operation is required.
 
@@ -155,110 +239,61 @@ def process_bulk(space_args):
         logger.error(f"spaces_bulk: file not found: {space_args.filename}")
         return
 
-    # Load the file - should be a CSV file
-
-    with open(space_args.filename, "r") as file:
-        bulk_text = file.readlines()
-
-    # Remove the header line by clipping starting at the --skip value (default=1).
-    bulk_text = bulk_text[int(space_args.skip):]
-    
-    for text in bulk_text:
-        text = text.strip()
-
-        # Skip blank and comment lines - I WANTED THE ABILITY TO COMMENT - so shoot me.
-        if len(text) == 0 or text[0] == '#':
-            continue
-
-        if space_args.bulk_subcommand == "create":
-            spaces_bulk_create(space_args, text)
-        elif space_args.bulk_subcommand == "delete":
-            spaces_bulk_delete(text)
-
-def spaces_bulk_create(space_args, text):
-    # Build the arguments to pass to the spaces_create routine - just like
-    # it would appear on a command line.
-    
-    create_args = [ "spaces", "create" ]
-
-    # Split the row into expected columns.
-    text_row = text.split(",")
-
-    space_id = text_row[constants.CONST_SPACE_ID]
-    space_business_name = text_row[constants.CONST_BUSINESS]
-    space_disk = text_row[constants.CONST_DISK]
-    space_memory = text_row[constants.CONST_MEMORY]
-    space_template = text_row[constants.CONST_TEMPLATE]
-    space_force = text_row[constants.CONST_FORCE]
-
-    # Pass along the force option, if present.
-    # Note: command line argument overrides individual spaces in the CSV
-
-    if space_args.force:   # Override from the "spaces bulk create --force" command
-        create_args.append("--force")
-    else:
-        if isinstance(space_force, str) and len(space_force) > 0 and space_force.lower() == 'true':
-            create_args.append("--force")
-            
-    # Pass along the template specified on the command line.
-    # Note: command line argument overrides individual templates in the CSV
-    
-    # Note: we do not validate the specified template Space - that occurs
-    # during the create operation.
-
-    if space_template is not None:
-        if isinstance(space_template, str) and len(space_template.strip()) > 0:
-            # An actual template name was found.
-            create_args.append('--template')
-            create_args.append(space_template.strip())
-        else:
-            # We really didn't see a valid template name, check to see if one
-            # was passed on the "spaces bulk create --template" command line.
-            if space_args.template is not None:
-                create_args.append('--template')
-                create_args.append(space_args.template)
+    # Stream the rows from the CSV file straight into the create/delete operations.
+    rows = bulk.read_space_rows(space_args.filename, int(space_args.skip), space_args)
+
+    if space_args.bulk_subcommand == "create":
+        # Resolve the templates and users for the whole file up front so
+        # each row doesn't look them up again - the same pass counts the rows.
+        context, total = plan_create(bulk.read_space_rows(space_args.filename, int(space_args.skip), space_args, warn=False))
+
+        # Two rows for the same space would race each other when run in
+        # parallel - only the spaces being created right now are tracked.
+        in_flight = set()
+        in_flight_lock = threading.Lock()
+
+        def action(row):
+            space_id = row.spaceID.upper()
+
+            with in_flight_lock:
+                if space_id in in_flight:
+                    logger.warning(f"process_bulk: row {row.line} - space {space_id} is being created by another row - skipped.")
+                    return False
+
+                in_flight.add(space_id)
+
+            try:
+                return spaces_create(row, context)
+            finally:
+                with in_flight_lock:
+                    in_flight.discard(space_id)
+    elif space_args.bulk_subcommand == "delete":
+        action = spaces_delete
+        total = bulk.count_rows(space_args.filename, int(space_args.skip))
     else:
-        if space_args.template is not None:
-            create_args.append('--template')
-            create_args.append(space_args.template)
-
-    # Process a label if present in the CSV
-    # Note: we do not validate the label name - that occurs during
-    #       the create operation.
-
-    if space_business_name is not None and len(space_business_name) > 0:
-        create_args.append("--business")
-        create_args.append(space_business_name)
-
-    # Note: if disk or memory is not specified for this space
-    #       then the values will set to defaults or to the template
-    #       values (if specified).
-
-    if space_disk is not None and len(space_disk) > 0:
-        create_args.append("--disk")
-        create_args.append(space_disk)
-
-    if space_memory is not None and len(space_memory) > 0:
-        create_args.append("--memory")
-        create_args.append(space_memory)
-
-    # Add the NON-dPTIONAL space id parameter
-    create_args.append(space_id)
+        logger.error("process_bulk: invalid bulk operation.")
+        return
 
-    # Add in the NON-dPTIONAL list of users
-    for user in text_row[constants.CONST_USERS:]:
-        if isinstance(user, str) and len(user) > 0:
-            create_args.append(user.strip())
+    # Every row gets an outcome - write them next to the input file unless told otherwise.
+    results_file = space_args.results
 
-    spaces_create(cmdparse.parse(create_args))
+    if results_file is None:
+        results_file = space_args.filename + ".results.csv"
 
-def spaces_bulk_delete(text):
-    space_args = text.split(",")
-    space_id = space_args[0]
+    # CLI processes running side by side each need their own passcode - have them ready.
+    if space_args.cli:
+        session_config.dwc.get_passcode_pool(space_args.parallel)
 
-    delete_args = [ "spaces", "delete", space_id ]
+    # With a journal, rows that were done by an earlier (interrupted) run are skipped.
+    row_journal = journal.open_journal(space_args)
 
-    spaces_delete(cmdparse.parse(delete_args))
+    try:
+        bulk.run(rows, action, f"spaces bulk {space_args.bulk_subcommand}", parallel=space_args.parallel, 
+                 rate=space_args.rate, results_file=results_file, 
+                 total=total, journal=row_journal)
+    finally:
+        if row_journal is not None:
+            row_journal.close()
 
 def spaces_list(space_args):
     utility.start_timer("spaces_list")
@@ -272,86 +307,129 @@ def spaces_list(space_args):
     utility.write_json("spaces-list", spaces)  
     
     # Now loop over the spaces list and do additional queries to get all the details for each space.
+    # The per-space queries are independent so they are fanned out across the
+    # requested number of workers - the results come back in the original order.
 
-    space_list = []
-    
-    for current_space in spaces:
-        space_id = current_space["name"]  # This is the technical name for the space.
+    session_config.dwc.ensure_pool(space_args.workers)
 
-        logger.debug(f"spaces_list: starting space list for {space_id}")
-        
-        # Get the space details (including members/dbusers/connections/etc) from DWC.
-        # This returns a dict object with the space as the first key.
-        space = session_config.dwc.get_space(space_id)
+    space_list = session_config.dwc.map_concurrent(lambda current_space: spaces_list_space(space_args, current_space), spaces, space_args.workers)
 
-        # Pull out the space details from the query results.
-        space_def = space[space_id]["spaceDefinition"]
+    if len(space_list) == 0:
+        logger.warn("spaces_list: No spaces found.")
+    else:
+        writer.write_list(space_list, args=space_args)
 
-        # Compose the space row to be written to the output.  This is a combination
-        # of all the short space query attributes and the detailed query attributes.
-        new_space = copy.deepcopy(current_space)   # Start with a copy of the simple space defintion
-        new_space.update(space_def)                # Add the detailed space attributes
+    logger.debug(utility.log_timer("spaces_list", f"spaces_list: {len(space_list)} space(s) listed"))
 
-        # Add this completed space to the list - we love lists
-        space_list.append(new_space)
-        
-        # Ask for any connections defined for this space.
-        new_space["connections"] = session_config.dwc.get_connections(space_id)
+def spaces_list_space(space_args, current_space):
+    space_id = current_space["name"]  # This is the technical name for the space.
 
-        # Create a list object for this space's dbusers containing the list
-        # of schema objects available for building views.
-
-        if space_args.extend:
-            for object in session_config.dwc.get_dbuser_objects(space_id, new_space["dbusers"]):
-                # Add in the hastag username of the user as a distinct field.
-                object["dbuser"] = object["id"][:object["id"].find(".")]  
-                
-                if "dbuser_objects" not in new_space:
-                    new_space["dbuser_objects"] = []
-                    
-                new_space["dbuser_objects"].append(object)
- 
-        # Ask for additional categories of objects that may be associated with each space.
-        # These data are only available for members of the space - we may need to add ourselves.
+    logger.debug(f"spaces_list: starting space list for {space_id}")
     
-        # Check to see if the current user is a member of this space.  We can't collect
-        # info on various object types if we are not a member.
+    # Get the space details (including members/dbusers/connections/etc) from DWC.
+    # This returns a dict object with the space as the first key.
+    space = session_config.dwc.get_space(space_id)
 
-        is_member = session_config.dwc.is_member(space_id)
-        remove_member = False
-        
-        if not is_member:
-            if space_args.add:  # Did the user ask to add themselves?
-                session_config.add_member(current_space)
-                remove_member = True
+    # Pull out the space details from the query results.
+    space_def = space[space_id]["spaceDefinition"]
+
+    # Compose the space row to be written to the output.  This is a combination
+    # of all the short space query attributes and the detailed query attributes.
+    new_space = copy.deepcopy(current_space)   # Start with a copy of the simple space defintion
+    new_space.update(space_def)                # Add the detailed space attributes
+
+    # Ask for any connections defined for this space.
+    new_space["connections"] = session_config.dwc.get_connections(space_id)
+
+    # Create a list object for this space's dbusers containing the list
+    # of schema objects available for building views.
+
+    if space_args.extend:
+        for object in session_config.dwc.get_dbuser_objects(space_id, new_space["dbusers"]):
+            # Add in the hastag username of the user as a distinct field.
+            object["dbuser"] = object["id"][:object["id"].find(".")]  
             
-        # Pump out the data builder objects - this returns nothing if we are not a member
-        new_space["data_builder"] = session_config.dwc.get_data_builder_objects(space_id)
+            if "dbuser_objects" not in new_space:
+                new_space["dbuser_objects"] = []
+                
+            new_space["dbuser_objects"].append(object)
 
-        # Pump out the remote tables list - this returns nothing if we are not a member
-        if space_args.extend:
-            new_space["remote_tables"] = session_config.dwc.get_remote_tables(space_id)
-        else:
-            new_space["remote_tables"] = []
+    # Ask for additional categories of objects that may be associated with each space.
+    # These data are only available for members of the space - we may need to add ourselves.
 
-        # Pump out the business builder objects - this returns nothing if we are not a member
-        new_space["business_builder"] = session_config.dwc.get_business_builder_objects(space_id)
+    # Check to see if the current user is a member of this space.  We can't collect
+    # info on various object types if we are not a member.
 
-        # Take ourselves out of the space.
-        if remove_member:
-            session_config.space_remove_member(current_space)
+    is_member = session_config.dwc.is_member(space_id)
+    remove_member = False
+    
+    if not is_member:
+        if space_args.add:  # Did the user ask to add themselves?
+            session_config.dwc.add_members(space_id, session_config.dwc.get_user_name())
+            remove_member = True
+        
+    # Pump out the data builder objects - this returns nothing if we are not a member
+    new_space["data_builder"] = session_config.dwc.get_data_builder_objects(space_id)
 
-    if len(space_list) == 0:
-        logger.warn("spaces_list: No spaces found.")
+    # Pump out the remote tables list - this returns nothing if we are not a member
+    if space_args.extend:
+        new_space["remote_tables"] = session_config.dwc.get_remote_tables(space_id)
     else:
-        writer.write_list(space_list, args=space_args)
+        new_space["remote_tables"] = []
+
+    # Pump out the business builder objects - this returns nothing if we are not a member
+    new_space["business_builder"] = session_config.dwc.get_business_builder_objects(space_id)
+
+    # Take ourselves out of the space.
+    if remove_member:
+        session_config.dwc.remove_members(space_id, session_config.dwc.get_user_name())
+
+    return new_space
 
 def process_members(space_args):
     if space_args.member_subcommand == "list":
         members_list(space_args)
+    elif space_args.member_subcommand == "batch":
+        members_batch(space_args)
     else:
         members_action(space_args)
 
+def coalesce_members(commands):
+    """Merge runs of "spaces member add/remove" commands from a script.
+
+    Each run of consecutive member changes becomes a single "member batch"
+    command so every space in the run is read once and written once, no
+    matter how many lines of the script change it.
+    """
+
+    coalesced = []
+
+    for command_args in commands:
+        is_change = command_args.command == "spaces" and command_args.subcommand == "member" and \
+                    command_args.member_subcommand in [ "add", "remove" ]
+
+        if not is_change:
+            coalesced.append(command_args)
+            continue
+
+        previous = coalesced[-1] if len(coalesced) > 0 else None
+
+        if previous is not None and previous.command == "spaces" and previous.subcommand == "member" and \
+           previous.member_subcommand == "batch":
+            previous.batch.append(command_args)
+        else:
+            coalesced.append(argparse.Namespace(command="spaces", subcommand="member", member_subcommand="batch", batch=[ command_args ]))
+
+    # The batch is journaled as a whole.
+    for command_args in coalesced:
+        if getattr(command_args, "member_subcommand", None) == "batch" and \
+           all(getattr(batch_args, "journal_key", None) is not None for batch_args in command_args.batch):
+            command_args.journal_key = " + ".join(batch_args.journal_key for batch_args in command_args.batch)
+
+    # A run with a single command doesn't need a batch.
+    return [ command_args.batch[0] if getattr(command_args, "member_subcommand", None) == "batch" and len(command_args.batch) == 1 else command_args
+             for command_args in coalesced ]
+
 def members_list(space_args):
     space_list = session_config.dwc.query_spaces(space_args.spaceID, query=space_args.query)
 
@@ -377,6 +455,40 @@ def members_list(space_args):
     
     writer.write_list(members_list, args=space_args)
 
+def members_batch(space_args):
+    # Apply all the member changes for each space to one copy of the space
+    # and write it back once.  Changes to the same space keep their script
+    # order.
+
+    space_commands = {}
+
+    for command_args in space_args.batch:
+        space_commands.setdefault(command_args.spaceID, []).append(command_args)
+
+    for space_id, commands in space_commands.items():
+        space = None
+        changed = False
+
+        for command_args in commands:
+            if not session_config.dwc.is_space(space_id):
+                logger.warn("member_action: invalid space name specified")
+                continue
+
+            if space is None:
+                space = session_config.dwc.get_space(space_id)
+
+            if command_args.member_subcommand == "add":
+                changed = session_config.dwc.add_members(space, command_args.user, command_args.query, put=False) or changed
+            else:
+                changed = session_config.dwc.remove_members(space, command_args.user, command_args.query, put=False) or changed
+
+        if changed:
+            response = session_config.dwc.put_space(space)
+
+            if response is None or response.status_code >= 400:
+                for command_args in commands:
+                    logger.error(f"members_batch: space {space_id} - member {command_args.member_subcommand} {' '.join(command_args.user)} not saved.")
+
 def members_action(space_args):
     if not session_config.dwc.is_space(space_args.spaceID,):
         logger.warn("member_action: invalid space name specified")
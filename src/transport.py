@@ -0,0 +1,135 @@
+import logging, time, random, threading, email.utils
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("transport")
+
+# Statuses the tenant sends back when it is overloaded or a backend is
+# briefly unavailable - these are worth another try.
+retry_statuses = [ 429, 502, 503, 504 ]
+
+# Only these methods can be repeated after the tenant may have processed
+# the first attempt.  Other methods (POST) are only retried when we know
+# the request never got through.
+idempotent_methods = [ "GET", "HEAD", "OPTIONS", "PUT", "DELETE" ]
+
+class DWCTransport(HTTPAdapter):
+    """Transport adapter for the DWC requests session.
+
+    Adds a sized, blocking connection pool (keep-alive connections are
+    reused and never exceed the pool size), idempotency-aware retries with
+    jittered exponential backoff and Retry-After handling, and a count of
+    the retries needed for each endpoint.
+    """
+
+    def __init__(self, retries=5, backoff=0.5, backoff_max=30, retry_after_max=300, pool_size=10):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+
+        self.retry_counts = {}
+        self.counts_lock = threading.Lock()
+
+        # The session tells us which named endpoint each thread is calling.
+        self.local = threading.local()
+
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+
+    def resize(self, pool_size):
+        # Start a new, bigger pool for the next requests.  The current pool
+        # isn't cleared - requests in flight on other threads keep their
+        # connections, which are closed once the old pool is released.
+        self.init_poolmanager(pool_size, pool_size, block=self._pool_block)
+
+    def set_endpoint(self, url_name):
+        self.local.endpoint = url_name
+
+    def get_endpoint(self, request):
+        endpoint = getattr(self.local, "endpoint", None)
+
+        if endpoint is None:
+            endpoint = request.method + " " + urlparse(request.url).path
+
+        return endpoint
+
+    def get_retry_counts(self):
+        with self.counts_lock:
+            return dict(self.retry_counts)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+
+        while True:
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.retries or not self.can_retry(request, None, e):
+                    raise
+
+                reason = type(e).__name__
+                delay = self.backoff_delay(attempt)
+            else:
+                if response.status_code not in retry_statuses or attempt >= self.retries:
+                    return response
+
+                if not self.can_retry(request, response.status_code, None):
+                    return response
+
+                reason = f"status {response.status_code}"
+                delay = self.retry_after(response, attempt)
+
+                # Release the connection back to the pool before waiting.
+                response.close()
+
+            attempt += 1
+
+            endpoint = self.get_endpoint(request)
+
+            with self.counts_lock:
+                self.retry_counts[endpoint] = self.retry_counts.get(endpoint, 0) + 1
+
+            logger.info(f"{endpoint}: {reason} - retry {attempt} of {self.retries} in {delay:.2f}s")
+
+            time.sleep(delay)
+
+    def can_retry(self, request, status_code, error):
+        if request.method in idempotent_methods:
+            return True
+
+        # A POST is only safe to repeat if the tenant refused it outright or
+        # we never managed to connect.
+
+        if status_code == 429:
+            return True
+
+        return isinstance(error, requests.exceptions.ConnectTimeout)
+
+    def backoff_delay(self, attempt):
+        # Exponential backoff with jitter so parallel workers that failed
+        # together do not all come back at the same moment.
+
+        delay = min(self.backoff_max, self.backoff * (2 ** attempt))
+
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def retry_after(self, response, attempt):
+        # Honor the tenant's Retry-After header - it may be a number of
+        # seconds or an HTTP date.
+
+        header = response.headers.get("Retry-After")
+
+        if header is None:
+            return self.backoff_delay(attempt)
+
+        try:
+            delay = float(header)
+        except ValueError:
+            try:
+                delay = email.utils.parsedate_to_datetime(header).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return self.backoff_delay(attempt)
+
+        return min(self.retry_after_max, max(0, delay))
@@ -0,0 +1,81 @@
+import logging
+from types import MappingProxyType
+
+logger = logging.getLogger("user_directory")
+
+def freeze(value):
+    # A read-only version of a user - all the way down, the directory is
+    # shared by every command (and every request to the daemon).
+
+    if isinstance(value, dict):
+        return MappingProxyType({ key : freeze(item) for key, item in value.items() })
+
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+
+    return value
+
+def thaw(value):
+    # A changeable copy of a frozen user.
+
+    if isinstance(value, MappingProxyType):
+        return { key : thaw(item) for key, item in value.items() }
+
+    if isinstance(value, tuple):
+        return [ thaw(item) for item in value ]
+
+    return value
+
+class UserDirectory:
+    """Read-only directory of the users in a tenant.
+
+    The indexes and search text are built once when the user list is
+    loaded.  Users are handed out frozen (see freeze) - callers that want
+    to change a user must make their own copy with thaw.
+    """
+
+    def __init__(self, users):
+        self.users = []
+        self.by_name = {}
+        self.by_email = {}
+        self.haystack = []
+
+        for user in users:
+            user_view = freeze(user)
+
+            self.users.append(user_view)
+
+            # Keep the first user for any name or email - the same as a
+            # front-to-back scan of the list would find.
+            self.by_name.setdefault(user["userName"].upper(), user_view)
+
+            email = user.get("parameters", {}).get("EMAIL")
+
+            if isinstance(email, str) and len(email) > 0:
+                self.by_email.setdefault(email.upper(), user_view)
+
+            # Query searches look for the pattern anywhere in the user
+            # definition - render it once.
+            self.haystack.append(str(user).upper())
+
+    def __len__(self):
+        return len(self.users)
+
+    def all(self):
+        return list(self.users)
+
+    def find(self, pattern):
+        # Exact match on either the user name or the email address.
+        pattern = pattern.upper()
+
+        user = self.by_name.get(pattern)
+
+        if user is None:
+            user = self.by_email.get(pattern)
+
+        return user
+
+    def search(self, pattern):
+        pattern = pattern.upper()
+
+        return [ self.users[index] for index, text in enumerate(self.haystack) if text.find(pattern) != -1 ]
@@ -1,6 +1,6 @@
 import logging
 
-import session_config, utility, writer
+import session_config, utility, writer, user_directory
 
 logger = logging.getLogger("spaces")
 
@@ -20,6 +20,10 @@ def users_list(user_args):
     user_list = []  # We love lists.
     
     for user in session_config.dwc.get_users(user_args.users, user_args.query):
+        # The directory hands out read-only users - take a copy before
+        # adding the ETL attributes below.
+        user = user_directory.thaw(user)
+
         # Do some fixup to streamline the user information by pulling some
         # specific attributes up from subobjects.
 
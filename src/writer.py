@@ -1,9 +1,21 @@
-import logging
+import logging, threading, importlib
 
 import session_config
-import writer_hana, writer_csv, writer_text, writer_json
 
 logger = logging.getLogger('writer')
+
+# Commands in a script may run in parallel - only one writes at a time
+# (the HANA writer shares a single connection).
+write_lock = threading.Lock()
+
+# The writer module for each output format - only the one used is imported
+# (parquet pulls in pyarrow).
+writers = { "hana"    : "writer_hana",
+            "csv"     : "writer_csv",
+            "json"    : "writer_json",
+            "text"    : "writer_text",
+            "parquet" : "writer_parquet",
+            "sqlite"  : "writer_sqlite" }
         
 def write_list(list_data, args=None):
     logger.setLevel(session_config.log_level)
@@ -12,13 +24,9 @@ def write_list(list_data, args=None):
         logger.error(f'invalid list passed to write_list: target {args.format}.')
         return
 
-    if args.format == "hana":
-        writer_hana.write_list(list_data, args)
-    elif args.format == "csv":
-        writer_csv.write_list(list_data, args)
-    elif args.format == "json":
-        writer_json.write_list(list_data, args)
-    elif args.format == "text":
-        writer_text.write_list(list_data, args)
-    else:
-        logger.warn(f"Unexpected target for output: {format}")
+    if args.format not in writers:
+        logger.warn(f"Unexpected target for output: {args.format}")
+        return
+
+    with write_lock:
+        importlib.import_module(writers[args.format]).write_list(list_data, args)
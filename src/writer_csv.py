@@ -1,76 +1,142 @@
-import logging
+import logging, os, csv
 
 import session_config
 
 logger = logging.getLogger("writer_csv")
 
+# Every file numbers its rows - the rows of a nested list point back to
+# the row they came from.  A data attribute with the same name keeps its
+# name - the generated column gets this prefix instead.
+row_id_column = "ROW_ID"
+parent_row_id_column = "PARENT_ROW_ID"
+generated_prefix = "_"
+
+# Output is written through a large buffer rather than line by line.
+buffer_size = 1024 * 1024
+
+def get_row_id_columns(file_name, column_names):
+    # The names of the generated row id and parent row id columns of a
+    # file - prefixed until they don't clash with a data column.
+
+    names = []
+
+    for name in [ row_id_column, parent_row_id_column ]:
+        generated = name
+
+        while generated in column_names:
+            generated = generated_prefix + generated
+
+        if generated != name:
+            logger.warning(f"get_row_id_columns: {file_name} has a {name} attribute - the generated column is {generated}.")
+
+        names.append(generated)
+
+    return tuple(names)
+
 def recurse_columns(columns, list_data, prefix):
     csv_name = prefix.upper()
 
     # Search through all the rows because some columns are not consistently
     # returned by the URL/REST queries.  Looping over all the rows helps ensure
-    # we capture all the possible columns (attributes).
-        
+    # we capture all the possible columns (attributes).  The columns of each
+    # file are kept in a dict - it keeps the order we found them in and
+    # checking for a column we already have is a single lookup.
+
     for row in list_data:
         if not isinstance(row, dict):
             continue
-        
-        row_column_names = row.keys()
 
         # Lazy instantiation of the column list - we may see
         # not see the same csv content in every pass through
         # list objects.
-        
+
         if csv_name not in columns:
-            columns[csv_name] = { "columns": [], "file_handle" : None }
+            columns[csv_name] = {}
 
-        for column_name in row_column_names:
+        for column_name, value in row.items():
             if column_name.find("@") != -1:  # Exclude metadata columns.
                 continue
 
-            # For each column we add, record the name of the column.
-            # DWC queries are sometimes inconsistent about columns and we
-            # can use this list to ensure all columns are accounted for
-            # across all rows in the CSV file.
+            columns[csv_name][column_name] = True
 
-            if column_name not in columns[csv_name]["columns"]:
-                columns[csv_name]["columns"].append(column_name)
+            # Every row's list goes into the child file, so every row's
+            # list can add columns to it.
+            if isinstance(value, list):
+                recurse_columns(columns, value, csv_name + "_" + column_name)
 
-                if isinstance(row[column_name], list):
-                    recurse_columns(columns, row[column_name], csv_name + "_" + column_name)
+class CsvFiles:
+    # The open output files of a list and its nested lists, opened as the
+    # first row for each one is written.
 
-def write_csv(columns, list_data, prefix):
-    csv_name = prefix.upper()
-    csv_file = csv_name + ".csv"
+    def __init__(self, columns, directory):
+        self.columns = columns
+        self.directory = directory
+        self.handles = {}
+        self.writers = {}
+        self.row_ids = {}
+        self.row_id_columns = {}
+
+    def get_writer(self, csv_name, is_child):
+        if csv_name not in self.writers:
+            csv_file = csv_name + ".csv"
 
-    if csv_name not in columns:
-        logger.warn(f"write_csv passed unexpected CSV object name: {csv_name}")
+            if self.directory is not None:
+                csv_file = os.path.join(self.directory, csv_file)
 
-    if columns[csv_name]["file_handle"] is None:
-        # Open the file and output the heading row for this file.
+            self.row_id_columns[csv_name] = get_row_id_columns(csv_name, self.columns[csv_name])
 
-        columns[csv_name]["file_handle"] = open(csv_file, "w")
+            row_id_name, parent_row_id_name = self.row_id_columns[csv_name]
 
-        heading_line = ""
-        comma = ""
+            heading = [ row_id_name ] + ([ parent_row_id_name ] if is_child else []) + list(self.columns[csv_name])
 
-        for heading in columns[csv_name]["columns"]:
-            heading_line += comma + '"' + heading + '"'
-            comma = ","
+            self.handles[csv_name] = open(csv_file, "w", newline="", encoding="utf-8", buffering=buffer_size)
 
-        columns[csv_name]["file_handle"].write(f"{heading_line}\n")
+            # Missing columns are written as empty values.
+            self.writers[csv_name] = csv.DictWriter(self.handles[csv_name], heading, restval="", extrasaction="ignore")
+            self.writers[csv_name].writeheader()
+
+            self.row_ids[csv_name] = 0
+
+        return self.writers[csv_name]
+
+    def close(self):
+        for csv_name in self.handles:
+            self.handles[csv_name].close()
+
+def write_csv(files, list_data, prefix, parent_row_id=None):
+    csv_name = prefix.upper()
+
+    if csv_name not in files.columns:
+        return  # A list of simple values, not rows.
 
     for row in list_data:
-        output_line = ""
-        comma = ""
-        
-        for column_name in columns[csv_name]["columns"]:
-            if column_name in row:
-                output_line += comma + str(row[column_name])
-                comma = ","
-            
-        columns[csv_name]["file_handle"].write(f"{output_line}\n")
-    
+        if not isinstance(row, dict):
+            continue
+
+        writer = files.get_writer(csv_name, parent_row_id is not None)
+
+        files.row_ids[csv_name] += 1
+        row_id = files.row_ids[csv_name]
+
+        row_id_name, parent_row_id_name = files.row_id_columns[csv_name]
+
+        output_row = { row_id_name : row_id }
+
+        if parent_row_id is not None:
+            output_row[parent_row_id_name] = parent_row_id
+
+        for column_name, value in row.items():
+            if value is not None:
+                output_row[column_name] = value if isinstance(value, str) else str(value)
+
+        writer.writerow(output_row)
+
+        # The nested lists of this row go to their own files, pointing
+        # back to this row.
+        for column_name, value in row.items():
+            if isinstance(value, list) and column_name.find("@") == -1:
+                write_csv(files, value, csv_name + "_" + column_name, row_id)
+
 def write_list(list_data, args):
     logger.setLevel(session_config.log_level)
 
@@ -78,13 +144,18 @@ def write_list(list_data, args):
     # creating from this object.  There may be many sub-objects
     # in the JSON - each one gets a separate file.
     columns = {}
-    
+
     recurse_columns(columns, list_data, args.prefix)
 
-    write_csv(columns, list_data, args.prefix)
+    directory = getattr(args, "directory", None)
+
+    if directory is not None and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    files = CsvFiles(columns, directory)
 
-    # Every sub-list may have generated an open file, close them all.
-    
-    for csv_name in columns:
-        if columns[csv_name]["file_handle"] is not None and columns[csv_name]["file_handle"].closed == False:
-            columns[csv_name]["file_handle"].close()
\ No newline at end of file
+    try:
+        write_csv(files, list_data, args.prefix)
+    finally:
+        # Every sub-list may have generated an open file, close them all.
+        files.close()
@@ -13,6 +13,41 @@ cursor = None
 timestamps = [ "createTime", "validFrom", "lastSuccessfulConnect", "lastInvalidConnectAttempt", "modification_date", "creation_date" ]
 date_fields = [ "LAST_LOGIN_DATE" ]
 
+# Rows sent to HANA in a single executemany call (and commit).
+batch_size = 10000
+
+sql_templates = { "drop"   : 'drop table {} cascade',
+                  "create" : 'create column table {} (',
+                  "insert" : 'insert into {} values (' }
+
+# Columns identifying a row in each table, by list and table (suffix
+# after the prefix).  Rows of a nested list also carry the key of the row
+# they came from (see add_parent_columns).  With "--hana-mode upsert",
+# tables without a hint are matched on all their columns - only rows not
+# already there are added.
+key_hints = {
+    "spaces"      : { ""             : [ "name" ],
+                      "_CONNECTIONS" : [ "id" ] },
+    "users"       : { ""             : [ "userName" ],
+                      "_ROLES_LIST"  : [ "userName", "roleName" ] },
+    "members"     : { ""             : [ "space_name", "name" ] },
+    "connections" : { ""             : [ "id" ] },
+    "shares"      : { ""             : [ "spaceName", "objectName", "targetSpace" ] }
+}
+
+# A list of some spaces still has all the rows for those spaces - the
+# rows of the spaces listed are complete.
+scope_hints = {
+    "members"     : [ "space_name" ]
+}
+
+# Arguments selecting which objects are listed - when none are given, the
+# list is the full inventory of the tenant.
+selection_args = [ "spaceID", "users", "connection", "sourceSpace", "sourceObject", "targetSpace" ]
+
+# Columns carrying the key of the parent row start with this.
+parent_column_prefix = "PARENT_"
+
 def hana_connect():
     '''Connect to HANA
 
@@ -42,6 +77,9 @@ def hana_connect():
                              sslValidateCertificate=ssl
                             )
         
+        # Rows are committed a batch at a time - see execute_dml.
+        conn.setautocommit(False)
+
         cursor = conn.cursor()
 
     return True
@@ -51,26 +89,84 @@ def hana_execute(sql_statement, bind_values=[]):
         if not hana_connect():   # Ensure the connection
             logger.error("Invalid HANA connection")
             logger.error(sql_statement)
-            return
+            return False
 
         cursor.execute(sql_statement, bind_values)
     except Exception as e:
-        logger.error("SQL Error: {}".format(e.errortext))
+        logger.error("SQL Error: {}".format(getattr(e, "errortext", e)))
         logger.error(sql_statement)
 
-def create_ddl(list_obj, args):
+        return False
+
+    return True
+
+def hana_execute_many(sql_statement, rows):
+    # Send a whole batch of rows in one round trip and commit it - a
+    # failed batch is rolled back so the table never holds half a batch.
+
+    try:
+        if not hana_connect():   # Ensure the connection
+            logger.error("Invalid HANA connection")
+            logger.error(sql_statement)
+            return False
+
+        cursor.executemany(sql_statement, rows)
+        conn.commit()
+    except Exception as e:
+        logger.error("SQL Error: {}".format(getattr(e, "errortext", e)))
+        logger.error(sql_statement)
+
+        conn.rollback()
+
+        return False
+
+    return True
+
+def hana_query(sql_statement, bind_values=[]):
+    try:
+        if not hana_connect():   # Ensure the connection
+            logger.error("Invalid HANA connection")
+            logger.error(sql_statement)
+            return None
+
+        cursor.execute(sql_statement, bind_values)
+
+        return cursor.fetchall()
+    except Exception as e:
+        logger.error("SQL Error: {}".format(getattr(e, "errortext", e)))
+        logger.error(sql_statement)
+
+        return None
+
+def hana_commit():
+    if conn is not None:
+        conn.commit()
+
+def hana_rollback():
+    if conn is not None:
+        conn.rollback()
+
+def create_ddl(list_obj, args, templates=None):
     """Create a SQL definition for a list of objects
+
+    The statement templates default to HANA - other databases pass
+    their own (see writer_sqlite).
     """
     logger.debug(f'Entering create_table_sql: {args.prefix}')
 
     ddl = {}
 
-    drop_sql_tmpl = 'drop table {} cascade'
-    create_sql_tmpl = 'create column table {} ('
-    insert_sql_tmpl = 'insert into {} values ('
+    if templates is None:
+        templates = sql_templates
+
+    drop_sql_tmpl = templates["drop"]
+    create_sql_tmpl = templates["create"]
+    insert_sql_tmpl = templates["insert"]
 
     recurse_columns(ddl, list_obj, args.prefix.upper())
 
+    add_parent_columns(ddl, args)
+
     # Build all the SQL statements for all the columns
 
     for table_name in ddl:
@@ -86,11 +182,9 @@ def create_ddl(list_obj, args):
         insert_sql = insert_sql_tmpl.format(table_name)
         comma = ""
 
-        for column_name in ddl[table_name]["columns"]:
-            column_def = ddl[table_name]["columns"][column_name]
-
+        for column_def in get_column_defs(ddl, table_name):
             create_sql += "\n" + comma + '"' + column_def["name"] + '" ' + column_def["type"]
-            insert_sql += "\n" + comma + ":" + column_def["name"]
+            insert_sql += "\n" + comma + "?"
             comma = ","
 
         ddl[table_name]["create"] = create_sql + ')'
@@ -98,6 +192,60 @@ def create_ddl(list_obj, args):
 
     return ddl
 
+def get_key_columns(ddl, table_name, args):
+    # The columns (as found in the rows) of the key hint for this table -
+    # None when there is no hint or the rows don't have the columns.
+
+    prefix = args.prefix.upper()
+    hints = key_hints.get(args.command, {})
+    suffix = table_name[len(prefix):] if table_name.startswith(prefix) else None
+
+    columns = ddl[table_name]["columns"]
+
+    for hint_suffix in hints:
+        if hint_suffix.upper() == suffix:
+            if all(column_name in columns for column_name in hints[hint_suffix]):
+                return hints[hint_suffix]
+
+            logger.warning(f"get_key_columns: key columns {hints[hint_suffix]} for {table_name} not found in the rows.")
+
+    return None
+
+def add_parent_columns(ddl, args):
+    # Rows of a nested list (e.g. the members of a space) get the key of
+    # the row they came from so they can be told apart from the same rows
+    # of another parent.  A parent without a key passes on its own parent
+    # key, so a table is always tied to its nearest ancestor with a key.
+    # Parents come before their children in the ddl.
+
+    for table_name in ddl:
+        table_def = ddl[table_name]
+
+        table_def["key"] = get_key_columns(ddl, table_name, args) if len(table_def["columns"]) > 0 else None
+        table_def["parent_columns"] = []
+
+        parent_name = table_def.get("parent")
+
+        if parent_name is None:
+            continue
+
+        parent_def = ddl[parent_name]
+
+        if parent_def["key"] is None:
+            table_def["parent_columns"] = parent_def["parent_columns"]
+        else:
+            for column_name in parent_def["key"]:
+                column_def = parent_def["columns"][column_name]
+
+                table_def["parent_columns"].append({ "name"   : parent_column_prefix + column_def["name"],
+                                                     "type"   : column_def["type"],
+                                                     "table"  : parent_name,
+                                                     "source" : column_def["name"] })
+
+def get_column_defs(ddl, table_name):
+    # All the columns of a table - the parent key comes first.
+    return ddl[table_name].get("parent_columns", []) + list(ddl[table_name]["columns"].values())
+
 def recurse_columns(ddl, list_data, param_name):
     table_name = param_name.upper()
 
@@ -133,6 +281,12 @@ def recurse_columns(ddl, list_data, param_name):
 
                 if isinstance(row[column_name], list):
                     recurse_columns(ddl, row[column_name], table_name + "_" + column_name)
+
+                    # Remember where the nested rows come from.
+                    child_name = (table_name + "_" + column_name).upper()
+
+                    if child_name in ddl:
+                        ddl[child_name]["parent"] = table_name
             else:
                 sql_type = "NVARCHAR(5000)"
 
@@ -146,7 +300,7 @@ def recurse_columns(ddl, list_data, param_name):
 
                 if column["type"] is None: 
                     ddl[table_name]["columns"][column_name]["type"] = sql_type
-                elif column["type"] == "BIGINT" and sql_type.startswith("NVARCHAR"):
+                elif column["type"] == "BIGINT" and (sql_type.startswith("NVARCHAR") or sql_type == "CLOB"):
                     ddl[table_name]["columns"][column_name]["type"] = sql_type
                 elif column["type"].startswith("NVARCHAR") and sql_type == "CLOB":
                     ddl[table_name]["columns"][column_name]["type"] = sql_type
@@ -167,72 +321,313 @@ def execute_ddl(ddl, statement_name):
 
             hana_execute(sql_statement)
 
+def convert_value(column_name, column_def, value):
+    # Fix up a value so it aligns with the DDL computed earlier - this
+    # includes fixing timestamps and handling complex objects.
+
+    # Not all queries to DWC reliably return exactly the same columns.
+    if value is None:
+        return None
+
+    if column_name in timestamps:
+        # Fix-up timestamps by chopping off extend milliseconds and timezone info.
+        # Note: dateFields do not need adjustment because they have default HANA
+        #       formatting that do not need to be adjusted.
+
+        return value[0:23]
+
+    if column_name in date_fields:
+        # This is an epoch date, convert the value before
+        epoch_time = time.gmtime(int(value[0:10]))
+
+        return dt.datetime(*epoch_time[:7]).strftime("%Y-%m-%d %H:%M:%S")
+
+    if column_def["type"] == 'CLOB':
+        # Convert complex objects to strings that get inserted as CLOB values
+        return str(value)
+
+    # Just a normal value
+    return value
+
+def collect_rows(ddl, list_data, table_name, batches, flush, parent_values=(), only=None):
+    # Add the rows of a list - and the rows of any lists nested in them -
+    # to the batch for their table, handing each full batch to flush.
+    # With "only", just the rows of that one table are collected.
+
+    if table_name not in ddl or "columns" not in ddl[table_name]:
+        return
+
+    columns = ddl[table_name]["columns"]
+    key = ddl[table_name].get("key")
+
+    for row in list_data:
+        if not isinstance(row, dict):
+            return
+
+        # Build the values in column order, independant of the columns
+        # present in this row - missing values are inserted as NULL.
+
+        values = { column_name : convert_value(column_name, columns[column_name], row.get(column_name)) for column_name in columns }
+
+        if only is None or only == table_name:
+            batch = batches.setdefault(table_name, [])
+            batch.append(tuple(parent_values) + tuple(values.values()))
+
+            if len(batch) >= batch_size:
+                flush(table_name, batch)
+                batches[table_name] = []
+
+        # The nested rows carry the key of this row - or, without a key,
+        # the key this row got from its own parent.
+        child_values = parent_values if key is None else tuple(values[column_name] for column_name in key)
+
+        for column_name in columns:
+            # If this is a list, recurse to load the child table.
+            if columns[column_name]["type"] == 'CLOB' and isinstance(row.get(column_name), list):
+                collect_rows(ddl, row[column_name], (table_name + "_" + column_name).upper(), batches, flush, child_values, only)
+
 def execute_dml(ddl, statement_name, list_data, param_name):
+    """Load a list, and the lists nested in it, into the tables.
+
+    Rows are buffered per table and sent "batch_size" rows at a time
+    with executemany - each batch is its own transaction.  Returns False
+    when any batch failed.
+    """
+
     if ddl is None or not isinstance(ddl, dict) or len(ddl) == 0:
         logger.error("Invalid ddl object passed to execute_dml.")
-        return
+        return False
+
+    table_name = param_name.upper()
 
     if list_data is None or isinstance(list_data, list) == False:
         logger.error(f"invalid list object passed to execute_dml - table {table_name}")
-        return
+        return False
 
-    table_name = param_name.upper()
+    counts = {}
+    failed = {}
 
-    # There are some lists that are not objects, skip
+    def flush(flush_table, rows):
+        # There are some lists that are not objects, skip
+        if statement_name not in ddl[flush_table] or len(rows) == 0:
+            return
 
-    if table_name not in ddl:
-        return
+        if hana_execute_many(ddl[flush_table][statement_name], rows):
+            counts[flush_table] = counts.get(flush_table, 0) + len(rows)
+        else:
+            failed[flush_table] = failed.get(flush_table, 0) + len(rows)
+
+    batches = {}
+
+    collect_rows(ddl, list_data, table_name, batches, flush)
+
+    # Whatever is left over is the last, partial, batch of each table.
+    for batch_table in batches:
+        flush(batch_table, batches[batch_table])
+
+    for count_table in counts:
+        logger.info(f"execute_dml: {counts[count_table]} row(s) loaded into {count_table}")
+
+    for failed_table in failed:
+        logger.error(f"execute_dml: {failed[failed_table]} row(s) failed to load into {failed_table}")
+
+    return len(failed) == 0
+
+def get_table_columns(table_name):
+    # The columns of an existing table - an empty list when the table
+    # doesn't exist (yet).
+
+    rows = hana_query("select column_name from table_columns where schema_name = current_schema and table_name = ?", [ table_name ])
+
+    return [] if rows is None else [ row[0] for row in rows ]
+
+def get_index_columns(ddl, table_name):
+    # The parent key and the table's own key - these identify a row when
+    # the table has a key hint.
+
+    key = ddl[table_name].get("key") or []
+    columns = ddl[table_name]["columns"]
+
+    return [ column_def["name"] for column_def in ddl[table_name].get("parent_columns", []) ] + \
+           [ columns[column_name]["name"] for column_name in key ]
+
+def get_match_columns(ddl, table_name):
+    # The columns used to find a row again.  Without a key, a row is only
+    # the same row when all of its values are - LOB values can't be
+    # compared, so CLOB columns don't count.
+
+    if ddl[table_name].get("key") is not None:
+        return get_index_columns(ddl, table_name)
+
+    match_columns = get_index_columns(ddl, table_name) + \
+                    [ column_def["name"] for column_def in ddl[table_name]["columns"].values() if column_def["type"] != "CLOB" ]
+
+    if len(match_columns) == 0:
+        raise ValueError(f"{table_name} has no key and only CLOB columns - rows can't be matched for an upsert.")
+
+    return match_columns
+
+def is_full_list(args):
+    # Nothing was selected - every object in the tenant was listed.
+    return all(getattr(args, name, None) in [ None, [], "" ] for name in selection_args)
+
+def equals(left, right, name, right_name=None):
+    # Compare a column of two tables, where NULL matches NULL.
+
+    right_name = name if right_name is None else right_name
+
+    return f'({left}."{name}" = {right}."{right_name}" or ({left}."{name}" is null and {right}."{right_name}" is null))'
+
+def prepare_table(ddl, table_name):
+    # Create the table if it is new, otherwise add any columns the
+    # current rows have that the table doesn't - existing columns, and
+    # the rows in them, are left alone.
 
-    if statement_name not in ddl[table_name]:
+    existing = set(get_table_columns(table_name))
+
+    if len(existing) == 0:
+        hana_execute(ddl[table_name]["create"])
         return
 
-    sql_stmt = ddl[table_name][statement_name]
+    for column_def in get_column_defs(ddl, table_name):
+        if column_def["name"] not in existing:
+            logger.info(f"prepare_table: adding column {column_def['name']} to {table_name}")
 
-    for row in list_data:
-        # Build the list of values to pass to the insert statement independant
-        # of the actual values.  We need to insert any missing values to make
-        # sure all the bind variables are present in the values passed to the
-        # statement.
+            hana_execute(f'alter table {table_name} add ("{column_def["name"]}" {column_def["type"]})')
+
+def create_merge(ddl, table_name):
+    # Merge the staged rows into the table - rows are matched on the key
+    # columns and only updated when a value changed.  LOB values can't be
+    # compared, so CLOB columns are written with the other changes but
+    # don't trigger an update on their own.
+
+    column_defs = get_column_defs(ddl, table_name)
+    match_columns = get_match_columns(ddl, table_name)
+
+    names = [ column_def["name"] for column_def in column_defs ]
+    compared = [ column_def["name"] for column_def in column_defs if column_def["type"] != "CLOB" and column_def["name"] not in match_columns ]
+
+    def differs(name):
+        return f'(T."{name}" <> S."{name}" or (T."{name}" is null and S."{name}" is not null) or (T."{name}" is not null and S."{name}" is null))'
+
+    match = " and ".join(equals("T", "S", name) for name in match_columns)
+
+    merge_sql = f'merge into {table_name} T using "{ddl[table_name]["staging"]}" S on {match}'
+
+    updated = [ name for name in names if name not in match_columns ]
+
+    if len(compared) > 0:
+        merge_sql += "\nwhen matched and (" + " or ".join(differs(name) for name in compared) + ")"
+        merge_sql += "\nthen update set " + ", ".join(f'T."{name}" = S."{name}"' for name in updated)
 
-        insert_values = {}
+    merge_sql += "\nwhen not matched then insert (" + ", ".join(f'"{name}"' for name in names) + ")"
+    merge_sql += "\nvalues (" + ", ".join(f'S."{name}"' for name in names) + ")"
 
-        for column_name in ddl[table_name]["columns"]:
-            column_def = ddl[table_name]["columns"][column_name]
+    return merge_sql
 
-            # Check for missing values - not all queries to DWC reliably return exactly the same columns
+def create_delete(ddl, table_name, args):
+    # Remove the rows that are no longer there - but only where the new
+    # rows are complete: everywhere for a full list, otherwise the rows
+    # of the parents that were listed (or the scope_hints columns of the
+    # rows that were listed).  Returns None when nothing can be removed.
 
-            if column_name not in row or row[column_name] is None:
-                insert_values[column_def["name"]] = None
-            else:            
-                if column_name in timestamps:
-                    # Fix-up timestamps by chopping off extend milliseconds and timezone info.
-                    # Note: dateFields do not need adjustment because they have default HANA
-                    #       formatting that do not need to be adjusted.
+    staging = ddl[table_name]["staging"]
 
-                    insert_values[column_def["name"]] = row[column_name][0:23]
-                elif column_name in date_fields:
-                    # This is an epoch date, convert the value before
-                    epoch_time = time.gmtime(int(row[column_name][0:10]))
-                    date_value = dt.datetime(*epoch_time[:7]).strftime("%Y-%m-%d %H:%M:%S")
+    match = " and ".join(equals(table_name, "S", name) for name in get_match_columns(ddl, table_name))
 
-                    insert_values[column_def["name"]] = date_value
-                elif column_def["type"] == 'CLOB':
-                    # Convert complex objects to strings that get inserted as CLOB values
-                    insert_values[column_def["name"]] = str(row[column_name])
+    delete_sql = f'delete from {table_name} where not exists (select 1 from "{staging}" S where {match})'
 
-                    # if this is a list, recurse to find additional table types.
+    if is_full_list(args):
+        return delete_sql
 
-                    if isinstance(row[column_name], list):
-                        execute_dml(ddl, statement_name, row[column_name], table_name + "_" + column_name)
-                else:
-                    # Just a normal value
-                    insert_values[column_def["name"]] = row[column_name]
+    parent_columns = ddl[table_name]["parent_columns"]
 
-        hana_execute(sql_stmt, insert_values)
+    if len(parent_columns) > 0:
+        parent_staging = ddl[parent_columns[0]["table"]]["staging"]
+        scope = " and ".join(equals(table_name, "P", column_def["name"], column_def["source"]) for column_def in parent_columns)
+
+        return delete_sql + f'\nand exists (select 1 from "{parent_staging}" P where {scope})'
+
+    columns = ddl[table_name]["columns"]
+    scope_columns = scope_hints.get(args.command)
+
+    if ddl[table_name].get("parent") is None and scope_columns is not None and all(column_name in columns for column_name in scope_columns):
+        scope = " and ".join(equals(table_name, "P", columns[column_name]["name"]) for column_name in scope_columns)
+
+        return delete_sql + f'\nand exists (select 1 from "{staging}" P where {scope})'
+
+    return None
+
+def upsert_list(list_data, args):
+    """Merge the list into the existing tables.
+
+    The rows are bulk loaded into local temporary staging tables first,
+    then merged into the target tables in a single statement per table,
+    so the targets are never dropped or emptied.  Rows missing from the
+    new list are removed where the list is complete (see create_delete).
+    When the staging tables can't be loaded completely, the targets are
+    left untouched and False is returned.
+    """
+
+    ddl = create_ddl(list_data, args)
+
+    tables = [ table_name for table_name in ddl if len(ddl[table_name]["columns"]) > 0 ]
+
+    # Local temporary tables are only seen by this connection and go
+    # away with it.
+    for table_name in tables:
+        ddl[table_name]["staging"] = "#" + table_name
+
+    # Build the statements before touching the database - a table that
+    # can't be merged stops the upsert here.
+    for table_name in tables:
+        ddl[table_name]["merge"] = create_merge(ddl, table_name)
+        ddl[table_name]["delete"] = create_delete(ddl, table_name, args)
+
+    for table_name in tables:
+        staging = ddl[table_name]["staging"]
+
+        prepare_table(ddl, table_name)
+
+        ddl[table_name]["stage"] = ddl[table_name]["insert"].replace(f"insert into {table_name} ", f'insert into "{staging}" ', 1)
+
+        hana_execute(ddl[table_name]["create"].replace(f"create column table {table_name} ", f'create local temporary column table "{staging}" ', 1))
+
+    success = execute_dml(ddl, "stage", list_data, args.prefix)
+
+    if not success:
+        # A staging table missing rows would make the delete remove the
+        # target rows of the failed batch - don't merge anything.
+        logger.error(f"upsert_list: {args.prefix} - staging failed, no tables were changed.")
+
+        hana_rollback()
+    else:
+        # The deletes of nested tables look at their parent's staging
+        # table - drop the staging tables once every table is done.
+        for table_name in tables:
+            if not hana_execute(ddl[table_name]["merge"]) or \
+               (ddl[table_name]["delete"] is not None and not hana_execute(ddl[table_name]["delete"])):
+                logger.error(f"upsert_list: {table_name} - merge failed, rolling back.")
+
+                hana_rollback()
+
+                success = False
+                break
+
+            hana_commit()
+
+    for table_name in tables:
+        hana_execute(f'drop table "{ddl[table_name]["staging"]}"')
+
+    return success
 
 def write_list(list_data, args):
     logger.setLevel(config.log_level)
 
+    if getattr(args, "hana_mode", "replace") == "upsert":
+        upsert_list(list_data, args)
+        return
+
     ddl = create_ddl(list_data, args)
 
     execute_ddl(ddl, "drop")
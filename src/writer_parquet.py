@@ -0,0 +1,212 @@
+import logging, os, datetime as dt
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import session_config
+import writer_hana, writer_csv
+
+logger = logging.getLogger("writer_parquet")
+
+# Rows written to a file as one row group.
+batch_size = 50000
+
+compression = "zstd"
+
+def get_arrow_type(sql_type):
+    # The column types come from the HANA writer's type inference.
+
+    if sql_type == "BIGINT":
+        return pyarrow.int64()
+
+    if sql_type == "TIMESTAMP":
+        return pyarrow.timestamp("ms")
+
+    return pyarrow.string()   # NVARCHAR and CLOB (complex objects as text)
+
+def convert_value(column_name, column_def, value):
+    # Use the HANA fix-ups, then make sure the value matches the column type.
+
+    value = writer_hana.convert_value(column_name, column_def, value)
+
+    if value is None:
+        return None
+
+    if column_def["type"] == "TIMESTAMP":
+        try:
+            return dt.datetime.fromisoformat(value)
+        except ValueError:
+            logger.debug(f"convert_value: {column_name} - {value} is not a timestamp.")
+            return None
+
+    if column_def["type"] == "BIGINT":
+        # Flags (e.g. enableDataLake) are typed BIGINT like in HANA - store
+        # them as 0/1, Arrow doesn't take a bool for an integer.
+        if isinstance(value, bool):
+            return int(value)
+
+        # The type inference widens a column that holds anything else, so
+        # this is a bug - don't quietly write a NULL.
+        if not isinstance(value, int):
+            raise ValueError(f"{column_name} - {value!r} is not an integer")
+
+        return value
+
+    return value if isinstance(value, str) else str(value)
+
+class ParquetFiles:
+    # The output files of a list and its nested lists.  Rows are buffered
+    # per file and written "batch_size" rows at a time as a row group.
+
+    def __init__(self, ddl, directory):
+        self.ddl = ddl
+        self.directory = directory
+        self.schemas = {}
+        self.writers = {}
+        self.batches = {}
+        self.row_ids = {}
+        self.row_id_columns = {}
+        self.files = {}
+
+    def get_schema(self, table_name, is_child):
+        if table_name not in self.schemas:
+            # Same generated columns as the CSV files.
+            column_names = [ column_def["name"] for column_def in self.ddl[table_name]["columns"].values() ]
+
+            self.row_id_columns[table_name] = writer_csv.get_row_id_columns(table_name, column_names)
+
+            row_id_name, parent_row_id_name = self.row_id_columns[table_name]
+
+            fields = [ (row_id_name, pyarrow.int64()) ]
+
+            if is_child:
+                fields.append((parent_row_id_name, pyarrow.int64()))
+
+            for column_def in self.ddl[table_name]["columns"].values():
+                fields.append((column_def["name"], get_arrow_type(column_def["type"])))
+
+            self.schemas[table_name] = pyarrow.schema(fields)
+            self.batches[table_name] = { field.name : [] for field in self.schemas[table_name] }
+            self.row_ids[table_name] = 0
+
+        return self.schemas[table_name]
+
+    def add_row(self, table_name, values):
+        batch = self.batches[table_name]
+
+        for name in batch:
+            batch[name].append(values.get(name))
+
+        if len(batch[self.row_id_columns[table_name][0]]) >= batch_size:
+            self.flush(table_name)
+
+    def flush(self, table_name):
+        batch = self.batches[table_name]
+
+        if len(batch[self.row_id_columns[table_name][0]]) == 0:
+            return
+
+        schema = self.schemas[table_name]
+
+        if table_name not in self.writers:
+            parquet_file = table_name + ".parquet"
+
+            if self.directory is not None:
+                parquet_file = os.path.join(self.directory, parquet_file)
+
+            # Written to a temporary file - the real file only appears once
+            # the whole list was written (see close).
+            self.files[table_name] = parquet_file
+
+            self.writers[table_name] = pyarrow.parquet.ParquetWriter(parquet_file + ".tmp", schema, compression=compression)
+
+        self.writers[table_name].write_table(pyarrow.Table.from_pydict(batch, schema=schema))
+
+        self.batches[table_name] = { name : [] for name in batch }
+
+    def close(self):
+        for table_name in self.batches:
+            self.flush(table_name)
+
+        for table_name in self.writers:
+            self.writers[table_name].close()
+
+        for table_name in self.files:
+            os.replace(self.files[table_name] + ".tmp", self.files[table_name])
+
+    def discard(self):
+        # Something went wrong - don't leave partial files behind.
+
+        for table_name in self.writers:
+            try:
+                self.writers[table_name].close()
+            except Exception:
+                pass
+
+        for table_name in self.files:
+            if os.path.exists(self.files[table_name] + ".tmp"):
+                os.remove(self.files[table_name] + ".tmp")
+
+def write_rows(files, list_data, table_name, parent_row_id=None):
+    if table_name not in files.ddl or len(files.ddl[table_name]["columns"]) == 0:
+        return
+
+    columns = files.ddl[table_name]["columns"]
+
+    files.get_schema(table_name, parent_row_id is not None)
+
+    for row in list_data:
+        if not isinstance(row, dict):
+            return
+
+        files.row_ids[table_name] += 1
+        row_id = files.row_ids[table_name]
+
+        row_id_name, parent_row_id_name = files.row_id_columns[table_name]
+
+        values = { row_id_name : row_id, parent_row_id_name : parent_row_id }
+
+        for column_name in columns:
+            column_def = columns[column_name]
+            value = row.get(column_name)
+
+            values[column_def["name"]] = convert_value(column_name, column_def, value)
+
+            # Nested lists go to a sibling file pointing back to this row.
+            if isinstance(value, list):
+                write_rows(files, value, (table_name + "_" + column_name).upper(), row_id)
+
+        files.add_row(table_name, values)
+
+def write_list(list_data, args):
+    logger.setLevel(session_config.log_level)
+
+    if pyarrow is None:
+        logger.error("write_list: the pyarrow package is required for parquet output - install pyarrow.")
+        return
+
+    # Same tables and column types as the HANA output - every nested list
+    # gets its own file.
+    ddl = {}
+
+    writer_hana.recurse_columns(ddl, list_data, args.prefix.upper())
+
+    directory = getattr(args, "directory", None)
+
+    if directory is not None and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    files = ParquetFiles(ddl, directory)
+
+    try:
+        write_rows(files, list_data, args.prefix.upper())
+
+        files.close()
+    except Exception as e:
+        logger.error(f"write_list: {args.prefix} - parquet output failed - {e}")
+
+        files.discard()
+        raise
@@ -0,0 +1,97 @@
+import logging, os, sqlite3
+
+import session_config
+import writer_hana
+
+logger = logging.getLogger("writer_sqlite")
+
+# All lists go into the same database file in --directory (or the
+# current directory) so they can be queried together.
+database_name = "provisioner.db"
+
+# The HANA DDL generation with SQLite statements - SQLite accepts the
+# HANA column types (BIGINT, TIMESTAMP, NVARCHAR, CLOB) as they are.
+sql_templates = { "drop"   : 'drop table if exists "{}"',
+                  "create" : 'create table "{}" (',
+                  "insert" : 'insert into "{}" values (' }
+
+def sqlite_connect(directory):
+    database_file = database_name
+
+    if directory is not None:
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        database_file = os.path.join(directory, database_name)
+
+    # Transactions are started and committed explicitly - one per table.
+    conn = sqlite3.connect(database_file, isolation_level=None)
+
+    # WAL lets analysts keep querying the database while it is loaded.
+    conn.execute("pragma journal_mode=wal")
+    conn.execute("pragma synchronous=normal")
+
+    return conn
+
+def load_table(conn, ddl, table_name, list_data, args):
+    # Replace the table and its rows in a single transaction - readers
+    # see either the old table or the new one.  The rows are converted
+    # the same way as for HANA and inserted "batch_size" rows at a time,
+    # so only one batch is held in memory.
+
+    table_def = ddl[table_name]
+    count = 0
+
+    def flush(flush_table, rows):
+        nonlocal count
+
+        conn.executemany(table_def["insert"], rows)
+        count += len(rows)
+
+    try:
+        conn.execute("begin")
+
+        conn.execute(table_def["drop"])
+        conn.execute(table_def["create"])
+
+        batches = {}
+
+        writer_hana.collect_rows(ddl, list_data, args.prefix.upper(), batches, flush, only=table_name)
+
+        # Whatever is left over is the last, partial, batch.
+        if len(batches.get(table_name, [])) > 0:
+            flush(table_name, batches[table_name])
+
+        # Rows of nested lists are indexed on the key of their parent row
+        # first (PARENT_ columns), then on their own key.
+        index_columns = writer_hana.get_index_columns(ddl, table_name)
+
+        if len(index_columns) > 0:
+            conn.execute(f'create index "{table_name}_KEY" on "{table_name}" (' + ", ".join(f'"{name}"' for name in index_columns) + ")")
+
+        conn.execute("commit")
+    except sqlite3.Error as e:
+        logger.error(f"load_table: {table_name} - {e}")
+
+        conn.execute("rollback")
+        return
+
+    logger.info(f"load_table: {count} row(s) loaded into {table_name}")
+
+def write_list(list_data, args):
+    logger.setLevel(session_config.log_level)
+
+    ddl = writer_hana.create_ddl(list_data, args, sql_templates)
+
+    conn = sqlite_connect(getattr(args, "directory", None))
+
+    try:
+        # One table at a time, each in its own transaction.
+        for table_name in ddl:
+            # Tables without columns (all values were empty) are skipped.
+            if "create" not in ddl[table_name]:
+                continue
+
+            load_table(conn, ddl, table_name, list_data, args)
+    finally:
+        conn.close()
@@ -0,0 +1,108 @@
+import os, sys, csv, time, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import session_config, bulk
+
+class FakeSession:
+    # Each row "request" leaves the status of the row's space behind.
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.status = None
+
+    def ensure_pool(self, workers):
+        pass
+
+    def iter_concurrent(self, function, items, workers=1):
+        for item in items:
+            yield function(item)
+
+    def clear_status(self):
+        self.status = None
+
+    def get_status(self):
+        return self.status
+
+def make_rows(*space_ids):
+    return [ argparse.Namespace(line=line, spaceID=space_id) for line, space_id in enumerate(space_ids, start=2) ]
+
+def test_outcome_per_row(tmp_path, monkeypatch):
+    dwc = FakeSession({ "SALES" : 201, "HR" : 409 })
+
+    monkeypatch.setattr(session_config, "dwc", dwc, raising=False)
+
+    def action(row):
+        dwc.status = dwc.statuses[row.spaceID]
+        return dwc.status < 400
+
+    results_file = os.path.join(tmp_path, "results.csv")
+
+    failed = bulk.run(make_rows("SALES", "HR"), action, "spaces bulk create", results_file=results_file)
+
+    assert failed == 1
+
+    with open(results_file, newline="") as results:
+        rows = [ row[:4] for row in csv.reader(results) ]
+
+    assert rows == [ [ "row", "space_id", "outcome", "http_status" ], [ "2", "SALES", "ok", "201" ], [ "3", "HR", "failed", "409" ] ]
+
+def test_failing_action_is_a_failed_row(monkeypatch):
+    monkeypatch.setattr(session_config, "dwc", FakeSession({}), raising=False)
+
+    def action(row):
+        raise RuntimeError("space definition not valid")
+
+    assert bulk.run(make_rows("SALES"), action, "spaces bulk create") == 1
+
+def test_throttle_spreads_starts():
+    throttle = bulk.Throttle(rate=20)
+
+    started = time.perf_counter()
+
+    for row in range(5):
+        throttle.wait()
+
+    # The first row starts right away, the next four 1/20s apart.
+    assert time.perf_counter() - started >= 0.19
+
+def write_csv(tmp_path, text):
+    filename = os.path.join(tmp_path, "spaces.csv")
+
+    with open(filename, "w", encoding="utf-8", newline="") as csv_file:
+        csv_file.write(text)
+
+    return filename
+
+def test_heading_maps_columns(tmp_path):
+    # Excel's byte order mark, columns in any order, users from the first "user" column on.
+    filename = write_csv(tmp_path, "﻿Label,Space_ID,Template,User Name,User Name\r\n"
+                                   "Sales,SALES,TEMPLATE,user1@company.com,USER2\r\n")
+
+    rows = list(bulk.read_space_rows(filename))
+
+    assert [ (row.line, row.spaceID, row.business, row.template, row.users) for row in rows ] == \
+           [ (2, "SALES", "Sales", "TEMPLATE", [ "user1@company.com", "USER2" ]) ]
+
+def test_positional_columns_without_heading(tmp_path):
+    filename = write_csv(tmp_path, "﻿SALES,Sales,2,1,,true,USER1\r\n")
+
+    rows = list(bulk.read_space_rows(filename, skip=0))
+
+    assert [ (row.spaceID, row.business, row.disk, row.memory, row.template, row.force, row.users) for row in rows ] == \
+           [ ("SALES", "Sales", "2", "1", None, True, [ "USER1" ]) ]
+
+def test_rows_are_numbered_by_record(tmp_path):
+    # A quoted label spans two lines - still one record.  Comments, blank
+    # rows and rows without a space id are counted but not handed out.
+    filename = write_csv(tmp_path, "Space Id,Label\r\n"
+                                   "SALES,\"Sales\r\nand Marketing\"\r\n"
+                                   "# HR,Human Resources\r\n"
+                                   ",No space\r\n"
+                                   "\r\n"
+                                   "IT,Information\r\n")
+
+    rows = list(bulk.read_space_rows(filename))
+
+    assert [ (row.line, row.spaceID) for row in rows ] == [ (2, "SALES"), (6, "IT") ]
+    assert bulk.count_rows(filename) == 2
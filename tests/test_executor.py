@@ -0,0 +1,77 @@
+import os, sys, io, threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import session_config, cmdparse, executor
+
+def parse_all(*lines):
+    return [ cmdparse.parse(line.split(" ")) for line in lines ]
+
+def get_dependencies(commands):
+    resources = [ executor.get_resources(command_args) for command_args in commands ]
+
+    return [ [ earlier for earlier in range(index) if executor.is_dependent(resources[index], resources[earlier]) ]
+             for index in range(len(commands)) ]
+
+def test_independent_spaces_run_together():
+    commands = parse_all("spaces create SALES",
+                         "spaces create HR",
+                         "spaces member add SALES USER1",
+                         "spaces member list HR")
+
+    assert get_dependencies(commands) == [ [], [], [ 0 ], [ 1 ] ]
+
+def test_connection_create_target_is_a_pattern():
+    # "SAL" also matches SALES - the create has to wait for it, and any
+    # later change to a space has to wait for the create.
+    commands = parse_all("spaces create SALES",
+                         "connections create --targetSpace SAL --filename connection.json",
+                         "connections delete --targetSpace HR --connectionName CONN")
+
+    assert get_dependencies(commands) == [ [], [ 0 ], [ 1 ] ]
+
+def test_unknown_command_waits_for_everything():
+    commands = parse_all("spaces create SALES", "users list")
+
+    commands[1].command = "something"
+
+    assert get_dependencies(commands) == [ [], [ 0 ] ]
+
+class FakeSession:
+    def clear_memo(self):
+        pass
+
+    def ensure_pool(self, workers):
+        pass
+
+def test_output_after_failure(monkeypatch):
+    # SALES fails while HR is still running - the member change waits for
+    # SALES and never starts, HR's output still appears.
+
+    commands = parse_all("spaces create SALES",
+                         "spaces member add SALES USER1",
+                         "spaces create HR")
+
+    hr_started = threading.Event()
+
+    def run_journaled(command_args, journal=None):
+        print(f"running {command_args.spaceID}")
+
+        if command_args.spaceID == "SALES":
+            hr_started.wait(5)
+            raise RuntimeError("create failed")
+
+        hr_started.set()
+
+    stdout = io.StringIO()
+
+    monkeypatch.setattr(session_config, "dwc", FakeSession(), raising=False)
+    monkeypatch.setattr(executor, "run_journaled", run_journaled)
+    monkeypatch.setattr(sys, "stdout", stdout)
+
+    with pytest.raises(RuntimeError):
+        executor.run_parallel(commands, 2)
+
+    assert stdout.getvalue() == "running SALES\nrunning HR\n"
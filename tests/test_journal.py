@@ -0,0 +1,79 @@
+import os, sys, json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import session_config, cmdparse, executor, journal
+
+class FakeSession:
+    def __init__(self):
+        self.status = None
+
+    def clear_memo(self):
+        pass
+
+    def clear_status(self):
+        self.status = None
+
+    def get_status(self):
+        return self.status
+
+def make_commands(*lines):
+    commands = []
+
+    for line, text in enumerate(lines, start=1):
+        command_args = cmdparse.parse(text.split(" "))
+        command_args.journal_key = f"{line}:{text}"
+
+        commands.append(command_args)
+
+    return commands
+
+def test_resume_skips_finished_commands(tmp_path, monkeypatch):
+    dwc = FakeSession()
+    ran = []
+
+    def run_command(command_args):
+        ran.append(command_args.spaceID)
+
+        # HR fails with an HTTP error, IT kills the run.
+        if command_args.spaceID == "HR":
+            dwc.status = 500
+
+        if command_args.spaceID == "IT" and len(ran) == 3:
+            raise KeyboardInterrupt()
+
+    monkeypatch.setattr(session_config, "dwc", dwc, raising=False)
+    monkeypatch.setattr(executor, "run_command", run_command)
+
+    commands = make_commands("spaces create SALES", "spaces create HR", "spaces create IT", "spaces create FINANCE")
+    filename = os.path.join(tmp_path, "run.journal")
+
+    script_journal = journal.Journal(filename)
+
+    with pytest.raises(KeyboardInterrupt):
+        executor.run_commands(commands, journal=script_journal)
+
+    script_journal.close()
+
+    # The process died part way through writing an entry.
+    with open(filename, "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"key": "4:spaces create FINANCE", "sta')
+
+    with open(filename, encoding="utf-8") as journal_file:
+        states = [ json.loads(line)["state"] for line in journal_file.readlines()[:-1] ]
+
+    # IT was still running when the run died.
+    assert states == [ "started", "ok", "started", "failed", "started" ]
+
+    ran.clear()
+
+    script_journal = journal.Journal(filename, resume=True)
+
+    executor.run_commands(commands, journal=script_journal)
+
+    script_journal.close()
+
+    # Only SALES finished - everything else runs again.
+    assert ran == [ "HR", "IT", "FINANCE" ]
@@ -0,0 +1,30 @@
+import os, sys, time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import passcode_pool
+
+def test_prefetched_passcode():
+    pool = passcode_pool.PasscodePool(lambda: "PASSCODE")
+
+    assert pool.get(timeout=5) == "PASSCODE"
+
+def test_failing_refill_fails_fast():
+    def fetch():
+        raise RuntimeError("tenant unavailable")
+
+    pool = passcode_pool.PasscodePool(fetch)
+
+    started = time.time()
+
+    with pytest.raises(passcode_pool.PasscodeError, match="tenant unavailable"):
+        pool.get(timeout=60)
+
+    # The first call may wait for the refill thread's first attempt,
+    # the next ones don't wait at all.
+    with pytest.raises(passcode_pool.PasscodeError):
+        pool.get(timeout=60)
+
+    assert time.time() - started < 5
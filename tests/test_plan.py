@@ -0,0 +1,55 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import session_config, plan
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+class FakeSession:
+    # Creating a space fails - everything else works.
+
+    def __init__(self):
+        self.posted = []
+
+    def ensure_pool(self, workers):
+        pass
+
+    def map_concurrent(self, function, items, workers=None):
+        return [ function(item) for item in items ]
+
+    def put_space(self, definition):
+        return Response(500)
+
+    def get_spaces(self, force=False):
+        return []
+
+    def get_space_guid(self, space_id):
+        return None
+
+    def get_url(self, url_name):
+        return url_name + "/{}"
+
+    def post(self, url, data=None, url_name="post"):
+        self.posted.append(url)
+        return Response(200)
+
+    def invalidate_cache(self, *url_names):
+        pass
+
+def test_failed_create_skips_connections_and_shares(monkeypatch):
+    dwc = FakeSession()
+
+    monkeypatch.setattr(session_config, "dwc", dwc, raising=False)
+
+    changes = [ { "action"             : "create",
+                  "space"              : "SALES",
+                  "definition"         : { "SALES" : {} },
+                  "connections_add"    : [ ("HANA", { "name" : "HANA" }) ],
+                  "connections_delete" : [],
+                  "shares"             : [ { "objectNames" : [ "VIEW1" ], "shareSpaceNames" : [ "HR" ], "unshareSpaceNames" : [] } ] } ]
+
+    assert plan.apply_plan(changes) == 1
+    assert dwc.posted == []
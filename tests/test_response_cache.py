@@ -0,0 +1,27 @@
+import os, sys, stat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import response_cache
+
+def test_cache_file_is_owner_only(tmp_path):
+    filename = os.path.join(tmp_path, "working", "response_cache.db")
+
+    cache = response_cache.ResponseCache("https://tenant.example.com", "user", filename=filename)
+
+    cache.put("users", "https://tenant.example.com/users", "[]")
+
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o600
+    assert cache.get("users", "https://tenant.example.com/users") == "[]"
+
+def test_existing_cache_file_is_made_owner_only(tmp_path):
+    filename = os.path.join(tmp_path, "response_cache.db")
+
+    with open(filename, "w"):
+        pass
+
+    os.chmod(filename, 0o644)
+
+    response_cache.ResponseCache("https://tenant.example.com", "user", filename=filename)
+
+    assert stat.S_IMODE(os.stat(filename).st_mode) == 0o600
@@ -0,0 +1,60 @@
+import os, sys, threading
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("bs4")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import session
+
+def test_worker_failure_reaches_the_caller():
+    dwc = session.DWCSession(url="https://tenant.example.com", user="user", password="password")
+
+    def request(status):
+        # Stands in for a request made on a worker thread.
+        dwc.local.last_status = status
+
+        if status >= 400 and getattr(dwc.local, "error_status", None) is None:
+            dwc.local.error_status = status
+
+        return status
+
+    dwc.clear_status()
+
+    assert dwc.map_concurrent(request, [ 200, 500, 200 ], workers=2) == [ 200, 500, 200 ]
+    assert dwc.get_status() == 500
+
+def test_pool_only_grows():
+    dwc = session.DWCSession(url="https://tenant.example.com", user="user", password="password")
+
+    pool_manager = dwc.transport.poolmanager
+    cleared = []
+
+    # The old pool is left to the requests still using it.
+    pool_manager.clear = lambda: cleared.append(True)
+
+    dwc.ensure_pool(20)
+    dwc.ensure_pool(5)
+
+    assert dwc.pool_size == 20
+    assert dwc.transport.poolmanager is not pool_manager
+    assert cleared == []
+
+def test_spaces_and_users_load_together(monkeypatch):
+    dwc = session.DWCSession(url="https://tenant.example.com", user="user", password="password")
+
+    both_loading = threading.Barrier(2, timeout=5)
+
+    def get_json(url_name, values=None):
+        # Each list only comes back once the other one is being read too.
+        if url_name in [ "spaces", "users" ]:
+            both_loading.wait()
+
+        return { "results" : [] } if url_name == "spaces" else {}
+
+    monkeypatch.setattr(dwc, "get_json", get_json)
+    monkeypatch.setattr(dwc, "get_tenant_id", lambda: "tenant")
+
+    dwc.map_concurrent(lambda load: load(), [ lambda: dwc.get_spaces(), dwc.get_users ], 2)
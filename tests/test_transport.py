@@ -0,0 +1,74 @@
+import os, sys, io
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import transport
+
+def make_response(status_code, headers={}):
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(b"")
+    response.headers.update(headers)
+
+    return response
+
+@pytest.fixture
+def tenant(monkeypatch):
+    # The responses the tenant sends back, in order, and the waits between them.
+    responses = []
+    sleeps = []
+
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", lambda self, request, **kwargs: responses.pop(0))
+    monkeypatch.setattr(transport.time, "sleep", sleeps.append)
+
+    return responses, sleeps
+
+def send(adapter, method, url_name="spaces"):
+    adapter.set_endpoint(url_name)
+
+    return adapter.send(requests.Request(method, "https://tenant.example.com/api/spaces").prepare())
+
+def test_retry_after_seconds(tenant):
+    responses, sleeps = tenant
+    responses.extend([ make_response(429, { "Retry-After" : "7" }), make_response(503, { "Retry-After" : "2" }), make_response(200) ])
+
+    adapter = transport.DWCTransport()
+
+    assert send(adapter, "GET").status_code == 200
+    assert sleeps == [ 7, 2 ]
+    assert adapter.get_retry_counts() == { "spaces" : 2 }
+
+def test_retry_after_is_capped(tenant):
+    responses, sleeps = tenant
+    responses.extend([ make_response(429, { "Retry-After" : "3600" }), make_response(200) ])
+
+    send(transport.DWCTransport(retry_after_max=300), "GET")
+
+    assert sleeps == [ 300 ]
+
+def test_retries_run_out(tenant):
+    responses, sleeps = tenant
+    responses.extend([ make_response(503) for attempt in range(4) ])
+
+    adapter = transport.DWCTransport(retries=3)
+
+    assert send(adapter, "GET").status_code == 503
+    assert len(sleeps) == 3
+    assert adapter.get_retry_counts() == { "spaces" : 3 }
+
+def test_post_is_only_retried_when_refused(tenant):
+    responses, sleeps = tenant
+    responses.extend([ make_response(503), make_response(429, { "Retry-After" : "1" }), make_response(201) ])
+
+    adapter = transport.DWCTransport()
+
+    # A 503 may come after the tenant processed the POST - not repeated.
+    assert send(adapter, "POST", "space_create").status_code == 503
+
+    # A 429 was refused outright - safe to send again.
+    assert send(adapter, "POST", "space_create").status_code == 201
+    assert adapter.get_retry_counts() == { "space_create" : 1 }
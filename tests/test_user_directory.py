@@ -0,0 +1,38 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import user_directory
+
+users = [ { "userName" : "USER1", "parameters" : { "EMAIL" : "first.user@company.com" }, "metadata" : { "groups" : [ "A" ] } },
+          { "userName" : "USER2", "parameters" : { "EMAIL" : "second.user@company.com" }, "metadata" : {} } ]
+
+def test_users_are_read_only_all_the_way_down():
+    directory = user_directory.UserDirectory(users)
+
+    user = directory.find("user1")
+
+    with pytest.raises(TypeError):
+        user["parameters"]["EMAIL"] = "changed@company.com"
+
+    with pytest.raises(AttributeError):
+        user["metadata"]["groups"].append("B")
+
+def test_thaw_gives_a_private_copy():
+    directory = user_directory.UserDirectory(users)
+
+    user = user_directory.thaw(directory.find("USER1"))
+    user["parameters"]["EMAIL"] = "changed@company.com"
+    user["metadata"]["groups"].append("B")
+
+    assert directory.find("USER1")["parameters"]["EMAIL"] == "first.user@company.com"
+    assert directory.find("USER1")["metadata"]["groups"] == ("A",)
+
+def test_lookups():
+    directory = user_directory.UserDirectory(users)
+
+    assert directory.find("SECOND.USER@COMPANY.COM")["userName"] == "USER2"
+    assert [ user["userName"] for user in directory.search("user") ] == [ "USER1", "USER2" ]
+    assert [ user["userName"] for user in directory.search("First") ] == [ "USER1" ]
@@ -0,0 +1,29 @@
+import os, sys, csv, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import writer_csv
+
+def read_csv(tmp_path, name):
+    with open(os.path.join(tmp_path, name + ".csv"), newline="", encoding="utf-8") as csv_file:
+        return list(csv.DictReader(csv_file))
+
+def test_child_rows_point_to_parent(tmp_path):
+    spaces = [ { "name" : "SALES", "members" : [ { "name" : "USER1" }, { "name" : "USER2" } ] },
+               { "name" : "HR",    "members" : [ { "name" : "USER3", "type" : "user" } ] } ]
+
+    writer_csv.write_list(spaces, argparse.Namespace(prefix="DWC_SPACES", directory=str(tmp_path)))
+
+    members = read_csv(tmp_path, "DWC_SPACES_MEMBERS")
+
+    assert [ (row["ROW_ID"], row["PARENT_ROW_ID"], row["name"], row["type"]) for row in members ] == \
+           [ ("1", "1", "USER1", ""), ("2", "1", "USER2", ""), ("3", "2", "USER3", "user") ]
+
+def test_row_id_attribute_is_kept(tmp_path):
+    rows = [ { "ROW_ID" : "A-1", "name" : "SALES", "members" : [ { "PARENT_ROW_ID" : "X", "name" : "USER1" } ] } ]
+
+    writer_csv.write_list(rows, argparse.Namespace(prefix="DWC_ROWS", directory=str(tmp_path)))
+
+    assert read_csv(tmp_path, "DWC_ROWS") == [ { "_ROW_ID" : "1", "ROW_ID" : "A-1", "name" : "SALES", "members" : "[{'PARENT_ROW_ID': 'X', 'name': 'USER1'}]" } ]
+
+    assert read_csv(tmp_path, "DWC_ROWS_MEMBERS") == [ { "ROW_ID" : "1", "_PARENT_ROW_ID" : "1", "PARENT_ROW_ID" : "X", "name" : "USER1" } ]
@@ -0,0 +1,115 @@
+import os, sys, argparse
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import writer_hana
+
+class FakeConnection:
+    # Records the statements sent to HANA - executemany fails for the
+    # statements containing "fail_on".
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql_statement, bind_values=[]):
+        self.statements.append(sql_statement)
+
+    def executemany(self, sql_statement, rows):
+        if self.fail_on is not None and self.fail_on in sql_statement:
+            raise RuntimeError("batch failed")
+
+        self.statements.append(sql_statement)
+
+    def fetchall(self):
+        return []   # No existing tables.
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+@pytest.fixture
+def hana(monkeypatch):
+    def connect(fail_on=None):
+        fake = FakeConnection(fail_on)
+
+        monkeypatch.setattr(writer_hana, "conn", fake)
+        monkeypatch.setattr(writer_hana, "cursor", fake)
+
+        return fake
+
+    return connect
+
+spaces = [ { "name" : "SALES", "priority" : 5, "members" : [ { "name" : "USER1", "type" : "user" } ] },
+           { "name" : "HR",    "priority" : 3, "members" : [ { "name" : "USER1", "type" : "user" } ] } ]
+
+def spaces_args(**selection):
+    return argparse.Namespace(prefix="DWC_SPACES", command="spaces", spaceID=selection.get("spaceID"), hana_mode="upsert")
+
+def test_merge_matches_on_key():
+    ddl = writer_hana.create_ddl(spaces, spaces_args())
+
+    ddl["DWC_SPACES"]["staging"] = "#DWC_SPACES"
+
+    merge_sql = writer_hana.create_merge(ddl, "DWC_SPACES")
+
+    assert merge_sql.startswith('merge into DWC_SPACES T using "#DWC_SPACES" S on (T."name" = S."name"')
+    assert 'T."priority" = S."priority"' in merge_sql
+
+def test_nested_rows_carry_parent_key():
+    ddl = writer_hana.create_ddl(spaces, spaces_args())
+
+    assert [ column_def["name"] for column_def in writer_hana.get_column_defs(ddl, "DWC_SPACES_MEMBERS") ][:1] == [ "PARENT_name" ]
+
+def test_delete_scope():
+    ddl = writer_hana.create_ddl(spaces, spaces_args())
+
+    for table_name in ddl:
+        ddl[table_name]["staging"] = "#" + table_name
+
+    # A full list removes vanished rows everywhere.
+    assert "and exists" not in writer_hana.create_delete(ddl, "DWC_SPACES", spaces_args())
+
+    # Listing some spaces only removes the members of those spaces.
+    delete_sql = writer_hana.create_delete(ddl, "DWC_SPACES_MEMBERS", spaces_args(spaceID="SALES"))
+
+    assert 'and exists (select 1 from "#DWC_SPACES" P where (DWC_SPACES_MEMBERS."PARENT_name" = P."name"' in delete_sql
+
+    # ...and nothing at all from the spaces table itself.
+    assert writer_hana.create_delete(ddl, "DWC_SPACES", spaces_args(spaceID="SALES")) is None
+
+def test_upsert_merges_and_deletes(hana):
+    fake = hana()
+
+    assert writer_hana.upsert_list(spaces, spaces_args())
+
+    assert any(statement.startswith("merge into DWC_SPACES ") for statement in fake.statements)
+    assert any(statement.startswith("delete from DWC_SPACES_MEMBERS ") for statement in fake.statements)
+    assert fake.statements[-1] == 'drop table "#DWC_SPACES_MEMBERS"'
+
+def test_failed_staging_batch_changes_nothing(hana):
+    fake = hana(fail_on='"#DWC_SPACES_MEMBERS"')
+
+    assert not writer_hana.upsert_list(spaces, spaces_args())
+
+    assert not any(statement.startswith(("merge", "delete")) for statement in fake.statements)
+    assert fake.rollbacks > 0
+
+    # The staging tables are still cleaned up.
+    assert 'drop table "#DWC_SPACES"' in fake.statements
+    assert 'drop table "#DWC_SPACES_MEMBERS"' in fake.statements
+
+def test_no_match_columns():
+    ddl = writer_hana.create_ddl([ { "tags" : [ 1, 2 ] } ], argparse.Namespace(prefix="DWC_TAGS", command="tags"))
+
+    with pytest.raises(ValueError):
+        writer_hana.get_match_columns(ddl, "DWC_TAGS")
@@ -0,0 +1,69 @@
+import os, sys, argparse
+
+import pytest
+
+pyarrow = pytest.importorskip("pyarrow")
+
+import pyarrow.parquet
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import writer_parquet
+
+def test_boolean_space_attributes(tmp_path):
+    spaces = [ { "name" : "SALES", "enableDataLake" : True,  "allowConsumption" : False, "priority" : 5,
+                 "members" : [ { "name" : "USER1", "type" : "user" } ] },
+               { "name" : "HR",    "enableDataLake" : False, "allowConsumption" : True,  "priority" : 3,
+                 "members" : [] } ]
+
+    writer_parquet.write_list(spaces, argparse.Namespace(prefix="DWC_SPACES", directory=str(tmp_path)))
+
+    rows = pyarrow.parquet.read_table(os.path.join(tmp_path, "DWC_SPACES.parquet")).to_pylist()
+
+    assert [ (row["name"], row["enableDataLake"], row["allowConsumption"]) for row in rows ] == [ ("SALES", 1, 0), ("HR", 0, 1) ]
+
+    members = pyarrow.parquet.read_table(os.path.join(tmp_path, "DWC_SPACES_MEMBERS.parquet")).to_pylist()
+
+    assert [ (row["PARENT_ROW_ID"], row["name"]) for row in members ] == [ (1, "USER1") ]
+
+def test_failed_write_leaves_no_files(tmp_path, monkeypatch):
+    convert_value = writer_parquet.convert_value
+
+    def fail_on_second_space(column_name, column_def, value):
+        if value == "HR":
+            raise ValueError("conversion failed")
+
+        return convert_value(column_name, column_def, value)
+
+    # The first space is already written when the second one fails.
+    monkeypatch.setattr(writer_parquet, "batch_size", 1)
+    monkeypatch.setattr(writer_parquet, "convert_value", fail_on_second_space)
+
+    with pytest.raises(ValueError):
+        writer_parquet.write_list([ { "name" : "SALES" }, { "name" : "HR" } ], argparse.Namespace(prefix="DWC_SPACES", directory=str(tmp_path)))
+
+    assert os.listdir(tmp_path) == []
+
+def test_integer_column_with_objects(tmp_path):
+    # The first rows make "quota" look like an integer column.
+    spaces = [ { "name" : "SALES", "quota" : 5 },
+               { "name" : "HR",    "quota" : { "disk" : 2 } },
+               { "name" : "IT",    "quota" : [ { "disk" : 3 } ] } ]
+
+    writer_parquet.write_list(spaces, argparse.Namespace(prefix="DWC_SPACES", directory=str(tmp_path)))
+
+    table = pyarrow.parquet.read_table(os.path.join(tmp_path, "DWC_SPACES.parquet"))
+
+    assert table.schema.field("quota").type == pyarrow.string()
+    assert table.column("quota").to_pylist() == [ "5", "{'disk': 2}", "[{'disk': 3}]" ]
+
+    quotas = pyarrow.parquet.read_table(os.path.join(tmp_path, "DWC_SPACES_QUOTA.parquet")).to_pylist()
+
+    assert [ (row["PARENT_ROW_ID"], row["disk"]) for row in quotas ] == [ (3, 3) ]
+
+def test_row_id_attribute_is_kept(tmp_path):
+    writer_parquet.write_list([ { "ROW_ID" : "A-1", "name" : "SALES" } ], argparse.Namespace(prefix="DWC_ROWS", directory=str(tmp_path)))
+
+    rows = pyarrow.parquet.read_table(os.path.join(tmp_path, "DWC_ROWS.parquet")).to_pylist()
+
+    assert rows == [ { "_ROW_ID" : 1, "ROW_ID" : "A-1", "name" : "SALES" } ]